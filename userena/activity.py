@@ -0,0 +1,115 @@
+"""
+Buffered tracking of user activity.
+
+Writing ``UserenaSignup.last_active`` on every request would add a write to
+every page view. Instead the activity is appended to a log in the cache, at
+most once every ``USERENA_ACTIVITY_INTERVAL`` seconds per user, and the
+``flush_activity`` command writes the log to the database in bulk.
+
+The log needs a cache that is shared between processes, like memcached, to
+be useful in production.
+
+"""
+from django.core.cache import cache
+
+import datetime
+
+try:
+    from django.utils.timezone import now
+except ImportError:
+    now = datetime.datetime.now
+
+from userena import settings as userena_settings
+from userena.presence import mark_online
+
+ACTIVITY_USER_KEY = 'userena_activity_user_%s'
+ACTIVITY_HEAD_KEY = 'userena_activity_head'
+ACTIVITY_TAIL_KEY = 'userena_activity_tail'
+ACTIVITY_SLOT_KEY = 'userena_activity_slot_%s'
+
+# The log counters should outlive the slots they point to.
+COUNTER_TIMEOUT = 60 * 60 * 24 * 30
+
+def record_activity(user, when=None):
+    """
+    Records that a user was active.
+
+    Only the first call within ``USERENA_ACTIVITY_INTERVAL`` seconds is
+    appended to the activity log, all others are ignored.
+
+    :param user:
+        The :class:`User` that was active.
+
+    :param when:
+        Optional ``datetime`` of the activity. Defaults to now.
+
+    :return:
+        Boolean that is ``True`` when the activity is appended to the log.
+
+    """
+    if when is None: when = now()
+
+    # ``add`` only succeeds if the key isn't set yet, which makes it the one
+    # atomic check that coalesces all requests inside the interval.
+    if not cache.add(ACTIVITY_USER_KEY % user.pk, when,
+                     userena_settings.USERENA_ACTIVITY_INTERVAL):
+        return False
+
+    try:
+        slot = cache.incr(ACTIVITY_HEAD_KEY)
+    except ValueError:
+        cache.add(ACTIVITY_HEAD_KEY, 0, COUNTER_TIMEOUT)
+        slot = cache.incr(ACTIVITY_HEAD_KEY)
+
+    cache.set(ACTIVITY_SLOT_KEY % slot, (user.pk, when),
+              userena_settings.USERENA_ACTIVITY_BUFFER_TIMEOUT)
+
+    mark_online(user, when)
+    return True
+
+def truncate_activity(when):
+    """
+    Rounds a ``datetime`` down to the start of its activity interval.
+
+    Activity is only recorded once per interval, so ``last_active`` can't be
+    more precise than that. Rounding lets users that were active in the same
+    interval share one ``UPDATE``.
+
+    """
+    interval = userena_settings.USERENA_ACTIVITY_INTERVAL
+    seconds = when.hour * 3600 + when.minute * 60 + when.second
+    return when - datetime.timedelta(seconds=seconds % interval,
+                                     microseconds=when.microsecond)
+
+def drain_activity(batch_size=500):
+    """
+    Removes all entries from the activity log.
+
+    :param batch_size:
+        Integer defining the amount of log entries that are fetched from the
+        cache at once.
+
+    :return:
+        Dictionary with the user id as key and the latest truncated
+        ``datetime`` that the user was active as value.
+
+    """
+    head = cache.get(ACTIVITY_HEAD_KEY, 0)
+    tail = cache.get(ACTIVITY_TAIL_KEY, 0)
+
+    # The head is restarted when the counter was evicted from the cache.
+    if tail > head: tail = 0
+
+    activity = dict()
+    while tail < head:
+        upper = min(tail + batch_size, head)
+        keys = [ACTIVITY_SLOT_KEY % i for i in xrange(tail + 1, upper + 1)]
+        for user_id, when in cache.get_many(keys).values():
+            when = truncate_activity(when)
+            if user_id not in activity or when > activity[user_id]:
+                activity[user_id] = when
+        cache.delete_many(keys)
+        tail = upper
+        cache.set(ACTIVITY_TAIL_KEY, tail, COUNTER_TIMEOUT)
+
+    return activity
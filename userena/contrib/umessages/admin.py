@@ -3,7 +3,9 @@ from django.utils.translation import gettext_lazy as _
 from django.contrib import admin
 from django.contrib.auth.models import User, Group
 
-from userena.contrib.umessages.models import Message, MessageContact, MessageRecipient
+from userena.contrib.umessages.models import (Message, MessageContact, MessageRecipient,
+                                              Inbox, InboxEntry, Broadcast,
+                                              ArchivedMessage, MessageBlock)
 
 class MessageRecipientInline(admin.TabularInline):
     """ Inline message recipients """
@@ -35,3 +37,38 @@ class MessageAdmin(admin.ModelAdmin):
 
 admin.site.register(Message, MessageAdmin)
 admin.site.register(MessageContact)
+
+class InboxAdmin(admin.ModelAdmin):
+    list_display = ('user', 'unread_count')
+    raw_id_fields = ('user',)
+
+class InboxEntryAdmin(admin.ModelAdmin):
+    list_display = ('user', 'counterpart', 'unread_count')
+    raw_id_fields = ('user', 'counterpart')
+
+admin.site.register(Inbox, InboxAdmin)
+admin.site.register(InboxEntry, InboxEntryAdmin)
+
+class BroadcastAdmin(admin.ModelAdmin):
+    """ Staff send a broadcast by adding one, the sender is set for them. """
+    exclude = ('sender',)
+    list_display = ('sender', 'body', 'sent_at')
+    search_fields = ('body',)
+
+    def save_model(self, request, obj, form, change):
+        if not change: obj.sender = request.user
+        obj.save()
+
+admin.site.register(Broadcast, BroadcastAdmin)
+
+class ArchivedMessageAdmin(admin.ModelAdmin):
+    list_display = ('sender', 'recipient', 'body', 'sent_at')
+    raw_id_fields = ('sender', 'recipient')
+
+admin.site.register(ArchivedMessage, ArchivedMessageAdmin)
+
+class MessageBlockAdmin(admin.ModelAdmin):
+    list_display = ('user', 'blocked_user', 'created_at')
+    raw_id_fields = ('user', 'blocked_user')
+
+admin.site.register(MessageBlock, MessageBlockAdmin)
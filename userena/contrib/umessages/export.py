@@ -0,0 +1,177 @@
+"""
+Export of all the messages of a user.
+
+The messages are read in batches of message id's, so only one batch is in
+memory at a time. The exports are generators of lines, which are written to
+a file by the ``export_messages`` command or streamed to the user by the
+``message_export`` view.
+
+"""
+from django.utils import simplejson
+
+from userena.contrib.umessages.models import (Message, MessageRecipient,
+                                              ArchivedMessage)
+
+import csv, cStringIO
+
+CSV_COLUMNS = ('id', 'sent_at', 'sender', 'sender_removed', 'recipient',
+               'read_at', 'removed', 'archived', 'body')
+
+def _batches(queryset, field, batch_size):
+    """
+    Yields the distinct values of ``field`` in ``queryset`` in ascending
+    batches. Every batch continues after the last value of the one before, so
+    each is read from the index instead of skipping an offset.
+
+    """
+    last = 0
+    while True:
+        values = list(queryset.filter(**{'%s__gt' % field: last})
+                              .order_by(field)
+                              .values_list(field, flat=True)
+                              .distinct()[:batch_size])
+        if not values: break
+        last = values[-1]
+        yield values
+
+def _date(value):
+    return value and value.isoformat() or None
+
+def _message(pk, sent_at, sender, sender_removed, body, archived):
+    return {'id': pk,
+            'sent_at': _date(sent_at),
+            'sender': sender,
+            'sender_removed': sender_removed,
+            'body': body,
+            'archived': archived,
+            'recipients': []}
+
+def _recipient(username, read_at, removed):
+    return {'username': username,
+            'read_at': _date(read_at),
+            'removed': removed}
+
+def export_messages(user, batch_size=500):
+    """
+    Yields every message that a user sent or received, including removed and
+    archived ones.
+
+    Messages that the user sent list all their recipients, messages that the
+    user received only list the user. Archived messages have no ``read_at``.
+
+    :param user:
+        The :class:`User` whose messages are exported.
+
+    :param batch_size:
+        Integer with the amount of messages that are read per query.
+
+    :return:
+        Generator of dictionaries with the ``id``, ``sent_at``, ``sender``,
+        ``sender_removed``, ``body``, ``archived`` and ``recipients`` of a
+        message.
+
+    """
+    for message_pks in _batches(Message.objects.filter(sender=user),
+                                'pk', batch_size):
+        recipients = dict()
+        for message_id, username, read_at, deleted_at in \
+                MessageRecipient.objects.filter(message__in=message_pks) \
+                                        .order_by('user') \
+                                        .values_list('message', 'user__username',
+                                                     'read_at', 'deleted_at'):
+            recipients.setdefault(message_id, []).append(
+                _recipient(username, read_at, deleted_at is not None))
+        for message in Message.objects.filter(pk__in=message_pks).order_by('pk'):
+            exported = _message(message.pk, message.sent_at, user.username,
+                                message.sender_deleted_at is not None,
+                                message.body, False)
+            exported['recipients'] = recipients.get(message.pk, [])
+            yield exported
+
+    for message_pks in _batches(MessageRecipient.objects.filter(user=user),
+                                'message', batch_size):
+        for recipient in MessageRecipient.objects.filter(user=user,
+                                                         message__in=message_pks) \
+                                                 .select_related('message__sender') \
+                                                 .order_by('message'):
+            message = recipient.message
+            if message.sender_id == user.pk: continue
+            exported = _message(message.pk, message.sent_at, message.sender.username,
+                                message.sender_deleted_at is not None,
+                                message.body, False)
+            exported['recipients'].append(_recipient(user.username, recipient.read_at,
+                                                     recipient.deleted_at is not None))
+            yield exported
+
+    for message_ids in _batches(ArchivedMessage.objects.filter(sender=user),
+                                'message_id', batch_size):
+        exported = None
+        for archived in ArchivedMessage.objects.filter(sender=user,
+                                                       message_id__in=message_ids) \
+                                               .select_related('recipient') \
+                                               .order_by('message_id', 'recipient'):
+            if exported is None or exported['id'] != archived.message_id:
+                if exported is not None: yield exported
+                exported = _message(archived.message_id, archived.sent_at,
+                                    user.username, archived.sender_deleted,
+                                    archived.body, True)
+            exported['recipients'].append(_recipient(archived.recipient.username, None,
+                                                     archived.recipient_deleted))
+        if exported is not None: yield exported
+
+    for message_ids in _batches(ArchivedMessage.objects.filter(recipient=user),
+                                'message_id', batch_size):
+        for archived in ArchivedMessage.objects.filter(recipient=user,
+                                                       message_id__in=message_ids) \
+                                               .select_related('sender') \
+                                               .order_by('message_id'):
+            if archived.sender_id == user.pk: continue
+            exported = _message(archived.message_id, archived.sent_at,
+                                archived.sender.username, archived.sender_deleted,
+                                archived.body, True)
+            exported['recipients'].append(_recipient(user.username, None,
+                                                     archived.recipient_deleted))
+            yield exported
+
+def export_json_lines(user, batch_size=500):
+    """
+    Yields the messages of a user as JSON, one message per line.
+
+    See :func:`export_messages` for the fields of a message.
+
+    """
+    for message in export_messages(user, batch_size):
+        yield simplejson.dumps(message) + '\n'
+
+def export_csv(user, batch_size=500):
+    """
+    Yields the messages of a user as CSV lines, with a header first.
+
+    Every recipient of a message has its own line, with the columns in
+    ``CSV_COLUMNS``.
+
+    """
+    buffer = cStringIO.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(row):
+        writer.writerow([isinstance(value, unicode) and value.encode('utf-8') or value
+                         for value in row])
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    yield line(CSV_COLUMNS)
+    for message in export_messages(user, batch_size):
+        for recipient in message['recipients']:
+            yield line([message['id'], message['sent_at'], message['sender'],
+                        message['sender_removed'], recipient['username'],
+                        recipient['read_at'], recipient['removed'],
+                        message['archived'], message['body']])
+
+# Format name to the export function, mimetype and file extension.
+EXPORT_FORMATS = {
+    'json': (export_json_lines, 'application/x-ndjson', 'jsonl'),
+    'csv': (export_csv, 'text/csv', 'csv'),
+}
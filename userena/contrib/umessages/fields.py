@@ -22,6 +22,12 @@ class CommaSeparatedUserField(forms.Field):
         function should return ``True`` if the user is allowed or ``False`` if
         the user is not allowed.
 
+    :param queryset_filter:
+        Optional function which receives the queryset of the :class:`User`
+        with the supplied usernames, and returns it with only the allowed
+        users. Unlike ``recipient_filter``, the users are filtered in the
+        same query that fetches them.
+
     :return:
         A list of :class:`User`.
 
@@ -31,6 +37,7 @@ class CommaSeparatedUserField(forms.Field):
     def __init__(self, *args, **kwargs):
         recipient_filter = kwargs.pop('recipient_filter', None)
         self._recipient_filter = recipient_filter
+        self._queryset_filter = kwargs.pop('queryset_filter', None)
         super(CommaSeparatedUserField, self).__init__(*args, **kwargs)
 
     def clean(self, value):
@@ -38,18 +45,23 @@ class CommaSeparatedUserField(forms.Field):
 
         names = set(value.split(','))
         names_set = set([name.strip() for name in names])
-        users = list(User.objects.filter(username__in=names_set))
+        queryset = User.objects.filter(username__in=names_set)
+        if self._queryset_filter is not None:
+            queryset = self._queryset_filter(queryset)
+        users = list(queryset)
 
-        # Check for unknown names.
+        # Check for unknown names, or names that are filtered out.
         unknown_names = names_set ^ set([user.username for user in users])
 
         recipient_filter = self._recipient_filter
         invalid_users = []
         if recipient_filter is not None:
+            allowed_users = []
             for r in users:
                 if recipient_filter(r) is False:
-                    users.remove(r)
                     invalid_users.append(r.username)
+                else: allowed_users.append(r)
+            users = allowed_users
 
         if unknown_names or invalid_users:
             humanized_usernames = ', '.join(list(unknown_names) + invalid_users)
@@ -2,16 +2,47 @@ from django import forms
 from django.utils.translation import ugettext_lazy as _
 
 from userena.contrib.umessages.fields import CommaSeparatedUserField
-from userena.contrib.umessages.models import Message, MessageRecipient
+from userena.contrib.umessages.models import Message, MessageRecipient, MessageBlock
 
 import datetime
 
+def block_recipients(form, sender):
+    """
+    Makes the ``to`` field of a form refuse the users that blocked the
+    sender. Forms without a :class:`CommaSeparatedUserField` named ``to`` are
+    left alone.
+
+    :param form:
+        The form that is used to compose a message.
+
+    :param sender:
+        The :class:`User` that sends the message.
+
+    """
+    field = form.fields.get('to')
+    if isinstance(field, CommaSeparatedUserField):
+        def queryset_filter(queryset):
+            return MessageBlock.objects.filter_recipients(queryset, sender)
+        field._queryset_filter = queryset_filter
+
 class ComposeForm(forms.Form):
     to = CommaSeparatedUserField(label=_("To"))
     body = forms.CharField(label=_("Message"),
                            widget=forms.Textarea({'class': 'message'}),
                            required=True)
 
+    def __init__(self, *args, **kwargs):
+        """
+        :param sender:
+            Optional :class:`User` that sends the message. Users that blocked
+            the sender are not accepted as recipients.
+
+        """
+        sender = kwargs.pop('sender', None)
+        super(ComposeForm, self).__init__(*args, **kwargs)
+        if sender is not None:
+            block_recipients(self, sender)
+
     def save(self, sender):
         """
         Save the message and send it out into the wide world.
@@ -22,7 +53,9 @@ class ComposeForm(forms.Form):
         :param parent_msg:
             The :class:`Message` that preceded this message in the thread.
 
-        :return: The saved :class:`Message`.
+        :return:
+            The saved :class:`Message`, or ``None`` if none of the recipients
+            can receive it.
 
         """
         to_user_list = self.cleaned_data['to']
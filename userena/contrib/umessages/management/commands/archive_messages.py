@@ -0,0 +1,63 @@
+from django.core.management.base import NoArgsCommand, BaseCommand
+from optparse import make_option
+
+from userena.contrib.umessages.models import Message, ArchivedMessage
+
+import datetime, time
+
+try:
+    from django.utils.timezone import now
+except ImportError:
+    now = datetime.datetime.now
+
+class Command(NoArgsCommand):
+    """
+    Move the messages that are sent more than ``--days`` days ago to the
+    :class:`ArchivedMessage` table.
+
+    The messages are moved in batches, every batch in its own transaction.
+    Messages that are still unread, or the latest of a conversation, are not
+    moved.
+
+    """
+    option_list = BaseCommand.option_list + (
+        make_option('--days',
+            action='store',
+            type='int',
+            dest='days',
+            default=365,
+            help='Amount of days after which messages are archived.'),
+        make_option('--batch-size',
+            action='store',
+            type='int',
+            dest='batch_size',
+            default=500,
+            help='Amount of messages that are archived per transaction.'),
+        make_option('--sleep',
+            action='store',
+            type='float',
+            dest='sleep',
+            default=0,
+            help='Seconds to wait between the batches.'),
+        )
+
+    help = 'Moves old messages to the archive.'
+    def handle_noargs(self, **options):
+        batch_size = options.get('batch_size')
+        sleep = options.get('sleep')
+        cutoff = now() - datetime.timedelta(days=options.get('days'))
+
+        archived, last_pk = 0, 0
+        while True:
+            message_pks = list(Message.objects.get_archivable(cutoff)
+                                              .filter(pk__gt=last_pk)
+                                              .order_by('pk')
+                                              .values_list('pk', flat=True)[:batch_size])
+            if not message_pks: break
+            last_pk = message_pks[-1]
+
+            archived += ArchivedMessage.objects.archive(message_pks)
+            if sleep: time.sleep(sleep)
+
+        if int(options.get('verbosity', 1)) > 1:
+            self.stdout.write("Archived %s messages.\n" % archived)
@@ -0,0 +1,93 @@
+from django.core.management.base import NoArgsCommand, BaseCommand
+from django.db import connections, transaction
+from optparse import make_option
+
+from userena.contrib.umessages.models import Message, MessageRecipient
+from userena.contrib.umessages.utils import CONVERSATION_SHIFT
+
+import time
+
+class Command(NoArgsCommand):
+    """
+    Fill the ``conversation``, ``sent_at`` and ``sender_deleted_at`` fields of
+    the recipients that were stored before these fields existed.
+
+    The recipients are updated in ranges of id's, every range in its own
+    transaction. Only recipients without a conversation are changed, so the
+    command can be stopped and started again at any time.
+
+    """
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size',
+            action='store',
+            type='int',
+            dest='batch_size',
+            default=1000,
+            help='Amount of recipients that are updated per query.'),
+        make_option('--sleep',
+            action='store',
+            type='float',
+            dest='sleep',
+            default=0,
+            help='Seconds to wait between the batches.'),
+        )
+
+    help = 'Fills the conversation key of existing messages.'
+    def handle_noargs(self, **options):
+        batch_size = options.get('batch_size')
+        sleep = options.get('sleep')
+        verbosity = int(options.get('verbosity', 1))
+
+        using = MessageRecipient.objects.db
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        recipient_table = qn(MessageRecipient._meta.db_table)
+        message_table = qn(Message._meta.db_table)
+
+        def message_column(column):
+            return ('(SELECT m.%s FROM %s m WHERE m.%s = %s.%s)' %
+                    (qn(column), message_table, qn('id'),
+                     recipient_table, qn('message_id')))
+
+        sender = message_column('sender_id')
+        user = qn('user_id')
+        sql = ('UPDATE %(recipients)s SET '
+               '%(sent_at)s = %(message_sent_at)s, '
+               '%(sender_deleted_at)s = %(message_sender_deleted_at)s, '
+               '%(conversation)s = CASE WHEN %(user)s < %(sender)s '
+               'THEN %(user)s * %(shift)s + %(sender)s '
+               'ELSE %(sender)s * %(shift)s + %(user)s END '
+               'WHERE %(id)s >= %%s AND %(id)s <= %%s '
+               'AND %(conversation)s IS NULL') % {
+            'recipients': recipient_table,
+            'sent_at': qn('sent_at'),
+            'message_sent_at': message_column('sent_at'),
+            'sender_deleted_at': qn('sender_deleted_at'),
+            'message_sender_deleted_at': message_column('sender_deleted_at'),
+            'conversation': qn('conversation'),
+            'user': user,
+            'sender': sender,
+            'shift': CONVERSATION_SHIFT,
+            'id': qn('id'),
+        }
+
+        updated, last_pk = 0, 0
+        while True:
+            pks = list(MessageRecipient.objects.filter(conversation__isnull=True,
+                                                       pk__gt=last_pk)
+                                               .order_by('pk')
+                                               .values_list('pk', flat=True)[:batch_size])
+            if not pks: break
+
+            cursor = connection.cursor()
+            cursor.execute(sql, [pks[0], pks[-1]])
+            transaction.commit_unless_managed(using=using)
+            updated += len(pks)
+            last_pk = pks[-1]
+
+            if verbosity > 2:
+                self.stdout.write("Updated recipients up to id %s.\n" % last_pk)
+            if sleep: time.sleep(sleep)
+
+        if verbosity > 1:
+            self.stdout.write("Updated %s recipients.\n" % updated)
@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.models import Count
+from optparse import make_option
+
+from userena.contrib.umessages.models import MessageRecipient
+
+import time
+
+class Command(BaseCommand):
+    """
+    Show the query plan and timing of the hot umessages queries.
+
+    Run it before and after ``migrate umessages`` to see which indexes the
+    database uses for them.
+
+    """
+    option_list = BaseCommand.option_list + (
+        make_option('--repeat',
+            action='store',
+            type='int',
+            dest='repeat',
+            default=10,
+            help='Amount of times every query is timed.'),
+        )
+
+    args = '<username> <username>'
+    help = 'Explains the queries that count unread messages and fetch conversations.'
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError('Supply the usernames of two users.')
+        try:
+            user, other = [User.objects.get(username=u) for u in args]
+        except User.DoesNotExist:
+            raise CommandError('User not found.')
+
+        unread = MessageRecipient.objects.filter(user=user,
+                                                 read_at__isnull=True,
+                                                 deleted_at__isnull=True)
+        queries = (
+            ('Unread messages for %s' % user.username,
+             unread.values_list('user').annotate(Count('id')).order_by()),
+            ('Unread messages from %s' % other.username,
+             unread.filter(message__sender=other)
+                   .values_list('user', 'message__sender')
+                   .annotate(Count('id')).order_by()),
+            ('Conversation between %s and %s' % (user.username, other.username),
+             MessageRecipient.objects.get_conversation(user, other)
+                                     .order_by('-sent_at', '-message')[:10]),
+        )
+
+        repeat = options.get('repeat')
+        for title, queryset in queries:
+            connection = connections[queryset.db]
+            sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+            if connection.vendor == 'sqlite':
+                explain = 'EXPLAIN QUERY PLAN '
+            else: explain = 'EXPLAIN '
+
+            cursor = connection.cursor()
+            cursor.execute(explain + sql, params)
+            plan = cursor.fetchall()
+
+            start = time.time()
+            for i in xrange(repeat):
+                cursor.execute(sql, params)
+                cursor.fetchall()
+            elapsed = (time.time() - start) / max(repeat, 1)
+
+            self.stdout.write('%s (%.2f ms)\n' % (title, elapsed * 1000))
+            for row in plan:
+                self.stdout.write('    %s\n' % ' | '.join([unicode(c) for c in row]))
+            self.stdout.write('\n')
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from optparse import make_option
+
+from userena.contrib.umessages.export import EXPORT_FORMATS
+
+class Command(BaseCommand):
+    """
+    Write all the messages that a user sent or received to the standard
+    output, as JSON lines or CSV.
+
+    The messages are read and written in batches, so the memory use doesn't
+    grow with the amount of messages.
+
+    """
+    option_list = BaseCommand.option_list + (
+        make_option('--format',
+            action='store',
+            type='choice',
+            choices=sorted(EXPORT_FORMATS.keys()),
+            dest='format',
+            default='json',
+            help='Format of the export, "json" for JSON lines or "csv".'),
+        make_option('--batch-size',
+            action='store',
+            type='int',
+            dest='batch_size',
+            default=500,
+            help='Amount of messages that are read per query.'),
+        )
+
+    args = '<username>'
+    help = 'Exports the messages of a user.'
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Supply the username of a user.')
+        try:
+            user = User.objects.get(username=args[0])
+        except User.DoesNotExist:
+            raise CommandError('User not found.')
+
+        export = EXPORT_FORMATS[options.get('format')][0]
+        for line in export(user, options.get('batch_size')):
+            self.stdout.write(line)
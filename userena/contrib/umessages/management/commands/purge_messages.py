@@ -0,0 +1,75 @@
+from django.core.management.base import NoArgsCommand, BaseCommand
+from optparse import make_option
+
+from userena.contrib.umessages.models import Message, ArchivedMessage
+
+import datetime, time
+
+try:
+    from django.utils.timezone import now
+except ImportError:
+    now = datetime.datetime.now
+
+class Command(NoArgsCommand):
+    """
+    Delete the messages that the sender and all recipients removed more than
+    ``--days`` days ago, and the archived messages that the sender and the
+    recipient removed.
+
+    The messages are deleted in batches, every batch in its own transaction.
+
+    """
+    option_list = BaseCommand.option_list + (
+        make_option('--days',
+            action='store',
+            type='int',
+            dest='days',
+            default=30,
+            help='Amount of days after which removed messages are deleted.'),
+        make_option('--batch-size',
+            action='store',
+            type='int',
+            dest='batch_size',
+            default=500,
+            help='Amount of messages that are deleted per transaction.'),
+        make_option('--sleep',
+            action='store',
+            type='float',
+            dest='sleep',
+            default=0,
+            help='Seconds to wait between the batches.'),
+        )
+
+    help = 'Deletes messages that are removed by everyone.'
+    def handle_noargs(self, **options):
+        batch_size = options.get('batch_size')
+        sleep = options.get('sleep')
+        cutoff = now() - datetime.timedelta(days=options.get('days'))
+
+        purged, last_pk = 0, 0
+        while True:
+            message_pks = list(Message.objects.get_purgeable(cutoff)
+                                              .filter(pk__gt=last_pk)
+                                              .order_by('pk')
+                                              .values_list('pk', flat=True)[:batch_size])
+            if not message_pks: break
+            last_pk = message_pks[-1]
+
+            purged += Message.objects.purge(message_pks)
+            if sleep: time.sleep(sleep)
+
+        # Archived messages don't keep the date they were removed at.
+        purged_archived = 0
+        while True:
+            archived_pks = list(ArchivedMessage.objects.get_purgeable()
+                                                       .order_by('pk')
+                                                       .values_list('pk', flat=True)[:batch_size])
+            if not archived_pks: break
+
+            ArchivedMessage.objects.filter(pk__in=archived_pks).delete()
+            purged_archived += len(archived_pks)
+            if sleep: time.sleep(sleep)
+
+        if int(options.get('verbosity', 1)) > 1:
+            self.stdout.write("Deleted %s messages and %s archived messages.\n"
+                              % (purged, purged_archived))
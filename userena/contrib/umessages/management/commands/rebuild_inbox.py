@@ -0,0 +1,63 @@
+from django.core.management.base import NoArgsCommand, BaseCommand
+from django.db import transaction
+from optparse import make_option
+
+from userena.contrib.umessages.models import MessageContact, InboxEntry
+
+import time
+
+class Command(NoArgsCommand):
+    """
+    Fill the latest message of the :class:`InboxEntry` of both users of every
+    contact.
+
+    The contacts are handled in batches, every batch in its own transaction.
+    Use ``--start`` to continue after the last contact that was reported.
+
+    """
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size',
+            action='store',
+            type='int',
+            dest='batch_size',
+            default=500,
+            help='Amount of contacts that are handled per transaction.'),
+        make_option('--start',
+            action='store',
+            type='int',
+            dest='start',
+            default=0,
+            help='Id of the contact after which to start.'),
+        make_option('--sleep',
+            action='store',
+            type='float',
+            dest='sleep',
+            default=0,
+            help='Seconds to wait between the batches.'),
+        )
+
+    help = 'Rebuilds the inbox summaries from the messages.'
+    def handle_noargs(self, **options):
+        batch_size = options.get('batch_size')
+        sleep = options.get('sleep')
+        verbosity = int(options.get('verbosity', 1))
+
+        last_pk = options.get('start')
+        while True:
+            contacts = list(MessageContact.objects.filter(pk__gt=last_pk)
+                                                  .order_by('pk')
+                                                  .values_list('pk', 'from_user', 'to_user')[:batch_size])
+            if not contacts: break
+            last_pk = contacts[-1][0]
+
+            self.rebuild(contacts)
+
+            if verbosity > 1:
+                self.stdout.write("Rebuilt inbox up to contact %s.\n" % last_pk)
+            if sleep: time.sleep(sleep)
+
+    @transaction.commit_on_success
+    def rebuild(self, contacts):
+        for pk, from_user_id, to_user_id in contacts:
+            InboxEntry.objects.refresh_latest(from_user_id, [to_user_id])
+            InboxEntry.objects.refresh_latest(to_user_id, [from_user_id])
@@ -0,0 +1,55 @@
+from django.core.management.base import NoArgsCommand, BaseCommand
+from optparse import make_option
+
+from userena.contrib.umessages.models import Message, MessageSearchTerm
+
+import time
+
+class Command(NoArgsCommand):
+    """
+    Build the search index of every message again.
+
+    The messages are handled in batches, every batch in its own transaction.
+    Use ``--start`` to continue after the last message that was reported.
+
+    """
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size',
+            action='store',
+            type='int',
+            dest='batch_size',
+            default=500,
+            help='Amount of messages that are indexed per transaction.'),
+        make_option('--start',
+            action='store',
+            type='int',
+            dest='start',
+            default=0,
+            help='Id of the message after which to start.'),
+        make_option('--sleep',
+            action='store',
+            type='float',
+            dest='sleep',
+            default=0,
+            help='Seconds to wait between the batches.'),
+        )
+
+    help = 'Rebuilds the search index of the messages.'
+    def handle_noargs(self, **options):
+        batch_size = options.get('batch_size')
+        sleep = options.get('sleep')
+        verbosity = int(options.get('verbosity', 1))
+
+        last_pk = options.get('start')
+        while True:
+            message_pks = list(Message.objects.filter(pk__gt=last_pk)
+                                              .order_by('pk')
+                                              .values_list('pk', flat=True)[:batch_size])
+            if not message_pks: break
+            last_pk = message_pks[-1]
+
+            MessageSearchTerm.objects.reindex(message_pks)
+
+            if verbosity > 1:
+                self.stdout.write("Indexed messages up to message %s.\n" % last_pk)
+            if sleep: time.sleep(sleep)
@@ -0,0 +1,55 @@
+from django.core.management.base import NoArgsCommand, BaseCommand
+from django.contrib.auth.models import User
+from django.db import transaction
+from optparse import make_option
+
+from userena.contrib.umessages.models import UserSearchName
+
+import time
+
+class Command(NoArgsCommand):
+    """
+    Store the names by which every user is found as a recipient.
+
+    The users are handled in batches, every batch in its own transaction.
+    Users whose names are already stored are skipped.
+
+    """
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size',
+            action='store',
+            type='int',
+            dest='batch_size',
+            default=500,
+            help='Amount of users that are handled per transaction.'),
+        make_option('--sleep',
+            action='store',
+            type='float',
+            dest='sleep',
+            default=0,
+            help='Seconds to wait between the batches.'),
+        )
+
+    help = 'Rebuilds the names by which recipients are found.'
+    def handle_noargs(self, **options):
+        batch_size = options.get('batch_size')
+        sleep = options.get('sleep')
+
+        updated, last_pk = 0, 0
+        while True:
+            user_list = list(User.objects.filter(pk__gt=last_pk)
+                                         .order_by('pk')[:batch_size])
+            if not user_list: break
+            last_pk = user_list[-1].pk
+
+            self.rebuild(user_list)
+            updated += len(user_list)
+            if sleep: time.sleep(sleep)
+
+        if int(options.get('verbosity', 1)) > 1:
+            self.stdout.write("Rebuilt the names of %s users.\n" % updated)
+
+    @transaction.commit_on_success
+    def rebuild(self, user_list):
+        for user in user_list:
+            UserSearchName.objects.update_names(user)
@@ -0,0 +1,67 @@
+from django.core.management.base import NoArgsCommand, BaseCommand
+from optparse import make_option
+
+from userena.contrib.umessages.models import Inbox, InboxEntry, MessageRecipient
+from userena.contrib.umessages.unread import invalidate_unread
+
+class Command(NoArgsCommand):
+    """
+    Repair the unread counters of :class:`Inbox` and :class:`InboxEntry` by
+    counting the unread messages again.
+
+    A counter is only repaired if it didn't change while it was counted,
+    otherwise it's left for the next run.
+
+    """
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size',
+            action='store',
+            type='int',
+            dest='batch_size',
+            default=500,
+            help='Amount of counters that are checked per query.'),
+        )
+
+    help = 'Repairs the unread message counters.'
+    def handle_noargs(self, **options):
+        batch_size = options.get('batch_size')
+
+        repaired = 0
+        last_pk = 0
+        while True:
+            inboxes = list(Inbox.objects.filter(pk__gt=last_pk)
+                                        .order_by('pk')
+                                        .values_list('pk', 'user', 'unread_count')[:batch_size])
+            if not inboxes: break
+            last_pk = inboxes[-1][0]
+
+            counts = MessageRecipient.objects.count_unread_grouped([i[1] for i in inboxes])
+            for pk, user_id, unread_count in inboxes:
+                actual = counts.get(user_id, 0)
+                if unread_count != actual:
+                    repaired += Inbox.objects.filter(pk=pk,
+                                                     unread_count=unread_count) \
+                                             .update(unread_count=actual)
+                    invalidate_unread([user_id])
+
+        last_pk = 0
+        while True:
+            entries = list(InboxEntry.objects.filter(pk__gt=last_pk)
+                                             .order_by('pk')
+                                             .values_list('pk', 'user', 'counterpart',
+                                                          'unread_count')[:batch_size])
+            if not entries: break
+            last_pk = entries[-1][0]
+
+            counts = MessageRecipient.objects.count_unread_grouped([e[1] for e in entries],
+                                                                   [e[2] for e in entries])
+            for pk, user_id, counterpart_id, unread_count in entries:
+                actual = counts.get((user_id, counterpart_id), 0)
+                if unread_count != actual:
+                    repaired += InboxEntry.objects.filter(pk=pk,
+                                                          unread_count=unread_count) \
+                                                  .update(unread_count=actual)
+                    invalidate_unread([user_id])
+
+        if int(options.get('verbosity', 1)) > 1:
+            self.stdout.write("Repaired %s unread counters.\n" % repaired)
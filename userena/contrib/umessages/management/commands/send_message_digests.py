@@ -0,0 +1,107 @@
+from django.core.management.base import NoArgsCommand, BaseCommand
+from django.core.mail import EmailMessage, get_connection
+from django.contrib.sites.models import Site
+from django.template import Context
+from django.template.loader import get_template
+from django.conf import settings
+from django.db import transaction
+from optparse import make_option
+
+from userena.contrib.umessages.models import MessageRecipient, MessageDigestRun
+from userena.utils import get_protocol
+
+import datetime
+
+try:
+    from django.utils.timezone import now
+except ImportError:
+    now = datetime.datetime.now
+
+class Command(NoArgsCommand):
+    """
+    Email every user a digest of the unread messages they received since the
+    last digest.
+
+    The users are handled in batches. Every batch takes one query for its
+    messages, and the progress is stored before its emails are send. All
+    emails are send over one connection.
+
+    """
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size',
+            action='store',
+            type='int',
+            dest='batch_size',
+            default=500,
+            help='Amount of users whose digests are build at once.'),
+        )
+
+    help = 'Emails a digest of their unread messages to users.'
+    def handle_noargs(self, **options):
+        batch_size = options.get('batch_size')
+        verbosity = int(options.get('verbosity', 1))
+
+        run = MessageDigestRun.objects.get_current_run()
+
+        # The templates are compiled once for all digests.
+        subject_template = get_template('umessages/emails/digest_subject.txt')
+        message_template = get_template('umessages/emails/digest_message.txt')
+        context = {'site': Site.objects.get_current(),
+                   'protocol': get_protocol()}
+
+        user_ids = MessageRecipient.objects.get_unread_between_ids(run.from_message_id,
+                                                                   run.to_message_id) \
+                                           .filter(user__gt=run.last_user_id) \
+                                           .order_by('user') \
+                                           .values_list('user', flat=True) \
+                                           .distinct()
+
+        connection = get_connection()
+        connection.open()
+        sent = 0
+        try:
+            batch = []
+            for user_id in user_ids.iterator():
+                batch.append(user_id)
+                if len(batch) == batch_size:
+                    sent += self.send_batch(run, batch, subject_template,
+                                            message_template, context, connection)
+                    batch = []
+            if batch:
+                sent += self.send_batch(run, batch, subject_template,
+                                        message_template, context, connection)
+        finally:
+            connection.close()
+
+        MessageDigestRun.objects.filter(pk=run.pk).update(finished_at=now())
+        transaction.commit_unless_managed()
+
+        if verbosity > 1:
+            self.stdout.write("Sent %s message digests.\n" % sent)
+
+    def send_batch(self, run, user_ids, subject_template, message_template,
+                   context, connection):
+        recipient_list = MessageRecipient.objects.get_unread_between_ids(run.from_message_id,
+                                                                         run.to_message_id,
+                                                                         user_ids) \
+                                                 .select_related('user', 'message__sender') \
+                                                 .order_by('user', 'message')
+        digests = dict()
+        for recipient in recipient_list:
+            digests.setdefault(recipient.user, []).append(recipient.message)
+
+        # Mark the batch before sending, a crash may skip a digest but never
+        # sends one twice.
+        MessageDigestRun.objects.filter(pk=run.pk).update(last_user_id=user_ids[-1])
+        transaction.commit_unless_managed()
+
+        emails = []
+        for user, message_list in digests.iteritems():
+            if not user.is_active or not user.email: continue
+            context.update({'user': user, 'message_list': message_list})
+            subject = ''.join(subject_template.render(Context(context)).splitlines())
+            emails.append(EmailMessage(subject,
+                                       message_template.render(Context(context)),
+                                       settings.DEFAULT_FROM_EMAIL,
+                                       [user.email]))
+        return connection.send_messages(emails) or 0
@@ -1,11 +1,80 @@
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction, IntegrityError
+from django.db.models import Q, F, Count, Max, get_model
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from django.utils.hashcompat import md5_constructor
 
 import datetime
 
+try:
+    from django.utils.timezone import now
+except ImportError:
+    now = datetime.datetime.now
+
+from userena.contrib.umessages.utils import (bulk_insert, bulk_update,
+                                             conversation_key,
+                                             message_position, search_terms,
+                                             search_names, SNIPPET_LENGTH,
+                                             SEARCH_NAME_LENGTH)
+from userena.contrib.umessages import unread
+from userena import settings as userena_settings
+
+AUTOCOMPLETE_CACHE_KEY = 'umessages_autocomplete_%s_%s'
+BLOCKER_IDS_CACHE_KEY = 'umessages_blockers_%s'
+
+def _page_conversation(queryset, message_field, before=None, after=None,
+                       date_field='sent_at'):
+    """
+    Orders and limits the rows of a conversation to the ones before or after
+    a position.
+
+    :param queryset:
+        Queryset with the rows of a conversation.
+
+    :param message_field:
+        String with the field that holds the message id.
+
+    :param before:
+        Optional tuple of ``sent_at`` and message id.
+
+    :param after:
+        Optional tuple of ``sent_at`` and message id. Ignored if ``before`` is
+        supplied.
+
+    :param date_field:
+        String with the field that holds the date. Defaults to ``sent_at``.
+
+    :return: The queryset, newest first unless ``after`` is used.
+
+    """
+    if before is None and after is not None:
+        sent_at, pk = after
+        return queryset.filter(Q(**{'%s__gt' % date_field: sent_at}) |
+                               Q(**{date_field: sent_at,
+                                    '%s__gt' % message_field: pk})) \
+                       .order_by(date_field, message_field)
+    if before is not None:
+        sent_at, pk = before
+        queryset = queryset.filter(Q(**{'%s__lt' % date_field: sent_at}) |
+                                   Q(**{date_field: sent_at,
+                                        '%s__lt' % message_field: pk}))
+    return queryset.order_by('-%s' % date_field, '-%s' % message_field)
+
 class MessageContactManager(models.Manager):
     """ Manager for the :class:`MessageContact` model """
 
+    def _canonical_pair(self, from_user, to_user):
+        """
+        Returns the id's of two users, lowest first.
+
+        A contact is stored once per pair of users, always with the lowest id
+        as ``from_user``. That way a contact is found with a single lookup on
+        the ``(from_user, to_user)`` index, in whatever direction the message
+        was sent.
+
+        """
+        return tuple(sorted([from_user.pk, to_user.pk]))
+
     def get_or_create(self, from_user, to_user, message):
         """
         Get or create a Contact
@@ -14,31 +83,103 @@ class MessageContactManager(models.Manager):
         be unique in a bi-directional manner.
 
         """
+        from_user_id, to_user_id = self._canonical_pair(from_user, to_user)
         created = False
         try:
-            contact = self.get(Q(from_user=from_user, to_user=to_user) |
-                               Q(from_user=to_user, to_user=from_user))
+            contact = self.get(from_user=from_user_id, to_user=to_user_id)
 
         except self.model.DoesNotExist:
-            created = True
-            contact = self.create(from_user=from_user,
-                                  to_user=to_user,
-                                  latest_message=message)
+            contact, created = self._create_or_update(from_user_id,
+                                                      to_user_id,
+                                                      message)
 
         return (contact, created)
 
+    def _create_or_update(self, from_user_id, to_user_id, message):
+        """
+        Creates a contact, or updates it when another request created it in
+        the meantime. The create runs in a savepoint, so a failed insert
+        doesn't abort the surrounding transaction.
+
+        """
+        sid = transaction.savepoint(using=self.db)
+        try:
+            contact = self.create(from_user_id=from_user_id,
+                                  to_user_id=to_user_id,
+                                  latest_message=message)
+        except IntegrityError:
+            transaction.savepoint_rollback(sid, using=self.db)
+            self.filter(from_user=from_user_id,
+                        to_user=to_user_id).update(latest_message=message)
+            return (self.get(from_user=from_user_id, to_user=to_user_id), False)
+        transaction.savepoint_commit(sid, using=self.db)
+        return (contact, True)
+
     def update_contact(self, from_user, to_user, message):
-        """ Get or update a contacts information """
-        contact, created = self.get_or_create(from_user,
-                                              to_user,
-                                              message)
-
-        # If the contact already existed, update the message
-        if not created:
-            contact.latest_message = message
-            contact.save()
+        """
+        Get or update a contacts information
+
+        Existing contacts are updated with a single ``UPDATE``, only when
+        there is no contact yet it's inserted.
+
+        """
+        from_user_id, to_user_id = self._canonical_pair(from_user, to_user)
+        updated = self.filter(from_user=from_user_id,
+                              to_user=to_user_id).update(latest_message=message)
+        if updated:
+            return self.get(from_user=from_user_id, to_user=to_user_id)
+
+        contact, created = self._create_or_update(from_user_id,
+                                                  to_user_id,
+                                                  message)
         return contact
 
+    def update_contacts(self, sender, to_user_list, message):
+        """
+        Updates the contacts of a sender with many users at once.
+
+        The existing contacts are updated with one ``UPDATE``, the missing
+        ones are inserted with one ``INSERT``.
+
+        :param sender:
+            The :class:`User` which sends the message.
+
+        :param to_user_list:
+            List of Django :class:`User` to whom the message is for.
+
+        :param message:
+            The :class:`Message` that becomes the latest message.
+
+        """
+        pairs = set(self._canonical_pair(sender, user) for user in to_user_list)
+        if not pairs: return
+
+        lower_ids = [f for f, t in pairs if t == sender.pk and f != sender.pk]
+        higher_ids = [t for f, t in pairs if f == sender.pk]
+        pair_q = Q(from_user=sender.pk, to_user__in=higher_ids) | \
+                 Q(to_user=sender.pk, from_user__in=lower_ids)
+
+        updated = self.filter(pair_q).update(latest_message=message)
+        if updated == len(pairs): return
+
+        existing = set(self.filter(pair_q).values_list('from_user', 'to_user'))
+        missing = [pair for pair in pairs if pair not in existing]
+        sid = transaction.savepoint(using=self.db)
+        try:
+            bulk_insert(self.model,
+                        [self.model(from_user_id=from_user_id,
+                                    to_user_id=to_user_id,
+                                    latest_message=message)
+                         for from_user_id, to_user_id in missing],
+                        using=self.db)
+        except IntegrityError:
+            # Another message created some of the contacts in the meantime.
+            transaction.savepoint_rollback(sid, using=self.db)
+            for from_user_id, to_user_id in missing:
+                self._create_or_update(from_user_id, to_user_id, message)
+        else:
+            transaction.savepoint_commit(sid, using=self.db)
+
     def get_contacts_for(self, user):
         """
         Returns the contacts for this user.
@@ -50,16 +191,26 @@ class MessageContactManager(models.Manager):
             The :class:`User` which to get the contacts for.
 
         """
-        contacts = self.filter(Q(from_user=user) | Q(to_user=user))
+        contacts = self.filter(Q(from_user=user) | Q(to_user=user)) \
+                       .select_related('from_user', 'to_user', 'latest_message')
         return contacts
 
 class MessageManager(models.Manager):
     """ Manager for the :class:`Message` model. """
 
+    @unread.commit_on_success
     def send_message(self, sender, to_user_list, body):
         """
         Send a message from a user, to a user.
 
+        The amount of queries doesn't depend on the amount of recipients, the
+        recipients, contacts and inbox entries are all written in bulk. Users
+        that blocked the sender and inactive users don't receive the message.
+
+        The search index is the exception. It holds a row for every user and
+        term of the message, which are inserted 400 rows per query. A long
+        message to many users costs an extra query for every 400 rows.
+
         :param sender:
             The :class:`User` which sends the message.
 
@@ -69,32 +220,341 @@ class MessageManager(models.Manager):
         :param message:
             String containing the message.
 
+        :return:
+            The sent :class:`Message`, or ``None`` if none of the users can
+            receive it.
+
         """
+        # Every active user receives the message once, unless the sender is
+        # blocked.
+        blocker_ids = get_model('umessages', 'MessageBlock').objects.get_blocker_ids(sender)
+        recipient_pks, recipients = set(), []
+        for user in to_user_list:
+            if user.is_active and user.pk not in recipient_pks \
+                    and user.pk not in blocker_ids:
+                recipient_pks.add(user.pk)
+                recipients.append(user)
+        if not recipients: return None
+
         msg = self.model(sender=sender,
                          body=body)
         msg.save()
 
         # Save the recipients
-        msg.save_recipients(to_user_list)
-        msg.update_contacts(to_user_list)
+        msg.save_recipients(recipients)
+        msg.update_contacts(recipients)
+
+        # Update the unread counters of the recipients
+        recipient_pks = list(recipient_pks)
+        get_model('umessages', 'Inbox').objects.add_unread(recipient_pks, 1)
+        get_model('umessages', 'InboxEntry').objects.add_unread(recipient_pks,
+                                                                sender.pk, 1)
+        get_model('umessages', 'InboxEntry').objects.update_latest(sender,
+                                                                   recipient_pks,
+                                                                   msg)
+        get_model('umessages', 'MessageSearchTerm').objects.index_messages([sender.pk] + recipient_pks,
+                                                                           [msg])
 
         return msg
 
+    @unread.commit_on_success
+    def remove_sent(self, sender, message_pks, undo=False):
+        """
+        Removes messages of a sender with a single ``UPDATE``.
+
+        Only the messages that are send by ``sender`` are changed.
+
+        :param sender:
+            The :class:`User` which sent the messages.
+
+        :param message_pks:
+            List of message id's.
+
+        :param undo:
+            Boolean that if ``True`` restores the messages.
+
+        :return: Integer with the amount of changed messages.
+
+        """
+        if not message_pks: return 0
+        sender_deleted_at = not undo and now() or None
+        message_list = self.filter(pk__in=message_pks,
+                                   sender=sender,
+                                   sender_deleted_at__isnull=not undo)
+        changed_pks = list(message_list.values_list('pk', flat=True))
+        changed = message_list.update(sender_deleted_at=sender_deleted_at)
+        if changed:
+            search_term_model = get_model('umessages', 'MessageSearchTerm')
+            search_term_model.objects.unindex_messages(changed_pks, [sender.pk])
+            if undo:
+                search_term_model.objects.index_messages([sender.pk],
+                                                         self.filter(pk__in=changed_pks))
+
+            recipient_model = get_model('umessages', 'MessageRecipient')
+            recipient_list = recipient_model.objects.filter(message__in=message_pks,
+                                                            message__sender=sender)
+            counterpart_ids = set(recipient_list.values_list('user', flat=True))
+            recipient_list.update(sender_deleted_at=sender_deleted_at)
+            get_model('umessages', 'InboxEntry').objects.refresh_latest(sender,
+                                                                        counterpart_ids)
+        return changed
+
+    @unread.commit_on_success
+    def remove_messages(self, user, message_pks, undo=False):
+        """
+        Removes the messages that a user sent or received, in one
+        transaction. Messages that are moved to the archive are removed from
+        it.
+
+        :param user:
+            The :class:`User` that removes the messages.
+
+        :param message_pks:
+            List of message id's.
+
+        :param undo:
+            Boolean that if ``True`` restores the messages.
+
+        :return: Integer with the amount of changed messages.
+
+        """
+        recipient_model = get_model('umessages', 'MessageRecipient')
+        archive_model = get_model('umessages', 'ArchivedMessage')
+        changed = self.remove_sent(user, message_pks, undo)
+        changed += recipient_model.objects.remove_received(user, message_pks, undo)
+        changed += archive_model.objects.remove(user, message_pks, undo)
+        return changed
+
+    def get_purgeable(self, cutoff):
+        """
+        Returns the messages that the sender and all recipients removed
+        before a date.
+
+        The recipients are excluded with a ``NOT IN`` subquery, which the
+        database runs as an anti-join.
+
+        :param cutoff:
+            ``datetime`` before which the messages are removed.
+
+        """
+        recipient_model = get_model('umessages', 'MessageRecipient')
+        kept = recipient_model.objects.filter(Q(deleted_at__isnull=True) |
+                                              Q(deleted_at__gte=cutoff)) \
+                                      .values('message')
+        return self.filter(sender_deleted_at__lt=cutoff) \
+                   .exclude(pk__in=kept)
+
+    @unread.commit_on_success
+    def purge(self, message_pks):
+        """
+        Deletes messages from the database.
+
+        Contacts that show one of the messages as their latest message are
+        pointed to the message before it, or deleted when there is none.
+
+        :param message_pks:
+            List of message id's.
+
+        :return: Integer with the amount of deleted messages.
+
+        """
+        message_pks = list(message_pks)
+        if not message_pks: return 0
+
+        recipient_model = get_model('umessages', 'MessageRecipient')
+        contact_model = get_model('umessages', 'MessageContact')
+        inbox_entry_model = get_model('umessages', 'InboxEntry')
+
+        for contact in contact_model.objects.filter(latest_message__in=message_pks):
+            latest = recipient_model.objects.filter(conversation=conversation_key(contact.from_user_id,
+                                                                                  contact.to_user_id)) \
+                                            .exclude(message__in=message_pks) \
+                                            .order_by('-sent_at', '-message') \
+                                            .values_list('message', flat=True)[:1]
+            if latest:
+                contact_model.objects.filter(pk=contact.pk).update(latest_message=latest[0])
+            else: contact_model.objects.filter(pk=contact.pk).delete()
+
+        entries = list(inbox_entry_model.objects.filter(latest_message__in=message_pks)
+                                                .values_list('user', 'counterpart'))
+
+        get_model('umessages', 'MessageSearchTerm').objects.unindex_messages(message_pks)
+        recipient_model.objects.filter(message__in=message_pks).delete()
+        purged = self.filter(pk__in=message_pks).count()
+        self.filter(pk__in=message_pks).delete()
+
+        counterparts = dict()
+        for user_id, counterpart_id in entries:
+            counterparts.setdefault(user_id, []).append(counterpart_id)
+        for user_id, counterpart_ids in counterparts.iteritems():
+            inbox_entry_model.objects.refresh_latest(user_id, counterpart_ids)
+        return purged
+
+    def get_archivable(self, cutoff):
+        """
+        Returns the messages sent before a date that can be moved to the
+        archive.
+
+        The latest message of a contact or inbox entry, and messages that are
+        still unread by a recipient stay in the hot tables, so the inbox and
+        the unread counters never need the archive.
+
+        :param cutoff:
+            ``datetime`` before which the messages are sent.
+
+        """
+        recipient_model = get_model('umessages', 'MessageRecipient')
+        contact_model = get_model('umessages', 'MessageContact')
+        inbox_entry_model = get_model('umessages', 'InboxEntry')
+        unread_messages = recipient_model.objects.filter(read_at__isnull=True,
+                                                         deleted_at__isnull=True) \
+                                                 .values('message')
+        return self.filter(sent_at__lt=cutoff) \
+                   .exclude(pk__in=contact_model.objects.values('latest_message')) \
+                   .exclude(pk__in=inbox_entry_model.objects.filter(latest_message__isnull=False)
+                                                            .values('latest_message')) \
+                   .exclude(pk__in=unread_messages)
+
     def get_conversation_between(self, from_user, to_user):
         """ Returns a conversation between two users """
-        messages = self.filter(Q(sender=from_user, recipients=to_user,
-                                 sender_deleted_at__isnull=True) |
-                               Q(sender=to_user, recipients=from_user,
-                                 messagerecipient__deleted_at__isnull=True))
+        key = conversation_key(from_user.pk, to_user.pk)
+        messages = self.filter(Q(messagerecipient__user=from_user,
+                                 messagerecipient__deleted_at__isnull=True) |
+                               Q(messagerecipient__user=to_user,
+                                 messagerecipient__sender_deleted_at__isnull=True),
+                               messagerecipient__conversation=key)
         return messages
 
+    def get_conversation_page(self, from_user, to_user, before=None,
+                              after=None, limit=10):
+        """
+        Returns a page of the conversation between two users.
+
+        Instead of an offset, the page starts at a position in the
+        conversation. Every page costs the same, no matter how far back it
+        is. The page is read from the recipients by their conversation key,
+        in the order of the ``(conversation, sent_at, message)`` index, and
+        from the :class:`ArchivedMessage` rows of the conversation with the
+        same bounds. Unread messages are never archived, so the two overlap
+        in time and are always merged.
+
+        :param from_user:
+            The :class:`User` that views the conversation.
+
+        :param to_user:
+            The :class:`User` with whom the conversation is.
+
+        :param before:
+            Optional tuple of ``sent_at`` and message id. Only messages that
+            are older are returned.
+
+        :param after:
+            Optional tuple of ``sent_at`` and message id. Only messages that
+            are newer are returned. Ignored if ``before`` is supplied.
+
+        :param limit:
+            Integer with the maximum amount of messages on the page.
+
+        :return:
+            Tuple containing a list of messages, newest first, and a boolean
+            if there are more messages in the direction that is paged in.
+
+        """
+        recipient_model = get_model('umessages', 'MessageRecipient')
+        archive_model = get_model('umessages', 'ArchivedMessage')
+        rows = recipient_model.objects.get_conversation(from_user, to_user) \
+                                      .select_related('message')
+        archived = archive_model.objects.get_conversation(from_user, to_user) \
+                                        .select_related('sender')
+        newer = before is None and after is not None
+
+        # Fetch one extra message to know if there is another page.
+        message_list = [row.message for row in
+                        _page_conversation(rows, 'message', before, after)[:limit + 1]]
+
+        message_list += list(_page_conversation(archived, 'message_id',
+                                                before, after)[:limit + 1])
+        message_list.sort(key=message_position, reverse=not newer)
+
+        has_more = len(message_list) > limit
+        message_list = message_list[:limit]
+        if newer:
+            message_list.reverse()
+        return (message_list, has_more)
+
 class MessageRecipientManager(models.Manager):
     """ Manager for the :class:`MessageRecipient` model. """
 
+    def get_conversation(self, user, other):
+        """
+        Returns the recipients of the messages between two users that are
+        visible to ``user``.
+
+        :param user:
+            The :class:`User`, or the id of one, that views the conversation.
+
+        :param other:
+            The :class:`User`, or the id of one, with whom the conversation
+            is.
+
+        """
+        user_id, other_id = getattr(user, 'pk', user), getattr(other, 'pk', other)
+        return self.filter(conversation=conversation_key(user_id, other_id)) \
+                   .filter(Q(user=user_id, deleted_at__isnull=True) |
+                           Q(user=other_id, sender_deleted_at__isnull=True))
+
+    def get_latest_messages(self, user, counterpart_ids):
+        """
+        Returns the latest message that is visible to a user in each
+        conversation with several counterparts, with two queries for all of
+        them.
+
+        :param user:
+            The :class:`User`, or the id of one, that views the conversations.
+
+        :param counterpart_ids:
+            List of user id's with whom the conversations are.
+
+        :return:
+            Dictionary with the counterpart id as key and the latest
+            :class:`Message` as value. Conversations without visible messages
+            are left out.
+
+        """
+        user_id = getattr(user, 'pk', user)
+        keys = dict((conversation_key(user_id, counterpart_id), counterpart_id)
+                    for counterpart_id in counterpart_ids)
+        if not keys: return dict()
+
+        # The conversation key already limits the rows to the pair of users.
+        rows = self.filter(conversation__in=keys.keys()) \
+                   .filter(Q(user=user_id, deleted_at__isnull=True) |
+                           Q(user__in=keys.values(), sender_deleted_at__isnull=True))
+        latest_sent = dict(rows.values_list('conversation')
+                               .annotate(Max('sent_at'))
+                               .order_by())
+        if not latest_sent: return dict()
+
+        # Only the rows sent at one of the latest dates are read, the latest
+        # of them per conversation wins. Messages sent at the same time are
+        # ordered by their id.
+        latest = dict()
+        for row in rows.filter(sent_at__in=set(latest_sent.values())) \
+                       .select_related('message'):
+            counterpart_id = keys[row.conversation]
+            if counterpart_id not in latest or \
+                    message_position(row.message) > message_position(latest[counterpart_id]):
+                latest[counterpart_id] = row.message
+        return latest
+
     def count_unread_messages_for(self, user):
         """
         Returns the amount of unread messages for this user
 
+        The amount is read from the :class:`Inbox` counter of the user, plus
+        the unread broadcasts, and cached until the messages of the user
+        change.
+
         :param user:
             A Django :class:`User`
 
@@ -102,16 +562,18 @@ class MessageRecipientManager(models.Manager):
             An integer with the amount of unread messages.
 
         """
-        unread_total = self.filter(user=user,
-                                   read_at__isnull=True,
-                                   deleted_at__isnull=True).count()
-
-        return unread_total
+        def fetch():
+            return get_model('umessages', 'Inbox').objects.get_unread_count(user) + \
+                   get_model('umessages', 'Broadcast').objects.count_unread_for(user)
+        return unread.get_unread_count(user.pk, fetch)
 
     def count_unread_messages_between(self, to_user, from_user):
         """
         Returns the amount of unread messages between two users
 
+        The amount is read from the :class:`InboxEntry` counter of the users
+        and cached until the messages of ``to_user`` change.
+
         :param to_user:
             A Django :class:`User` for who the messages are for.
 
@@ -122,9 +584,1082 @@ class MessageRecipientManager(models.Manager):
             An integer with the amount of unread messages.
 
         """
-        unread_total = self.filter(message__sender=from_user,
-                                   user=to_user,
-                                   read_at__isnull=True,
-                                   deleted_at__isnull=True).count()
+        def fetch():
+            return get_model('umessages', 'InboxEntry').objects.get_unread_count(to_user,
+                                                                                from_user)
+        return unread.get_unread_count(to_user.pk, fetch, from_user.pk)
+
+    def get_latest_message_id(self, user):
+        """
+        Returns the id of the latest message that a user received and didn't
+        remove, cached until the messages of the user change.
+
+        :param user:
+            A Django :class:`User`.
+
+        :return: Integer with the id of the message, or ``None``.
+
+        """
+        def fetch():
+            message_ids = self.filter(user=user, deleted_at__isnull=True) \
+                              .order_by('-message') \
+                              .values_list('message', flat=True)[:1]
+            return message_ids and message_ids[0] or None
+        return unread.get_latest_message_id(user.pk, fetch)
+
+    @unread.commit_on_success
+    def mark_read_between(self, to_user, from_user, message_pks=None):
+        """
+        Marks the unread messages between two users as read.
+
+        All messages are marked with a single ``UPDATE``, without fetching
+        them first.
+
+        :param to_user:
+            A Django :class:`User` for who the messages are for.
+
+        :param from_user:
+            A Django :class:`User` from whom the messages originate from.
+
+        :param message_pks:
+            Optional list of message id's. When supplied only these messages
+            are marked as read, for ex. the messages on the displayed page.
+
+        :return:
+            An integer with the amount of messages marked as read.
+
+        """
+        unread_list = self.filter(message__sender=from_user,
+                                  user=to_user,
+                                  read_at__isnull=True,
+                                  deleted_at__isnull=True)
+        if message_pks is not None:
+            unread_list = unread_list.filter(message__in=message_pks)
+
+        marked = unread_list.update(read_at=now())
+
+        # Update the unread counters
+        get_model('umessages', 'Inbox').objects.add_unread([to_user.pk],
+                                                           -marked)
+        get_model('umessages', 'InboxEntry').objects.add_unread([to_user.pk],
+                                                                from_user.pk,
+                                                                -marked)
+        return marked
+
+    @unread.commit_on_success
+    def remove_received(self, user, message_pks, undo=False):
+        """
+        Removes the messages that a user received with a single ``UPDATE``.
+
+        Only the messages that ``user`` is a recipient of are changed. The
+        unread counters are adjusted per sender.
+
+        :param user:
+            The :class:`User` which received the messages.
+
+        :param message_pks:
+            List of message id's.
+
+        :param undo:
+            Boolean that if ``True`` restores the messages.
+
+        :return: Integer with the amount of changed messages.
+
+        """
+        if not message_pks: return 0
+        recipient_list = self.filter(user=user,
+                                     message__in=message_pks,
+                                     deleted_at__isnull=not undo)
+
+        # Removed unread messages don't count as unread.
+        unread_changes = recipient_list.filter(read_at__isnull=True) \
+                                       .values_list('message__sender') \
+                                       .annotate(Count('id')) \
+                                       .order_by()
+        unread_changes = list(unread_changes)
+        counterpart_ids = set(recipient_list.values_list('message__sender', flat=True))
+        changed_pks = list(recipient_list.values_list('message', flat=True))
+
+        changed = recipient_list.update(deleted_at=not undo and now() or None)
+        if changed:
+            unread.invalidate_unread([user.pk])
+            search_term_model = get_model('umessages', 'MessageSearchTerm')
+            search_term_model.objects.unindex_messages(changed_pks, [user.pk])
+            if undo:
+                message_model = get_model('umessages', 'Message')
+                search_term_model.objects.index_messages([user.pk],
+                                                         message_model.objects.filter(pk__in=changed_pks))
+
+        sign = undo and 1 or -1
+        inbox_entry_model = get_model('umessages', 'InboxEntry')
+        amounts = dict((sender_id, sign * count) for sender_id, count in unread_changes)
+        inbox_entry_model.objects.add_unread_from(user, amounts)
+        get_model('umessages', 'Inbox').objects.add_unread([user.pk],
+                                                           sum(amounts.values()))
+        inbox_entry_model.objects.refresh_latest(user, counterpart_ids)
+        return changed
+
+    def get_unread_between_ids(self, from_message_id, to_message_id,
+                               user_ids=None):
+        """
+        Returns the unread recipients of the messages in a range of id's.
+
+        :param from_message_id:
+            Integer with the id after which the messages start.
+
+        :param to_message_id:
+            Integer with the id of the last message.
+
+        :param user_ids:
+            Optional list of user id's whose recipients are returned.
+
+        """
+        recipient_list = self.filter(message__gt=from_message_id,
+                                     message__lte=to_message_id,
+                                     read_at__isnull=True,
+                                     deleted_at__isnull=True)
+        if user_ids is not None:
+            recipient_list = recipient_list.filter(user__in=user_ids)
+        return recipient_list
+
+    def count_unread_grouped(self, user_ids, sender_ids=None):
+        """
+        Counts the unread messages of users with a single grouped query.
+
+        :param user_ids:
+            List of user id's to count the unread messages for.
+
+        :param sender_ids:
+            Optional list of user id's. When supplied, the messages are
+            counted per sender.
+
+        :return:
+            Dictionary with the user id, or a tuple of the user id and the
+            sender id, as key and the amount of unread messages as value.
+
+        """
+        unread_list = self.filter(user__in=user_ids,
+                                  read_at__isnull=True,
+                                  deleted_at__isnull=True)
+        if sender_ids is None:
+            return dict(unread_list.values_list('user')
+                                   .annotate(Count('id'))
+                                   .order_by())
+
+        counts = unread_list.filter(message__sender__in=sender_ids) \
+                            .values_list('user', 'message__sender') \
+                            .annotate(Count('id')) \
+                            .order_by()
+        return dict(((user_id, sender_id), count)
+                    for user_id, sender_id, count in counts)
+
+class InboxManager(models.Manager):
+    """ Manager for the :class:`Inbox` model. """
+
+    def initialize(self, user_ids):
+        """
+        Creates the missing counters by counting the unread messages.
+
+        :param user_ids:
+            List of user id's whose counters are created.
+
+        :return:
+            Dictionary with the user id as key and the amount of unread
+            messages as value.
+
+        """
+        recipient_model = get_model('umessages', 'MessageRecipient')
+        counts = recipient_model.objects.count_unread_grouped(user_ids)
+
+        sid = transaction.savepoint(using=self.db)
+        try:
+            bulk_insert(self.model,
+                        [self.model(user_id=user_id,
+                                    unread_count=counts.get(user_id, 0))
+                         for user_id in user_ids],
+                        using=self.db)
+        except IntegrityError:
+            # Some counters were created in the meantime.
+            transaction.savepoint_rollback(sid, using=self.db)
+            for user_id in user_ids:
+                self.get_or_create(user__pk=user_id,
+                                   defaults={'user_id': user_id,
+                                             'unread_count': counts.get(user_id, 0)})
+        else:
+            transaction.savepoint_commit(sid, using=self.db)
+        return counts
+
+    def add_unread(self, user_ids, amount):
+        """
+        Adds an amount to the unread counters of users.
+
+        Missing counters are created by counting the unread messages, which
+        should already include the change.
+
+        :param user_ids:
+            List of user id's whose counters are changed.
+
+        :param amount:
+            Integer that is added to the counters. Negative to subtract.
+
+        """
+        user_ids = list(set(user_ids))
+        if not user_ids or not amount: return
+
+        updated = self.filter(user__in=user_ids) \
+                      .update(unread_count=F('unread_count') + amount)
+        if updated < len(user_ids):
+            existing = set(self.filter(user__in=user_ids)
+                               .values_list('user', flat=True))
+            self.initialize([u for u in user_ids if u not in existing])
+        unread.invalidate_unread(user_ids)
+
+    def get_unread_count(self, user):
+        """
+        Returns the amount of unread messages of a user.
+
+        :param user:
+            A Django :class:`User`.
+
+        """
+        try:
+            unread_count = self.get(user=user).unread_count
+        except self.model.DoesNotExist:
+            unread_count = self.initialize([user.pk]).get(user.pk, 0)
+        return max(unread_count, 0)
+
+class InboxEntryManager(models.Manager):
+    """ Manager for the :class:`InboxEntry` model. """
+
+    def _latest_values(self, message):
+        """ Returns the fields that show ``message`` as the latest message. """
+        if message is None:
+            return {'latest_message': None,
+                    'latest_sent_at': None,
+                    'snippet': ''}
+        return {'latest_message': message,
+                'latest_sent_at': message.sent_at,
+                'snippet': message.body[:SNIPPET_LENGTH]}
+
+    def create_entries(self, pairs, **values):
+        """
+        Creates the missing entries by counting the unread messages.
+
+        :param pairs:
+            List of tuples with the id of the user and of the counterpart.
+
+        :param values:
+            Optional values for the other fields of the entries.
+
+        :return:
+            Dictionary with the pair as key and the amount of unread
+            messages as value.
+
+        """
+        pairs = list(set(pairs))
+        if not pairs: return dict()
+
+        recipient_model = get_model('umessages', 'MessageRecipient')
+        counts = recipient_model.objects.count_unread_grouped([u for u, c in pairs],
+                                                              [c for u, c in pairs])
+
+        sid = transaction.savepoint(using=self.db)
+        try:
+            bulk_insert(self.model,
+                        [self.model(user_id=user_id,
+                                    counterpart_id=counterpart_id,
+                                    unread_count=counts.get((user_id, counterpart_id), 0),
+                                    **values)
+                         for user_id, counterpart_id in pairs],
+                        using=self.db)
+        except IntegrityError:
+            # Some entries were created in the meantime.
+            transaction.savepoint_rollback(sid, using=self.db)
+            for user_id, counterpart_id in pairs:
+                defaults = dict(values)
+                defaults.update({'user_id': user_id,
+                                 'counterpart_id': counterpart_id,
+                                 'unread_count': counts.get((user_id, counterpart_id), 0)})
+                entry, created = self.get_or_create(user__pk=user_id,
+                                                    counterpart__pk=counterpart_id,
+                                                    defaults=defaults)
+                if not created and values:
+                    self.filter(pk=entry.pk).update(**values)
+        else:
+            transaction.savepoint_commit(sid, using=self.db)
+        return counts
+
+    def initialize(self, user_ids, counterpart_id):
+        """
+        Creates the missing counters by counting the unread messages.
+
+        :param user_ids:
+            List of user id's whose counters are created.
+
+        :param counterpart_id:
+            Integer with the id of the user that sent the messages.
+
+        :return:
+            Dictionary with the user id as key and the amount of unread
+            messages as value.
+
+        """
+        counts = self.create_entries([(user_id, counterpart_id)
+                                      for user_id in user_ids])
+        return dict((user_id, count) for (user_id, sender_id), count
+                    in counts.iteritems())
+
+    def update_latest(self, sender, user_ids, message):
+        """
+        Shows a message as the latest message in the entries of the sender
+        and the recipients, using one ``UPDATE``.
+
+        Should be called after the unread counters are updated, because
+        missing entries are created by counting the messages.
+
+        :param sender:
+            The :class:`User` which sent the message.
+
+        :param user_ids:
+            List of user id's of the recipients.
+
+        :param message:
+            The :class:`Message` that was sent.
+
+        """
+        user_ids = list(set(user_ids))
+        if not user_ids: return
+
+        pairs = set([(user_id, sender.pk) for user_id in user_ids] +
+                    [(sender.pk, user_id) for user_id in user_ids])
+        pair_q = Q(user__in=user_ids, counterpart=sender.pk) | \
+                 Q(user=sender.pk, counterpart__in=user_ids)
+
+        values = self._latest_values(message)
+        updated = self.filter(pair_q).update(**values)
+        if updated < len(pairs):
+            existing = set(self.filter(pair_q).values_list('user', 'counterpart'))
+            self.create_entries([p for p in pairs if p not in existing],
+                                **values)
+
+    def refresh_latest(self, user, counterpart_ids):
+        """
+        Looks up the latest message that is visible to a user for entries,
+        after messages are removed or restored.
+
+        The latest messages of all conversations are looked up at once, and
+        the entries are updated with an ``UPDATE`` per 100 entries.
+
+        :param user:
+            A Django :class:`User` or the id of one.
+
+        :param counterpart_ids:
+            List of user id's of the counterparts whose entries are refreshed.
+
+        """
+        user_id = getattr(user, 'pk', user)
+        counterpart_ids = list(set(counterpart_ids))
+        if not counterpart_ids: return
+
+        recipient_model = get_model('umessages', 'MessageRecipient')
+        latest = recipient_model.objects.get_latest_messages(user_id, counterpart_ids)
+        rows = dict((counterpart_id, self._latest_values(latest.get(counterpart_id)))
+                    for counterpart_id in counterpart_ids)
+        updated = bulk_update(self.model, 'counterpart', rows,
+                              filters={'user': user_id}, using=self.db)
+        if updated < len(rows):
+            existing = set(self.filter(user=user_id, counterpart__in=counterpart_ids)
+                               .values_list('counterpart', flat=True))
+            for counterpart_id in counterpart_ids:
+                if counterpart_id not in existing:
+                    self.create_entries([(user_id, counterpart_id)],
+                                        **rows[counterpart_id])
+
+    def get_inbox_for(self, user):
+        """
+        Returns the entries in the inbox of a user, latest conversation
+        first, with the counterparts loaded.
+
+        :param user:
+            A Django :class:`User`.
+
+        """
+        return self.filter(user=user, latest_sent_at__isnull=False) \
+                   .order_by('-latest_sent_at', '-pk') \
+                   .select_related('counterpart')
+
+    def get_inbox_page(self, user, before=None, after=None, limit=50):
+        """
+        Returns a page of the inbox of a user.
+
+        Just like :meth:`MessageManager.get_conversation_page` the page
+        starts at a position instead of an offset, here the
+        ``(latest_sent_at, id)`` of an entry. Every page is read from the
+        ``(user, latest_sent_at, id)`` index, without counting the entries.
+
+        :param user:
+            A Django :class:`User`.
+
+        :param before:
+            Optional tuple of ``latest_sent_at`` and entry id. Only older
+            entries are returned.
+
+        :param after:
+            Optional tuple of ``latest_sent_at`` and entry id. Only newer
+            entries are returned. Ignored if ``before`` is supplied.
+
+        :param limit:
+            Integer with the maximum amount of entries on the page.
+
+        :return:
+            Tuple containing a list of entries, latest first, and a boolean
+            if there are more entries in the direction that is paged in.
+
+        """
+        # Fetch one extra entry to know if there is another page.
+        entry_list = list(_page_conversation(self.get_inbox_for(user), 'pk',
+                                             before, after,
+                                             date_field='latest_sent_at')[:limit + 1])
+        has_more = len(entry_list) > limit
+        entry_list = entry_list[:limit]
+        if before is None and after is not None:
+            entry_list.reverse()
+        return (entry_list, has_more)
+
+    def add_unread(self, user_ids, counterpart_id, amount):
+        """
+        Adds an amount to the unread counters of users for the messages of
+        a counterpart.
+
+        Missing counters are created by counting the unread messages, which
+        should already include the change.
+
+        :param user_ids:
+            List of user id's whose counters are changed.
+
+        :param counterpart_id:
+            Integer with the id of the user that sent the messages.
+
+        :param amount:
+            Integer that is added to the counters. Negative to subtract.
+
+        """
+        user_ids = list(set(user_ids))
+        if not user_ids or not amount: return
+
+        updated = self.filter(user__in=user_ids,
+                              counterpart=counterpart_id) \
+                      .update(unread_count=F('unread_count') + amount)
+        if updated < len(user_ids):
+            existing = set(self.filter(user__in=user_ids,
+                                       counterpart=counterpart_id)
+                               .values_list('user', flat=True))
+            self.initialize([u for u in user_ids if u not in existing],
+                            counterpart_id)
+
+    def add_unread_from(self, user, amounts):
+        """
+        Adds amounts to the unread counters of a user for the messages of
+        several counterparts, with an ``UPDATE`` per 100 counters.
+
+        Missing counters are created by counting the unread messages, which
+        should already include the change.
+
+        :param user:
+            A Django :class:`User` or the id of one.
+
+        :param amounts:
+            Dictionary with the counterpart id as key and the integer that is
+            added to the counter as value. Negative to subtract.
+
+        """
+        user_id = getattr(user, 'pk', user)
+        rows = dict((counterpart_id, {'unread_count': amount})
+                    for counterpart_id, amount in amounts.iteritems() if amount)
+        if not rows: return
+
+        updated = bulk_update(self.model, 'counterpart', rows,
+                              filters={'user': user_id}, add=('unread_count',),
+                              using=self.db)
+        if updated < len(rows):
+            existing = set(self.filter(user=user_id, counterpart__in=rows.keys())
+                               .values_list('counterpart', flat=True))
+            for counterpart_id in rows:
+                if counterpart_id not in existing:
+                    self.initialize([user_id], counterpart_id)
+
+    def get_unread_counts(self, user, counterpart_ids):
+        """
+        Returns the amount of unread messages of a user from several
+        counterparts, using one query for all of them.
+
+        :param user:
+            A Django :class:`User` for who the messages are for.
+
+        :param counterpart_ids:
+            List of user id's from whom the messages originate from.
+
+        :return:
+            Dictionary with the counterpart id as key and the amount of unread
+            messages as value.
+
+        """
+        if not counterpart_ids: return dict()
+
+        counts = dict(self.filter(user=user, counterpart__in=counterpart_ids)
+                          .values_list('counterpart', 'unread_count'))
+
+        # Counters that don't exist yet are counted from the messages.
+        missing = [c for c in counterpart_ids if c not in counts]
+        if missing:
+            recipient_model = get_model('umessages', 'MessageRecipient')
+            grouped = recipient_model.objects.count_unread_grouped([user.pk],
+                                                                   missing)
+            for counterpart_id in missing:
+                counts[counterpart_id] = grouped.get((user.pk, counterpart_id), 0)
+
+        return dict((c, max(count, 0)) for c, count in counts.iteritems())
+
+    def get_unread_count(self, user, counterpart):
+        """
+        Returns the amount of unread messages of a user from a counterpart.
+
+        :param user:
+            A Django :class:`User` for who the messages are for.
+
+        :param counterpart:
+            A Django :class:`User` from whom the messages originate from.
+
+        """
+        try:
+            unread_count = self.get(user=user,
+                                    counterpart=counterpart).unread_count
+        except self.model.DoesNotExist:
+            unread_count = self.initialize([user.pk],
+                                           counterpart.pk).get(user.pk, 0)
+        return max(unread_count, 0)
+
+class BroadcastManager(models.Manager):
+    """ Manager for the :class:`Broadcast` model. """
+
+    def send_broadcast(self, sender, body):
+        """
+        Send a broadcast to all users.
+
+        Only the broadcast itself is stored, which makes sending independent
+        of the amount of users.
+
+        :param sender:
+            The :class:`User` which sends the broadcast.
+
+        :param body:
+            String containing the message.
+
+        """
+        return self.create(sender=sender, body=body)
+
+    def _states_for(self, user, **kwargs):
+        """ Returns the broadcast id's of the states of a user. """
+        state_model = get_model('umessages', 'BroadcastState')
+        return state_model.objects.filter(user=user, **kwargs) \
+                                  .values('broadcast')
+
+    def get_broadcasts_for(self, user, include_removed=False):
+        """
+        Returns the broadcasts that are in the inbox of a user.
+
+        :param user:
+            A Django :class:`User`.
+
+        :param include_removed:
+            Boolean that if ``True`` also returns the broadcasts that the
+            user removed from the inbox.
+
+        """
+        broadcasts = self.filter(sent_at__gte=user.date_joined)
+        if include_removed: return broadcasts
+        return broadcasts.exclude(pk__in=self._states_for(user,
+                                                          deleted_at__isnull=False))
+
+    def count_unread_for(self, user):
+        """
+        Returns the amount of broadcasts that a user hasn't read.
+
+        :param user:
+            A Django :class:`User`.
+
+        """
+        return self.get_broadcasts_for(user) \
+                   .exclude(pk__in=self._states_for(user,
+                                                    read_at__isnull=False)) \
+                   .count()
+
+    def attach_read(self, user, broadcast_list):
+        """
+        Sets an ``is_read`` attribute on broadcasts, using one query.
+
+        :param user:
+            A Django :class:`User`.
+
+        :param broadcast_list:
+            List of :class:`Broadcast`.
+
+        :return: The same list of broadcasts.
+
+        """
+        read = set()
+        if broadcast_list:
+            state_model = get_model('umessages', 'BroadcastState')
+            read = set(state_model.objects.filter(user=user,
+                                                  broadcast__in=[b.pk for b in broadcast_list],
+                                                  read_at__isnull=False)
+                                          .values_list('broadcast', flat=True))
+        for broadcast in broadcast_list:
+            broadcast.is_read = broadcast.pk in read
+        return broadcast_list
+
+class BroadcastStateManager(models.Manager):
+    """ Manager for the :class:`BroadcastState` model. """
+
+    @unread.commit_on_success
+    def set_state(self, user, broadcast_pks, **values):
+        """
+        Sets the state of broadcasts for a user.
+
+        The existing states are changed with one ``UPDATE``, the states that
+        don't exist yet are inserted at once.
+
+        :param user:
+            A Django :class:`User`.
+
+        :param broadcast_pks:
+            List of broadcast id's.
+
+        :param values:
+            The fields that are set, ``read_at`` and/or ``deleted_at``.
+
+        :return: Integer with the amount of states that are set.
+
+        """
+        broadcast_pks = set(broadcast_pks)
+        if not broadcast_pks: return 0
+        # Removed after the transaction commits, see unread.commit_on_success.
+        unread.invalidate_unread([user.pk])
+
+        changed = self.filter(user=user, broadcast__in=broadcast_pks) \
+                      .update(**values)
+        if changed == len(broadcast_pks): return changed
+
+        existing = set(self.filter(user=user, broadcast__in=broadcast_pks)
+                           .values_list('broadcast', flat=True))
+        missing = [pk for pk in broadcast_pks if pk not in existing]
+        sid = transaction.savepoint(using=self.db)
+        try:
+            bulk_insert(self.model,
+                        [self.model(user_id=user.pk, broadcast_id=pk, **values)
+                         for pk in missing],
+                        using=self.db)
+        except IntegrityError:
+            # The user acted on the broadcasts in another request.
+            transaction.savepoint_rollback(sid, using=self.db)
+            for pk in missing:
+                state, created = self.get_or_create(user=user,
+                                                    broadcast__pk=pk,
+                                                    defaults=dict(broadcast_id=pk,
+                                                                  **values))
+                if not created: self.filter(pk=state.pk).update(**values)
+        else:
+            transaction.savepoint_commit(sid, using=self.db)
+        return changed + len(missing)
+
+    def mark_read(self, user, broadcast_pks):
+        """
+        Marks broadcasts as read for a user.
 
-        return unread_total
+        :param user:
+            A Django :class:`User`.
+
+        :param broadcast_pks:
+            List of broadcast id's.
+
+        """
+        unread_pks = set(broadcast_pks) - \
+                set(self.filter(user=user, broadcast__in=broadcast_pks,
+                                read_at__isnull=False)
+                        .values_list('broadcast', flat=True))
+        return self.set_state(user, unread_pks, read_at=now())
+
+class MessageDigestRunManager(models.Manager):
+    """ Manager for the :class:`MessageDigestRun` model. """
+
+    def get_current_run(self):
+        """
+        Returns the run that didn't finish yet, or starts a new one for the
+        messages that were sent since the last run.
+
+        :return: A :class:`MessageDigestRun`.
+
+        """
+        try:
+            return self.filter(finished_at__isnull=True).order_by('-pk')[0]
+        except IndexError:
+            pass
+
+        try:
+            from_message_id = self.order_by('-to_message_id')[0].to_message_id
+        except IndexError:
+            from_message_id = 0
+
+        message_ids = get_model('umessages', 'Message').objects.order_by('-pk') \
+                                                       .values_list('pk', flat=True)[:1]
+        to_message_id = message_ids and message_ids[0] or from_message_id
+        return self.create(from_message_id=from_message_id,
+                           to_message_id=max(to_message_id, from_message_id))
+
+class ArchivedMessageManager(models.Manager):
+    """ Manager for the :class:`ArchivedMessage` model. """
+
+    def get_conversation(self, user, other):
+        """
+        Returns the archived messages between two users that are visible to
+        ``user``.
+
+        :param user:
+            The :class:`User`, or the id of one, that views the conversation.
+
+        :param other:
+            The :class:`User`, or the id of one, with whom the conversation
+            is.
+
+        """
+        user_id, other_id = getattr(user, 'pk', user), getattr(other, 'pk', other)
+        return self.filter(conversation=conversation_key(user_id, other_id)) \
+                   .filter(Q(recipient=user_id, recipient_deleted=False) |
+                           Q(recipient=other_id, sender_deleted=False))
+
+    def remove(self, user, message_ids, undo=False):
+        """
+        Removes archived messages for a user, with an ``UPDATE`` for the
+        messages that the user sent and one for those the user received.
+
+        :param user:
+            The :class:`User` that removes the messages.
+
+        :param message_ids:
+            List of the id's of the messages before they were archived.
+
+        :param undo:
+            Boolean that if ``True`` restores the messages.
+
+        :return: Integer with the amount of changed messages.
+
+        """
+        if not message_ids: return 0
+        changed_ids = set()
+        for field in ('sender', 'recipient'):
+            deleted_field = '%s_deleted' % field
+            rows = self.filter(**{'message_id__in': message_ids,
+                                  field: user,
+                                  deleted_field: undo})
+            changed_ids.update(rows.values_list('message_id', flat=True))
+            rows.update(**{deleted_field: not undo})
+        return len(changed_ids)
+
+    def get_purgeable(self):
+        """
+        Returns the archived messages that the sender and the recipient
+        removed.
+
+        """
+        return self.filter(sender_deleted=True, recipient_deleted=True)
+
+    @unread.commit_on_success
+    def archive(self, message_pks):
+        """
+        Moves messages from the hot tables to the archive.
+
+        Every recipient of a message becomes an archived message. Messages
+        that are removed by the sender and all recipients are deleted without
+        being archived.
+
+        :param message_pks:
+            List of message id's, see
+            :meth:`MessageManager.get_archivable`.
+
+        :return: Integer with the amount of archived messages.
+
+        """
+        message_pks = list(message_pks)
+        if not message_pks: return 0
+
+        recipient_model = get_model('umessages', 'MessageRecipient')
+        message_model = get_model('umessages', 'Message')
+
+        recipient_list = recipient_model.objects.filter(message__in=message_pks) \
+                                                .select_related('message')
+        archived, archived_pks = [], set()
+        for recipient in recipient_list:
+            message = recipient.message
+            sender_deleted = message.sender_deleted_at is not None
+            recipient_deleted = recipient.deleted_at is not None
+            if sender_deleted and recipient_deleted: continue
+            archived.append(self.model(conversation=conversation_key(message.sender_id,
+                                                                     recipient.user_id),
+                                       message_id=message.pk,
+                                       sender_id=message.sender_id,
+                                       recipient_id=recipient.user_id,
+                                       body=message.body,
+                                       sent_at=message.sent_at,
+                                       sender_deleted=sender_deleted,
+                                       recipient_deleted=recipient_deleted))
+            archived_pks.add(message.pk)
+        bulk_insert(self.model, archived, using=self.db)
+
+        get_model('umessages', 'MessageSearchTerm').objects.unindex_messages(message_pks)
+        recipient_model.objects.filter(message__in=message_pks).delete()
+        message_model.objects.filter(pk__in=message_pks).delete()
+        return len(archived_pks)
+
+class MessageSearchTermManager(models.Manager):
+    """ Manager for the :class:`MessageSearchTerm` model. """
+
+    def _terms_for(self, message, user_ids):
+        terms = search_terms(message.body)
+        return [self.model(user_id=user_id, term=term, message_id=message.pk)
+                for user_id in set(user_ids) for term in terms]
+
+    def index_messages(self, user_ids, message_list):
+        """
+        Adds messages to the search index of users, with one multi-row
+        ``INSERT`` per batch.
+
+        :param user_ids:
+            List of id's of the users that can see the messages.
+
+        :param message_list:
+            List of :class:`Message`.
+
+        """
+        rows = []
+        for message in message_list:
+            rows.extend(self._terms_for(message, user_ids))
+        bulk_insert(self.model, rows, using=self.db)
+
+    def unindex_messages(self, message_pks, user_ids=None):
+        """
+        Removes messages from the search index.
+
+        :param message_pks:
+            List of message id's.
+
+        :param user_ids:
+            Optional list of id's of the users from whose index the messages
+            are removed. Defaults to all users.
+
+        """
+        rows = self.filter(message__in=message_pks)
+        if user_ids is not None:
+            rows = rows.filter(user__in=user_ids)
+        rows.delete()
+
+    @unread.commit_on_success
+    def reindex(self, message_pks):
+        """
+        Builds the search index of messages again, for the sender and
+        recipients that didn't remove them.
+
+        :param message_pks:
+            List of message id's.
+
+        :return: Integer with the amount of indexed messages.
+
+        """
+        message_model = get_model('umessages', 'Message')
+        recipient_model = get_model('umessages', 'MessageRecipient')
+
+        message_list = list(message_model.objects.filter(pk__in=message_pks))
+        user_ids = dict([(m.pk, m.sender_deleted_at is None and [m.sender_id] or [])
+                         for m in message_list])
+        for message_id, user_id in recipient_model.objects.filter(message__in=message_pks,
+                                                                  deleted_at__isnull=True) \
+                                                          .values_list('message', 'user'):
+            user_ids[message_id].append(user_id)
+
+        self.unindex_messages(message_pks)
+        rows = []
+        for message in message_list:
+            rows.extend(self._terms_for(message, user_ids[message.pk]))
+        bulk_insert(self.model, rows, using=self.db)
+        return len(message_list)
+
+    def search(self, user, query):
+        """
+        Searches the messages that are visible to a user.
+
+        Only the index rows of the user for the terms of the query are read.
+        Messages are ranked by the amount of terms they contain, newest first
+        when they contain as many. Ordering by ``message__id`` instead of
+        ``message`` keeps the ordering of :class:`Message` out of the query,
+        so it doesn't join the messages. Archived messages are not indexed.
+
+        :param user:
+            The :class:`User` that searches.
+
+        :param query:
+            String with the words to search for.
+
+        :return:
+            Queryset of dictionaries with the ``message`` id and its
+            ``rank``.
+
+        """
+        terms = search_terms(query)
+        if not terms: return self.none()
+        return self.filter(user=user, term__in=terms) \
+                   .values('message') \
+                   .annotate(rank=Count('id')) \
+                   .order_by('-rank', '-message__id')
+
+class UserSearchNameManager(models.Manager):
+    """ Manager for the :class:`UserSearchName` model. """
+
+    def update_names(self, user):
+        """
+        Stores the names by which a user is found, if they changed.
+
+        :param user:
+            The :class:`User` whose names are stored.
+
+        """
+        names = search_names(user)
+        current = set(self.filter(user=user).values_list('name', flat=True))
+        if names == current: return
+        if current - names:
+            self.filter(user=user, name__in=current - names).delete()
+        bulk_insert(self.model,
+                    [self.model(user_id=user.pk, name=name) for name in names - current],
+                    using=self.db)
+
+    def autocomplete(self, prefix, exclude_user=None, limit=10):
+        """
+        Returns the active users of which a name starts with a prefix.
+
+        The id's of the users found for a prefix are cached for
+        ``USERENA_UMESSAGES_AUTOCOMPLETE_TIMEOUT`` seconds. The users
+        themselves are fetched by their id's every time, so renamed and
+        deactivated users are left out right away.
+
+        :param prefix:
+            String with the start of the name, the case is ignored.
+
+        :param exclude_user:
+            Optional :class:`User` that searches. The user and the users that
+            blocked the user are left out.
+
+        :param limit:
+            Integer with the maximum amount of users.
+
+        :return:
+            List of dictionaries with the ``username`` and the ``name`` of a
+            user, ordered by the name that matched.
+
+        """
+        prefix = prefix.strip().lower()[:SEARCH_NAME_LENGTH]
+        if not prefix: return []
+
+        # One more than the limit, in case the excluded user is found.
+        key = AUTOCOMPLETE_CACHE_KEY % (limit + 1,
+                                        md5_constructor(prefix.encode('utf-8')).hexdigest())
+        user_ids = cache.get(key)
+        if user_ids is None:
+            user_ids = []
+            # A user has a row for every name that may match.
+            rows = self.filter(name__startswith=prefix, user__is_active=True) \
+                       .order_by('name') \
+                       .values_list('user', flat=True)
+            for user_id in rows[:(limit + 1) * 4]:
+                if user_id not in user_ids: user_ids.append(user_id)
+                if len(user_ids) > limit: break
+            cache.set(key, user_ids,
+                      userena_settings.USERENA_UMESSAGES_AUTOCOMPLETE_TIMEOUT)
+
+        if exclude_user is not None:
+            excluded_ids = get_model('umessages', 'MessageBlock').objects.get_blocker_ids(exclude_user)
+            user_ids = [pk for pk in user_ids
+                        if pk != exclude_user.pk and pk not in excluded_ids]
+
+        # Only the id's are cached, users that are renamed or deactivated
+        # since are checked again by their primary key.
+        users = User.objects.filter(is_active=True).in_bulk(user_ids)
+        user_list = []
+        for pk in user_ids:
+            user = users.get(pk)
+            if user is None: continue
+            if not [name for name in search_names(user) if name.startswith(prefix)]:
+                continue
+            user_list.append({'username': user.username,
+                              'name': user.get_full_name() or user.username})
+        return user_list[:limit]
+
+class MessageBlockManager(models.Manager):
+    """ Manager for the :class:`MessageBlock` model. """
+
+    def block(self, user, blocked_user):
+        """
+        Stops messages from ``blocked_user`` to ``user``.
+
+        :return: The :class:`MessageBlock`.
+
+        """
+        block, created = self.get_or_create(user=user, blocked_user=blocked_user)
+        return block
+
+    def unblock(self, user, blocked_user):
+        """ Allows messages from ``blocked_user`` to ``user`` again. """
+        self.filter(user=user, blocked_user=blocked_user).delete()
+
+    def get_blocker_ids(self, sender):
+        """
+        Returns the id's of the users that blocked a sender.
+
+        The id's are cached until a block of the sender changes, so users
+        that send many messages don't query the blocks every time.
+
+        :param sender:
+            The :class:`User`, or the id of one, that sends messages.
+
+        :return: Set of user id's.
+
+        """
+        sender_id = getattr(sender, 'pk', sender)
+        key = BLOCKER_IDS_CACHE_KEY % sender_id
+        blocker_ids = cache.get(key)
+        if blocker_ids is None:
+            blocker_ids = set(self.filter(blocked_user=sender_id)
+                                  .values_list('user', flat=True))
+            cache.set(key, blocker_ids,
+                      userena_settings.USERENA_UMESSAGES_CACHE_TIMEOUT)
+        return blocker_ids
+
+    def invalidate_blocker_ids(self, sender_id):
+        """ Removes the cached id's of the users that blocked a sender. """
+        cache.delete(BLOCKER_IDS_CACHE_KEY % sender_id)
+
+    def filter_recipients(self, queryset, sender):
+        """
+        Returns the users in ``queryset`` that can receive messages from a
+        sender. Inactive users and users that blocked the sender are left
+        out by the query itself.
+
+        :param queryset:
+            Queryset of :class:`User`.
+
+        :param sender:
+            The :class:`User` that sends messages.
+
+        """
+        queryset = queryset.filter(is_active=True)
+        blocker_ids = self.get_blocker_ids(sender)
+        if blocker_ids:
+            queryset = queryset.exclude(pk__in=blocker_ids)
+        return queryset
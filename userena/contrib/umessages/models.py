@@ -1,10 +1,19 @@
 from django.db import models
+from django.db.models.signals import post_save, post_delete
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.auth.models import User
 from django.utils.text import truncate_words
 
 from userena.contrib.umessages.managers import (MessageManager, MessageContactManager,
-                                                MessageRecipientManager)
+                                                MessageRecipientManager, InboxManager,
+                                                InboxEntryManager, BroadcastManager,
+                                                BroadcastStateManager, MessageDigestRunManager,
+                                                ArchivedMessageManager, MessageSearchTermManager,
+                                                UserSearchNameManager, MessageBlockManager)
+from userena.contrib.umessages.utils import (bulk_insert, conversation_key,
+                                             SNIPPET_LENGTH, SEARCH_TERM_LENGTH,
+                                             SEARCH_NAME_LENGTH)
+from userena.contrib.umessages.unread import invalidate_broadcasts
 
 class MessageContact(models.Model):
     """
@@ -13,6 +22,9 @@ class MessageContact(models.Model):
     A contact is a user to whom a user has send a message to or
     received a message from.
 
+    There is one contact per pair of users, stored with the lowest user id as
+    ``from_user``. Use :meth:`opposite_user` to get the other user.
+
     """
     from_user = models.ForeignKey(User, verbose_name=_("from user"),
                                   related_name=('from_users'))
@@ -71,6 +83,20 @@ class MessageRecipient(models.Model):
                                       null=True,
                                       blank=True)
 
+    # Copied from the message, so a conversation is read from this table
+    # alone. See :func:`userena.contrib.umessages.utils.conversation_key`.
+    conversation = models.BigIntegerField(_("conversation"),
+                                          null=True,
+                                          blank=True)
+
+    sent_at = models.DateTimeField(_("sent at"),
+                                   null=True,
+                                   blank=True)
+
+    sender_deleted_at = models.DateTimeField(_("sender deleted at"),
+                                             null=True,
+                                             blank=True)
+
     objects = MessageRecipientManager()
 
     class Meta:
@@ -121,6 +147,8 @@ class Message(models.Model):
         """
         Save the recipients for this message
 
+        All recipients are inserted at once.
+
         :param to_user_list:
             A list which elements are :class:`User` to whom the message is for.
 
@@ -128,12 +156,14 @@ class Message(models.Model):
             Boolean indicating if any users are saved.
 
         """
-        created = False
-        for user in to_user_list:
-            MessageRecipient.objects.create(user=user,
-                                            message=self)
-            created = True
-        return created
+        bulk_insert(MessageRecipient,
+                    [MessageRecipient(user_id=user.pk,
+                                      message=self,
+                                      conversation=conversation_key(self.sender_id,
+                                                                    user.pk),
+                                      sent_at=self.sent_at)
+                     for user in to_user_list])
+        return len(to_user_list) > 0
 
     def update_contacts(self, to_user_list):
         """
@@ -146,10 +176,330 @@ class Message(models.Model):
             A boolean if a user is contact is updated.
 
         """
-        updated = False
-        for user in to_user_list:
-            MessageContact.objects.update_contact(self.sender,
-                                                  user,
-                                                  self)
-            updated = True
-        return updated
+        MessageContact.objects.update_contacts(self.sender,
+                                               to_user_list,
+                                               self)
+        return len(to_user_list) > 0
+
+class Inbox(models.Model):
+    """
+    Denormalized amount of unread messages of a user.
+
+    The counter is updated when messages are sent, read, removed and
+    restored. The ``reconcile_unread`` command repairs any drift.
+
+    """
+    user = models.OneToOneField(User,
+                                verbose_name=_("user"),
+                                related_name='message_inbox')
+
+    unread_count = models.IntegerField(_("unread messages"),
+                                       default=0)
+
+    objects = InboxManager()
+
+    class Meta:
+        verbose_name = _("inbox")
+        verbose_name_plural = _("inboxes")
+
+    def __unicode__(self):
+        return (_("inbox of %(user)s")
+                % {'user': self.user.username})
+
+class InboxEntry(models.Model):
+    """
+    Summary of the conversation of a user with a counterpart, as shown in the
+    inbox of the user.
+
+    Holds the amount of unread messages from the counterpart and the latest
+    message that is visible to the user, so the inbox is read from this
+    table alone.
+
+    """
+    user = models.ForeignKey(User,
+                             verbose_name=_("user"),
+                             related_name='message_inbox_entries')
+
+    counterpart = models.ForeignKey(User,
+                                    verbose_name=_("counterpart"),
+                                    related_name='message_inbox_counterparts')
+
+    unread_count = models.IntegerField(_("unread messages"),
+                                       default=0)
+
+    latest_message = models.ForeignKey('Message',
+                                       verbose_name=_("latest message"),
+                                       related_name='inbox_entries',
+                                       null=True,
+                                       blank=True,
+                                       on_delete=models.SET_NULL)
+
+    latest_sent_at = models.DateTimeField(_("latest sent at"),
+                                          null=True,
+                                          blank=True)
+
+    snippet = models.CharField(_("snippet"),
+                               max_length=SNIPPET_LENGTH,
+                               blank=True)
+
+    objects = InboxEntryManager()
+
+    class Meta:
+        unique_together = ('user', 'counterpart')
+        verbose_name = _("inbox entry")
+        verbose_name_plural = _("inbox entries")
+
+    def __unicode__(self):
+        return (_("%(counterpart)s in the inbox of %(user)s")
+                % {'counterpart': self.counterpart.username,
+                   'user': self.user.username})
+
+class Broadcast(models.Model):
+    """
+    Announcement from staff to all users.
+
+    A broadcast is stored once, instead of once per recipient. It's shown to
+    every user that joined before it was sent. Only when a user reads or
+    removes it, a :class:`BroadcastState` is stored for that user.
+
+    """
+    sender = models.ForeignKey(User,
+                               related_name='sent_broadcasts',
+                               verbose_name=_("sender"))
+
+    body = models.TextField(_("body"))
+
+    sent_at = models.DateTimeField(_("sent at"),
+                                   auto_now_add=True)
+
+    objects = BroadcastManager()
+
+    class Meta:
+        ordering = ['-sent_at']
+        verbose_name = _("broadcast")
+        verbose_name_plural = _("broadcasts")
+
+    def __unicode__(self):
+        """ Human representation, displaying first ten words of the body. """
+        truncated_body = truncate_words(self.body, 10)
+        return "%(truncated_body)s" % {'truncated_body': truncated_body}
+
+class BroadcastState(models.Model):
+    """ The state of a :class:`Broadcast` for a user that acted on it. """
+    broadcast = models.ForeignKey(Broadcast,
+                                  related_name='states',
+                                  verbose_name=_("broadcast"))
+
+    user = models.ForeignKey(User,
+                             related_name='broadcast_states',
+                             verbose_name=_("user"))
+
+    read_at = models.DateTimeField(_("read at"),
+                                   null=True,
+                                   blank=True)
+
+    deleted_at = models.DateTimeField(_("deleted at"),
+                                      null=True,
+                                      blank=True)
+
+    objects = BroadcastStateManager()
+
+    class Meta:
+        unique_together = ('broadcast', 'user')
+        verbose_name = _("broadcast state")
+        verbose_name_plural = _("broadcast states")
+
+    def __unicode__(self):
+        return (_("%(broadcast)s for %(user)s")
+                % {'broadcast': self.broadcast,
+                   'user': self.user.username})
+
+class MessageDigestRun(models.Model):
+    """
+    Progress of the ``send_message_digests`` command.
+
+    A run sends the unread messages with an id in ``(from_message_id,
+    to_message_id]``. The users are handled in the order of their id, and
+    ``last_user_id`` is stored before their digests are send. A run that
+    crashed continues after that user, so nobody gets a digest twice.
+
+    """
+    from_message_id = models.IntegerField(_("from message id"))
+
+    to_message_id = models.IntegerField(_("to message id"))
+
+    last_user_id = models.IntegerField(_("last user id"),
+                                       default=0)
+
+    started_at = models.DateTimeField(_("started at"),
+                                      auto_now_add=True)
+
+    finished_at = models.DateTimeField(_("finished at"),
+                                       null=True,
+                                       blank=True)
+
+    objects = MessageDigestRunManager()
+
+    class Meta:
+        ordering = ['-to_message_id']
+        verbose_name = _("message digest run")
+        verbose_name_plural = _("message digest runs")
+
+    def __unicode__(self):
+        return (_("messages %(from)s to %(to)s")
+                % {'from': self.from_message_id,
+                   'to': self.to_message_id})
+
+class ArchivedMessage(models.Model):
+    """
+    Message that is moved out of the hot tables by the ``archive_messages``
+    command.
+
+    There is one row per recipient, holding everything that is needed to show
+    the message in a conversation. The archive is only read when a user pages
+    past the oldest message in :class:`MessageRecipient`.
+
+    """
+    conversation = models.BigIntegerField(_("conversation"))
+
+    message_id = models.IntegerField(_("message id"))
+
+    sender = models.ForeignKey(User,
+                               verbose_name=_("sender"),
+                               related_name='archived_sent_messages')
+
+    recipient = models.ForeignKey(User,
+                                  verbose_name=_("recipient"),
+                                  related_name='archived_received_messages')
+
+    body = models.TextField(_("body"))
+
+    sent_at = models.DateTimeField(_("sent at"))
+
+    sender_deleted = models.BooleanField(_("removed by sender"),
+                                         default=False)
+
+    recipient_deleted = models.BooleanField(_("removed by recipient"),
+                                            default=False)
+
+    objects = ArchivedMessageManager()
+
+    class Meta:
+        unique_together = ('message_id', 'recipient')
+        verbose_name = _("archived message")
+        verbose_name_plural = _("archived messages")
+
+    def __unicode__(self):
+        truncated_body = truncate_words(self.body, 10)
+        return "%(truncated_body)s" % {'truncated_body': truncated_body}
+
+class MessageSearchTerm(models.Model):
+    """
+    Term of a message in the search index of a user.
+
+    Every user that can see a message has a row for each term of its body,
+    so a search only reads the rows of one user. A removed message is taken
+    out of the index of the user that removed it.
+
+    """
+    user = models.ForeignKey(User,
+                             verbose_name=_("user"),
+                             related_name='message_search_terms')
+
+    term = models.CharField(_("term"),
+                            max_length=SEARCH_TERM_LENGTH)
+
+    message = models.ForeignKey('Message',
+                                verbose_name=_("message"),
+                                related_name='search_terms')
+
+    objects = MessageSearchTermManager()
+
+    class Meta:
+        unique_together = ('user', 'term', 'message')
+        verbose_name = _("search term")
+        verbose_name_plural = _("search terms")
+
+    def __unicode__(self):
+        return (_("%(term)s for %(user)s")
+                % {'term': self.term,
+                   'user': self.user.username})
+
+class UserSearchName(models.Model):
+    """
+    Lowercased name by which a user is found as a recipient.
+
+    Every user has a row for the username, first name, last name and full
+    name, so recipients are looked up by prefix on one index.
+
+    """
+    user = models.ForeignKey(User,
+                             verbose_name=_("user"),
+                             related_name='message_search_names')
+
+    name = models.CharField(_("name"),
+                            max_length=SEARCH_NAME_LENGTH,
+                            db_index=True)
+
+    objects = UserSearchNameManager()
+
+    class Meta:
+        unique_together = ('user', 'name')
+        verbose_name = _("user search name")
+        verbose_name_plural = _("user search names")
+
+    def __unicode__(self):
+        return (_("%(name)s for %(user)s")
+                % {'name': self.name,
+                   'user': self.user.username})
+
+class MessageBlock(models.Model):
+    """
+    A user that doesn't want to receive messages from another user.
+
+    Blocked senders can't choose the user as recipient, and messages they
+    send are not delivered to the user.
+
+    """
+    user = models.ForeignKey(User,
+                             verbose_name=_("user"),
+                             related_name='message_blocks')
+
+    blocked_user = models.ForeignKey(User,
+                                     verbose_name=_("blocked user"),
+                                     related_name='message_blocked_by')
+
+    created_at = models.DateTimeField(_("created at"),
+                                      auto_now_add=True)
+
+    objects = MessageBlockManager()
+
+    class Meta:
+        unique_together = ('user', 'blocked_user')
+        verbose_name = _("message block")
+        verbose_name_plural = _("message blocks")
+
+    def __unicode__(self):
+        return (_("%(user)s blocks %(blocked_user)s")
+                % {'user': self.user.username,
+                   'blocked_user': self.blocked_user.username})
+
+def invalidate_broadcast_counts(sender, instance, **kwargs):
+    """ A new or removed broadcast changes the unread counts of all users. """
+    invalidate_broadcasts()
+
+post_save.connect(invalidate_broadcast_counts, sender=Broadcast)
+post_delete.connect(invalidate_broadcast_counts, sender=Broadcast)
+
+def update_search_names(sender, instance, **kwargs):
+    """ Keeps the names by which a user is found up to date. """
+    UserSearchName.objects.update_names(instance)
+
+post_save.connect(update_search_names, sender=User)
+
+def invalidate_blocker_ids(sender, instance, **kwargs):
+    """ A new or removed block changes the recipients of the blocked user. """
+    MessageBlock.objects.invalidate_blocker_ids(instance.blocked_user_id)
+
+post_save.connect(invalidate_blocker_ids, sender=MessageBlock)
+post_delete.connect(invalidate_blocker_ids, sender=MessageBlock)
@@ -41,6 +41,8 @@ def get_unread_message_count_for(parser, token):
     """
     Returns the unread message count for a user.
 
+    The count is served from the cache until the messages of the user change.
+
     Syntax::
 
         {% get_unread_message_count_for [user] as [var_name] %}
@@ -0,0 +1,10 @@
+from django.core.cache import cache
+from django import test
+
+class CacheTestCase(test.TestCase):
+    """ A TestCase that starts every test with an empty cache """
+    def _pre_setup(self):
+        # Unread counts, found recipients and blocks are cached by user id,
+        # which every test reuses.
+        cache.clear()
+        super(CacheTestCase, self)._pre_setup()
@@ -15,6 +15,12 @@ class CommaSeparatedTestForm(forms.Form):
             return False
         return True
 
+def exclude_jane(queryset):
+    return queryset.exclude(username='jane')
+
+class QuerysetFilterTestForm(forms.Form):
+    users = CommaSeparatedUserField(queryset_filter=exclude_jane)
+
 class CommaSeperatedFieldTests(TestCase):
     fixtures = ['users',]
 
@@ -52,3 +58,23 @@ class CommaSeperatedFieldTests(TestCase):
             self.failIf(form.is_valid())
             self.assertEqual(form.errors[invalid_dict['error'][0]],
                              invalid_dict['error'][1])
+
+    def test_recipient_filter_all(self):
+        """ Test that every user that is filtered out is reported """
+        form = CommaSeparatedTestForm(data={'users': 'jane, arie'})
+        form.fields['users']._recipient_filter = lambda user: False
+        self.failIf(form.is_valid())
+        error = form.errors['users'][0]
+        self.failUnless('arie' in error and 'jane' in error)
+
+    def test_queryset_filter(self):
+        """ Test that users are filtered in the query that fetches them """
+        form = QuerysetFilterTestForm(data={'users': 'john, jane'})
+        self.failIf(form.is_valid())
+        self.assertEqual(form.errors['users'],
+                         [u'The following usernames are incorrect: jane.'])
+
+        form = QuerysetFilterTestForm(data={'users': 'john'})
+        self.failUnless(form.is_valid())
+        self.assertEqual([u.username for u in form.cleaned_data['users']],
+                         ['john'])
@@ -47,5 +47,5 @@ class ComposeFormTests(TestCase):
         self.failUnless(msg.sent_at)
 
         # Check recipients
-        self.failUnlessEqual(msg.recipients.all()[0].username, 'jane')
-        self.failUnlessEqual(msg.recipients.all()[1].username, 'john')
+        self.failUnlessEqual([u.username for u in msg.recipients.order_by('username')],
+                             ['jane', 'john'])
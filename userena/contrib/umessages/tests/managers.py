@@ -1,10 +1,26 @@
 from django.test import TestCase
+from django.core.management import call_command
+from django.core import mail
 from django.contrib.auth.models import User
 
+import datetime
+
+try:
+    from django.utils.timezone import now
+except ImportError:
+    now = datetime.datetime.now
+
+from userena.contrib.umessages.tests.base import CacheTestCase
 from userena.contrib.umessages.models import (Message, MessageContact,
-                                              MessageRecipient)
+                                              MessageRecipient, Inbox, InboxEntry,
+                                              Broadcast, BroadcastState, MessageDigestRun,
+                                              ArchivedMessage, MessageSearchTerm,
+                                              UserSearchName, MessageBlock)
+from userena.contrib.umessages.forms import ComposeForm
+from userena.contrib.umessages.utils import message_position, inbox_position
+from userena.contrib.umessages import unread
 
-class MessageManagerTests(TestCase):
+class MessageManagerTests(CacheTestCase):
     fixtures = ['users', 'messages']
 
     def test_get_conversation(self):
@@ -14,7 +30,182 @@ class MessageManagerTests(TestCase):
 
         messages = Message.objects.get_conversation_between(user_1, user_2)
 
-class MessageRecipientManagerTest(TestCase):
+    def test_send_message_bulk(self):
+        """ Test that sending to more users doesn't take more queries """
+        john = User.objects.get(pk=1)
+        jane = User.objects.get(pk=2)
+        users = [User.objects.create_user('user%s' % i, 'user%s@example.com' % i)
+                 for i in range(5)]
+
+        # Create the counters, so both sends do the same work.
+        Message.objects.send_message(john, [jane] + users, 'First')
+
+        # The message, its recipients, the contacts, both unread counters,
+        # the latest messages and the search index.
+        self.assertNumQueries(7, Message.objects.send_message,
+                              john, [jane], 'Hello')
+        self.assertNumQueries(7, Message.objects.send_message,
+                              john, [jane] + users, 'Hello')
+
+        message = Message.objects.order_by('-pk')[0]
+        self.failUnlessEqual(message.messagerecipient_set.count(), 6)
+        self.failUnlessEqual(MessageContact.objects.filter(latest_message=message).count(), 6)
+
+        # Except for the search index, which has a row for every user and term
+        # and takes an ``INSERT`` per 400 rows.
+        body = ' '.join(['word%s' % i for i in range(60)])
+        self.assertNumQueries(8, Message.objects.send_message,
+                              john, [jane] + users, body)
+        message = Message.objects.order_by('-pk')[0]
+        self.failUnlessEqual(MessageSearchTerm.objects.filter(message=message).count(),
+                             7 * 60)
+
+    def test_remove_sent(self):
+        """ Test that only the sender can remove a sent message """
+        john = User.objects.get(pk=1)
+        jane = User.objects.get(pk=2)
+
+        self.failUnlessEqual(Message.objects.remove_sent(jane, [1]), 0)
+        self.failUnlessEqual(Message.objects.remove_sent(john, [1]), 1)
+        self.failUnless(Message.objects.get(pk=1).sender_deleted_at)
+        self.failUnlessEqual(Message.objects.remove_sent(john, [1]), 0)
+
+        self.failUnlessEqual(Message.objects.remove_sent(john, [1], undo=True), 1)
+        self.failIf(Message.objects.get(pk=1).sender_deleted_at)
+
+    def test_purge_messages(self):
+        """ Test that messages removed by everyone are deleted """
+        # Message 2 is removed by the sender, but not by the recipient.
+        call_command('purge_messages', days=30)
+        self.failUnless(Message.objects.filter(pk=2).exists())
+
+        MessageRecipient.objects.filter(message=2).update(deleted_at=datetime.datetime(2010, 1, 1))
+        call_command('purge_messages', days=30)
+
+        self.failIf(Message.objects.filter(pk=2).exists())
+        self.failIf(MessageRecipient.objects.filter(message=2).exists())
+        self.failUnlessEqual(MessageContact.objects.get(pk=1).latest_message.pk, 1)
+        self.failUnlessEqual(InboxEntry.objects.get(user=1, counterpart=2).latest_message.pk, 1)
+
+    def test_get_conversation_page(self):
+        """ Test paging through a conversation with cursors """
+        john = User.objects.get(pk=1)
+        jane = User.objects.get(pk=2)
+        for i in range(3):
+            Message.objects.send_message(john, [jane], 'Message %s' % i)
+
+        newest, has_more = Message.objects.get_conversation_page(john, jane,
+                                                                 limit=2)
+        self.failUnlessEqual([m.body for m in newest],
+                             ['Message 2', 'Message 1'])
+        self.failUnless(has_more)
+
+        cursor = (newest[-1].sent_at, newest[-1].pk)
+        older, has_more = Message.objects.get_conversation_page(john, jane,
+                                                                before=cursor,
+                                                                limit=2)
+        self.failUnlessEqual(older[0].body, 'Message 0')
+
+        cursor = (older[0].sent_at, older[0].pk)
+        newer, has_more = Message.objects.get_conversation_page(john, jane,
+                                                                after=cursor,
+                                                                limit=2)
+        self.failUnlessEqual(newer, newest)
+
+    def test_archive_messages(self):
+        """ Test that old messages are archived and still paged through """
+        john = User.objects.get(pk=1)
+        jane = User.objects.get(pk=2)
+        for i in range(3):
+            Message.objects.send_message(john, [jane], 'Old %s' % i)
+        Message.objects.send_message(john, [jane], 'New')
+        MessageRecipient.objects.mark_read_between(jane, john)
+
+        old_pks = list(Message.objects.filter(body__startswith='Old')
+                                      .values_list('pk', flat=True))
+        sent_at = datetime.datetime(2009, 1, 1)
+        Message.objects.filter(pk__in=old_pks).update(sent_at=sent_at)
+        MessageRecipient.objects.filter(message__in=old_pks).update(sent_at=sent_at)
+
+        # The latest message stays, all older ones are read.
+        call_command('archive_messages', days=365)
+        self.failUnlessEqual(list(Message.objects.values_list('body', flat=True)),
+                             ['New'])
+        self.failUnlessEqual(ArchivedMessage.objects.count(), 5)
+
+        # The message jane removed is no longer shown to her.
+        newest, has_more = Message.objects.get_conversation_page(jane, john,
+                                                                 limit=2)
+        self.failUnlessEqual([m.body for m in newest],
+                             ['New', 'Hello from your friend'])
+        self.failUnless(has_more)
+
+        older, has_more = Message.objects.get_conversation_page(jane, john,
+                                                                before=message_position(newest[-1]),
+                                                                limit=2)
+        self.failUnlessEqual([m.body for m in older], ['Old 2', 'Old 1'])
+        self.failUnless(has_more)
+
+        newer, has_more = Message.objects.get_conversation_page(jane, john,
+                                                                after=message_position(older[0]),
+                                                                limit=2)
+        self.failUnlessEqual([m.body for m in newer],
+                             ['New', 'Hello from your friend'])
+        self.failIf(has_more)
+
+    def test_get_conversation_page_kept_messages(self):
+        """ Test that archived messages newer than kept ones are paged """
+        john = User.objects.get(pk=1)
+        arie = User.objects.get(pk=3)
+        archived = Message.objects.send_message(john, [arie], 'Archived')
+        MessageRecipient.objects.mark_read_between(arie, john)
+        old_unread = [Message.objects.send_message(john, [arie], 'Unread %s' % i)
+                      for i in range(2)]
+        Message.objects.send_message(john, [arie], 'New')
+
+        # The unread messages are older than the archived one, but kept.
+        for message, sent_at in ((archived, datetime.datetime(2009, 6, 1)),
+                                 (old_unread[0], datetime.datetime(2009, 1, 2)),
+                                 (old_unread[1], datetime.datetime(2009, 1, 1))):
+            Message.objects.filter(pk=message.pk).update(sent_at=sent_at)
+            MessageRecipient.objects.filter(message=message).update(sent_at=sent_at)
+        ArchivedMessage.objects.archive([archived.pk])
+
+        newest, has_more = Message.objects.get_conversation_page(arie, john,
+                                                                 limit=2)
+        self.failUnlessEqual([m.body for m in newest], ['New', 'Archived'])
+        self.failUnless(has_more)
+
+        older, has_more = Message.objects.get_conversation_page(arie, john,
+                                                                before=message_position(newest[-1]),
+                                                                limit=2)
+        self.failUnlessEqual([m.body for m in older], ['Unread 0', 'Unread 1'])
+        self.failIf(has_more)
+
+    def test_remove_archived_messages(self):
+        """ Test that archived messages are removed and purged """
+        john = User.objects.get(pk=1)
+        jane = User.objects.get(pk=2)
+        message = Message.objects.send_message(john, [jane], 'Old')
+        Message.objects.send_message(john, [jane], 'New')
+        MessageRecipient.objects.mark_read_between(jane, john)
+        ArchivedMessage.objects.archive([message.pk])
+
+        self.failUnlessEqual(Message.objects.remove_messages(jane, [message.pk]), 1)
+        self.failIf(ArchivedMessage.objects.get_conversation(jane, john)
+                                           .filter(message_id=message.pk).exists())
+        self.failUnless(ArchivedMessage.objects.get_conversation(john, jane)
+                                               .filter(message_id=message.pk).exists())
+
+        # Only removed by the recipient, so it's kept.
+        call_command('purge_messages', days=30)
+        self.failUnless(ArchivedMessage.objects.filter(message_id=message.pk).exists())
+
+        self.failUnlessEqual(Message.objects.remove_messages(john, [message.pk]), 1)
+        call_command('purge_messages', days=30)
+        self.failIf(ArchivedMessage.objects.filter(message_id=message.pk).exists())
+
+class MessageRecipientManagerTest(CacheTestCase):
     fixtures = ['users', 'messages']
 
     def test_count_unread_messages_for(self):
@@ -26,6 +217,32 @@ class MessageRecipientManagerTest(TestCase):
 
         self.failUnlessEqual(unread_messages, 1)
 
+    def test_count_unread_messages_cache(self):
+        """ Test that the unread count is cached until messages change """
+        john = User.objects.get(pk=1)
+        jane = User.objects.get(pk=2)
+
+        self.failUnlessEqual(MessageRecipient.objects.count_unread_messages_for(jane), 1)
+        self.assertNumQueries(0, MessageRecipient.objects.count_unread_messages_for, jane)
+
+        Message.objects.send_message(john, [jane], 'Hello again')
+        self.failUnlessEqual(MessageRecipient.objects.count_unread_messages_for(jane), 2)
+
+        MessageRecipient.objects.mark_read_between(jane, john)
+        self.failUnlessEqual(MessageRecipient.objects.count_unread_messages_for(jane), 0)
+
+    def test_invalidate_after_commit(self):
+        """ Test that cached counts are only invalidated after the transaction """
+        jane = User.objects.get(pk=2)
+        version = unread.get_version(jane.pk)
+
+        def change():
+            unread.invalidate_unread([jane.pk])
+            return unread.get_version(jane.pk)
+
+        self.failUnlessEqual(unread.commit_on_success(change)(), version)
+        self.failIfEqual(unread.get_version(jane.pk), version)
+
     def test_count_unread_messages_between(self):
         """ Test the unread messages count between two users """
         john = User.objects.get(pk=1)
@@ -36,6 +253,80 @@ class MessageRecipientManagerTest(TestCase):
 
         self.failUnlessEqual(unread_messages, 1)
 
+    def test_mark_read_between(self):
+        """ Test marking the messages between two users as read """
+        john = User.objects.get(pk=1)
+        jane = User.objects.get(pk=2)
+
+        # Only marks the messages that are supplied.
+        marked = MessageRecipient.objects.mark_read_between(jane, john, [2])
+        self.failUnlessEqual(marked, 0)
+
+        marked = MessageRecipient.objects.mark_read_between(jane, john)
+        self.failUnlessEqual(marked, 1)
+        self.failUnlessEqual(MessageRecipient.objects.count_unread_messages_between(jane, john), 0)
+
+    def test_remove_received(self):
+        """ Test removing and restoring received messages """
+        john = User.objects.get(pk=1)
+        jane = User.objects.get(pk=2)
+
+        # John isn't a recipient of the first message.
+        self.failUnlessEqual(MessageRecipient.objects.remove_received(john, [1]), 0)
+
+        self.failUnlessEqual(MessageRecipient.objects.remove_received(jane, [1, 2]), 1)
+        self.failUnlessEqual(MessageRecipient.objects.count_unread_messages_between(jane, john), 0)
+
+        self.failUnlessEqual(MessageRecipient.objects.remove_received(jane, [1], undo=True), 1)
+        self.failUnlessEqual(MessageRecipient.objects.count_unread_messages_between(jane, john), 1)
+
+    def test_backfill_conversations(self):
+        """ Test that the conversation is filled for existing recipients """
+        MessageRecipient.objects.update(conversation=None, sent_at=None,
+                                        sender_deleted_at=None)
+
+        call_command('backfill_conversations', batch_size=1)
+
+        john = User.objects.get(pk=1)
+        jane = User.objects.get(pk=2)
+        self.failUnlessEqual(MessageRecipient.objects.get_conversation(jane, john).count(), 1)
+        self.failUnless(MessageRecipient.objects.get(pk=2).sender_deleted_at)
+
+class InboxManagerTest(CacheTestCase):
+    fixtures = ['users', 'messages']
+
+    def test_unread_counters(self):
+        """ Test that the counters follow sending and reading messages """
+        john = User.objects.get(pk=1)
+        jane = User.objects.get(pk=2)
+
+        # Missing counters are created from the messages.
+        self.failUnlessEqual(Inbox.objects.get_unread_count(jane), 1)
+        self.failUnlessEqual(InboxEntry.objects.get_unread_count(jane, john), 1)
+
+        Message.objects.send_message(john, [jane], 'Hello again')
+        self.failUnlessEqual(Inbox.objects.get_unread_count(jane), 2)
+        self.failUnlessEqual(InboxEntry.objects.get_unread_count(jane, john), 2)
+
+        MessageRecipient.objects.mark_read_between(jane, john)
+        self.failUnlessEqual(Inbox.objects.get_unread_count(jane), 0)
+        self.failUnlessEqual(InboxEntry.objects.get_unread_count(jane, john), 0)
+
+    def test_reconcile_unread(self):
+        """ Test that the ``reconcile_unread`` command repairs the counters """
+        john = User.objects.get(pk=1)
+        jane = User.objects.get(pk=2)
+
+        Inbox.objects.get_unread_count(jane)
+        InboxEntry.objects.get_unread_count(jane, john)
+        Inbox.objects.filter(user=jane).update(unread_count=5)
+        InboxEntry.objects.filter(user=jane).update(unread_count=5)
+
+        call_command('reconcile_unread')
+
+        self.failUnlessEqual(Inbox.objects.get_unread_count(jane), 1)
+        self.failUnlessEqual(InboxEntry.objects.get_unread_count(jane, john), 1)
+
 class MessageContactManagerTest(TestCase):
     fixtures = ['users', 'messages']
 
@@ -51,3 +342,226 @@ class MessageContactManagerTest(TestCase):
         self.failUnlessEqual(contacts[0].to_user,
                              jane)
 
+    def test_update_contact(self):
+        """ Test that a pair of users shares one contact in both directions """
+        john = User.objects.get(pk=1)
+        jane = User.objects.get(pk=2)
+
+        message = Message.objects.send_message(jane, [john], 'Hello John')
+        contact = MessageContact.objects.update_contact(jane, john, message)
+
+        self.failUnlessEqual(MessageContact.objects.count(), 1)
+        self.failUnlessEqual(contact.from_user, john)
+        self.failUnlessEqual(contact.latest_message, message)
+
+class InboxEntryManagerTest(CacheTestCase):
+    fixtures = ['users', 'messages']
+
+    def test_inbox_summary(self):
+        """ Test that the inbox follows sending and removing messages """
+        john = User.objects.get(pk=1)
+        jane = User.objects.get(pk=2)
+
+        message = Message.objects.send_message(jane, [john], 'Hello John')
+        for user, counterpart in ((john, jane), (jane, john)):
+            entry = InboxEntry.objects.get_inbox_for(user)[0]
+            self.failUnlessEqual(entry.counterpart, counterpart)
+            self.failUnlessEqual(entry.latest_message, message)
+            self.failUnlessEqual(entry.snippet, 'Hello John')
+
+        # Removing the latest message shows the one before it.
+        MessageRecipient.objects.remove_received(john, [message.pk])
+        entry = InboxEntry.objects.get(user=john, counterpart=jane)
+        self.failUnlessEqual(entry.latest_message.pk, 2)
+
+    def test_remove_from_counterparts(self):
+        """ Test that removing messages of several senders updates the inbox """
+        john = User.objects.get(pk=1)
+        jane = User.objects.get(pk=2)
+        arie = User.objects.get(pk=3)
+        from_arie = Message.objects.send_message(arie, [jane], 'Hello Jane')
+        from_john = Message.objects.send_message(john, [jane], 'Hello again')
+
+        MessageRecipient.objects.remove_received(jane, [from_arie.pk, from_john.pk])
+        entry = InboxEntry.objects.get(user=jane, counterpart=john)
+        self.failUnlessEqual((entry.latest_message.pk, entry.unread_count), (1, 1))
+        entry = InboxEntry.objects.get(user=jane, counterpart=arie)
+        self.failUnlessEqual((entry.latest_message, entry.unread_count), (None, 0))
+
+        MessageRecipient.objects.remove_received(jane, [from_arie.pk, from_john.pk],
+                                                 undo=True)
+        entry = InboxEntry.objects.get(user=jane, counterpart=john)
+        self.failUnlessEqual((entry.latest_message, entry.unread_count), (from_john, 2))
+        entry = InboxEntry.objects.get(user=jane, counterpart=arie)
+        self.failUnlessEqual((entry.latest_message, entry.unread_count), (from_arie, 1))
+        self.failUnlessEqual(entry.snippet, 'Hello Jane')
+
+    def test_get_inbox_page(self):
+        """ Test that the inbox is paged from the position of an entry """
+        john = User.objects.get(pk=1)
+        arie = User.objects.get(pk=3)
+        Message.objects.send_message(john, [arie], 'Hello Arie')
+
+        entries, has_more = InboxEntry.objects.get_inbox_page(john, limit=1)
+        self.failUnlessEqual([e.counterpart.pk for e in entries], [3])
+        self.failUnless(has_more)
+
+        entries, has_more = InboxEntry.objects.get_inbox_page(
+            john, before=inbox_position(entries[0]), limit=1)
+        self.failUnlessEqual([e.counterpart.pk for e in entries], [2])
+        self.failIf(has_more)
+
+        entries, has_more = InboxEntry.objects.get_inbox_page(
+            john, after=inbox_position(entries[0]), limit=1)
+        self.failUnlessEqual([e.counterpart.pk for e in entries], [3])
+        self.failIf(has_more)
+
+    def test_rebuild_inbox(self):
+        """ Test that the ``rebuild_inbox`` command fills the summaries """
+        InboxEntry.objects.all().delete()
+
+        call_command('rebuild_inbox')
+
+        self.failUnlessEqual(InboxEntry.objects.get(user=2, counterpart=1).latest_message.pk, 1)
+        self.failUnlessEqual(InboxEntry.objects.get(user=2, counterpart=1).unread_count, 1)
+        self.failUnlessEqual(InboxEntry.objects.get(user=1, counterpart=2).latest_message.pk, 2)
+
+class BroadcastManagerTest(CacheTestCase):
+    fixtures = ['users', 'messages']
+
+    def test_broadcast_state(self):
+        """ Test that broadcasts are read and removed per user """
+        john = User.objects.get(pk=1)
+        jane = User.objects.get(pk=2)
+        broadcast = Broadcast.objects.send_broadcast(john, 'Announcement')
+
+        # The broadcast is unread for everyone, without any state stored.
+        self.failUnlessEqual(BroadcastState.objects.count(), 0)
+        self.failUnlessEqual(Broadcast.objects.count_unread_for(jane), 1)
+        self.failUnlessEqual(MessageRecipient.objects.count_unread_messages_for(jane), 2)
+
+        BroadcastState.objects.mark_read(jane, [broadcast.pk])
+        self.failUnlessEqual(Broadcast.objects.count_unread_for(jane), 0)
+        self.failUnlessEqual(Broadcast.objects.count_unread_for(john), 1)
+
+        BroadcastState.objects.set_state(john, [broadcast.pk], deleted_at=now())
+        self.failUnlessEqual(list(Broadcast.objects.get_broadcasts_for(john)), [])
+        self.failUnlessEqual(list(Broadcast.objects.get_broadcasts_for(jane)),
+                             [broadcast])
+        self.failUnlessEqual(BroadcastState.objects.count(), 2)
+
+class MessageDigestRunManagerTest(TestCase):
+    fixtures = ['users', 'messages']
+
+    def test_send_message_digests(self):
+        """ Test that every unread message is in one digest only """
+        call_command('send_message_digests')
+
+        # Only Jane has an unread message.
+        self.failUnlessEqual(len(mail.outbox), 1)
+        self.failUnlessEqual(mail.outbox[0].to, [User.objects.get(pk=2).email])
+        self.failUnless(MessageDigestRun.objects.get().finished_at)
+
+        mail.outbox = []
+        call_command('send_message_digests')
+        self.failUnlessEqual(len(mail.outbox), 0)
+
+        # A run that crashed continues after the last marked user.
+        Message.objects.send_message(User.objects.get(pk=2),
+                                     [User.objects.get(pk=1)], 'Hello')
+        run = MessageDigestRun.objects.get_current_run()
+        MessageDigestRun.objects.filter(pk=run.pk).update(last_user_id=1)
+        call_command('send_message_digests')
+        self.failUnlessEqual(len(mail.outbox), 0)
+
+class MessageSearchTermManagerTest(TestCase):
+    fixtures = ['users', 'messages']
+
+    def test_search(self):
+        """ Test that messages are ranked and only found by who can see them """
+        john = User.objects.get(pk=1)
+        jane = User.objects.get(pk=2)
+        first = Message.objects.send_message(john, [jane], 'Dinner at eight tonight?')
+        second = Message.objects.send_message(jane, [john], 'Dinner sounds great.')
+
+        results = MessageSearchTerm.objects.search(john, 'dinner TONIGHT')
+        self.failUnlessEqual([r['message'] for r in results],
+                             [first.pk, second.pk])
+
+        MessageRecipient.objects.remove_received(jane, [first.pk])
+        results = MessageSearchTerm.objects.search(jane, 'dinner')
+        self.failUnlessEqual([r['message'] for r in results], [second.pk])
+
+        MessageRecipient.objects.remove_received(jane, [first.pk], undo=True)
+        self.failUnlessEqual(MessageSearchTerm.objects.search(jane, 'dinner').count(), 2)
+
+    def test_rebuild_search_index(self):
+        """ Test that the index is built for the users that see the messages """
+        call_command('rebuild_search_index')
+
+        # Message 2 is removed by its sender.
+        results = MessageSearchTerm.objects.search(User.objects.get(pk=1), 'hello')
+        self.failUnlessEqual([r['message'] for r in results], [2, 1])
+        results = MessageSearchTerm.objects.search(User.objects.get(pk=2), 'hello')
+        self.failUnlessEqual([r['message'] for r in results], [1])
+
+class UserSearchNameManagerTest(CacheTestCase):
+    fixtures = ['users']
+
+    def test_autocomplete(self):
+        """ Test that active users are found by the start of any name """
+        john = User.objects.get(pk=1)
+        self.failUnlessEqual(set([u['username'] for u in
+                                  UserSearchName.objects.autocomplete('Doe')]),
+                             set(['john', 'jane']))
+        self.failUnlessEqual(UserSearchName.objects.autocomplete('doe', exclude_user=john),
+                             [{'username': 'jane', 'name': 'Jane Doe'}])
+
+        arie = User.objects.get(pk=3)
+        arie.first_name = 'Aristotle'
+        arie.save()
+        self.failUnlessEqual([u['username'] for u in
+                              UserSearchName.objects.autocomplete('aris')],
+                             ['arie'])
+
+        # Cached results are left out when the user no longer matches.
+        arie.first_name = 'Arie'
+        arie.save()
+        self.failUnlessEqual(UserSearchName.objects.autocomplete('aris'), [])
+
+        self.failUnlessEqual([u['username'] for u in
+                              UserSearchName.objects.autocomplete('de beu')],
+                             ['arie'])
+        arie.is_active = False
+        arie.save()
+        self.failUnlessEqual(UserSearchName.objects.autocomplete('de beu'), [])
+
+class MessageBlockManagerTest(CacheTestCase):
+    fixtures = ['users']
+
+    def test_block(self):
+        """ Test that blocked senders can't reach the user """
+        john = User.objects.get(pk=1)
+        jane = User.objects.get(pk=2)
+        arie = User.objects.get(pk=3)
+        MessageBlock.objects.block(jane, john)
+
+        message = Message.objects.send_message(john, [jane, arie], 'Hello')
+        self.failUnlessEqual(list(message.recipients.all()), [arie])
+
+        # Nothing is saved when no recipient is left.
+        count = Message.objects.count()
+        self.failUnless(Message.objects.send_message(john, [jane], 'Hello') is None)
+        arie.is_active = False
+        arie.save()
+        self.failUnless(Message.objects.send_message(john, [arie], 'Hello') is None)
+        self.failUnlessEqual(Message.objects.count(), count)
+
+        form = ComposeForm(data={'to': 'jane', 'body': 'Hello'}, sender=john)
+        self.failIf(form.is_valid())
+        form = ComposeForm(data={'to': 'john', 'body': 'Hello'}, sender=jane)
+        self.failUnless(form.is_valid())
+
+        MessageBlock.objects.unblock(jane, john)
+        form = ComposeForm(data={'to': 'jane', 'body': 'Hello'}, sender=john)
+        self.failUnless(form.is_valid())
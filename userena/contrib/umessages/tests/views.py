@@ -2,11 +2,16 @@ from django.test import TestCase
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
 from django.conf import settings
+from django.utils import simplejson
+
+import datetime
 
 from userena.contrib.umessages.forms import ComposeForm
-from userena.contrib.umessages.models import Message, MessageRecipient
+from userena.contrib.umessages.tests.base import CacheTestCase
+from userena.contrib.umessages.models import (Message, MessageRecipient,
+                                              Broadcast, BroadcastState)
 
-class MessagesViewsTests(TestCase):
+class MessagesViewsTests(CacheTestCase):
     fixtures = ['users', 'messages']
 
     def _test_login(self, named_url, **kwargs):
@@ -75,6 +80,45 @@ class MessagesViewsTests(TestCase):
         self.assertEqual(response.context['form'].initial['to'],
                          [jane, john])
 
+    def test_message_poll(self):
+        """ ``GET`` the unread messages of a user """
+        self._test_login("userena_umessages_poll")
+
+        self.client.login(username="jane", password="blowfish")
+        response = self.client.get(reverse("userena_umessages_poll"),
+                                   data={'timeout': 0})
+        poll = simplejson.loads(response.content)
+        self.failUnless(poll['changed'])
+        self.failUnlessEqual(poll['unread_count'], 1)
+        self.failUnlessEqual(poll['latest_message'], 1)
+
+        # Nothing changed since the last poll.
+        response = self.client.get(reverse("userena_umessages_poll"),
+                                   data={'timeout': 0,
+                                         'version': poll['version']})
+        self.failIf(simplejson.loads(response.content)['changed'])
+
+    def test_broadcast_remove(self):
+        """ ``POST`` to remove only the broadcasts that the user received """
+        broadcast = Broadcast.objects.create(sender=User.objects.get(pk=3),
+                                             body='Maintenance tonight')
+        jane = User.objects.get(pk=2)
+        jane.date_joined = broadcast.sent_at + datetime.timedelta(days=1)
+        jane.save()
+
+        self.client.login(username="jane", password="blowfish")
+        self.client.post(reverse("userena_umessages_broadcast_remove"),
+                         {'broadcast_pks': [broadcast.pk]})
+        self.failIf(BroadcastState.objects.filter(user=jane).exists())
+
+        self.client.login(username="john", password="blowfish")
+        self.client.post(reverse("userena_umessages_broadcast_remove"),
+                         {'broadcast_pks': [broadcast.pk]})
+        self.failUnless(BroadcastState.objects.get(user=1).deleted_at)
+        self.client.post(reverse("userena_umessages_broadcast_unremove"),
+                         {'broadcast_pks': [broadcast.pk]})
+        self.failIf(BroadcastState.objects.get(user=1).deleted_at)
+
     def test_message_detail(self):
         """ A ``GET`` to the detail view """
         self._test_login('userena_umessages_detail',
@@ -186,6 +230,27 @@ class MessagesViewsTests(TestCase):
 
         self.assertTemplateUsed(response, "umessages/message_list.html")
 
+        # The unread messages are counted for every contact.
+        self.client.login(username="jane", password="blowfish")
+        response = self.client.get(reverse("userena_umessages_list"))
+        contact = response.context['message_list'][0]
+        self.failUnlessEqual(contact.counterpart.username, 'john')
+        self.failUnlessEqual(contact.unread_count, 1)
+
+        # The older conversations are on the page before the cursor.
+        arie = User.objects.get(pk=3)
+        Message.objects.send_message(arie, [User.objects.get(pk=2)], 'Hello Jane')
+        response = self.client.get(reverse("userena_umessages_list"))
+        self.failUnlessEqual([e.counterpart.username for e in
+                              response.context['message_list']], ['arie', 'john'])
+        self.failIf(response.context['has_newer'])
+        response = self.client.get(reverse("userena_umessages_list"),
+                                   {'before': response.context['newer_cursor']})
+        self.failUnlessEqual([e.counterpart.username for e in
+                              response.context['message_list']], ['john'])
+        self.failUnless(response.context['has_newer'])
+        self.failUnlessEqual(response.context['broadcast_list'], [])
+
     def test_message_detail(self):
         """ ``GET`` to a detail page between two users """
         self._test_login("userena_umessages_detail",
@@ -207,3 +272,58 @@ class MessagesViewsTests(TestCase):
                                                           read_at__isnull=True)
 
         self.assertEqual(len(unread_messages), 0)
+
+    def test_message_search(self):
+        """ ``GET`` the messages that contain the words of a query """
+        self._test_login("userena_umessages_search")
+
+        john = User.objects.get(pk=1)
+        jane = User.objects.get(pk=2)
+        message = Message.objects.send_message(jane, [john], 'Dinner at eight')
+
+        client = self.client.login(username="john", password="blowfish")
+        response = self.client.get(reverse("userena_umessages_search"),
+                                   {'q': 'dinner'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "umessages/message_search.html")
+        self.failUnlessEqual(response.context['message_list'], [message])
+
+        # The page is read from the ``GET``.
+        response = self.client.get(reverse("userena_umessages_search"),
+                                   {'q': 'hello', 'page': 2})
+        self.failUnlessEqual(response.status_code, 404)
+
+    def test_message_export(self):
+        """ ``GET`` all the messages of a user as JSON lines and CSV """
+        self._test_login("userena_umessages_export")
+
+        client = self.client.login(username="john", password="blowfish")
+        response = self.client.get(reverse("userena_umessages_export"))
+        self.assertEqual(response.status_code, 200)
+
+        message_list = [simplejson.loads(line) for line in
+                        response.content.splitlines()]
+        self.failUnlessEqual([m['id'] for m in message_list], [1, 2])
+        self.failUnlessEqual(message_list[0]['recipients'][0]['username'], 'jane')
+        self.failUnless(message_list[1]['sender_removed'])
+
+        response = self.client.get(reverse("userena_umessages_export_format",
+                                           kwargs={'format': 'csv'}))
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.failUnlessEqual(len(response.content.splitlines()), 3)
+
+    def test_message_autocomplete(self):
+        """ ``GET`` the users of which a name starts with a prefix """
+        self._test_login("userena_umessages_autocomplete")
+
+        client = self.client.login(username="john", password="blowfish")
+        response = self.client.get(reverse("userena_umessages_autocomplete"),
+                                   {'q': 'JA'})
+        self.assertEqual(response.status_code, 200)
+        self.failUnlessEqual([u['username'] for u in simplejson.loads(response.content)],
+                             ['jane'])
+
+        # The user that searches is never returned.
+        response = self.client.get(reverse("userena_umessages_autocomplete"),
+                                   {'q': 'jo'})
+        self.failUnlessEqual(simplejson.loads(response.content), [])
@@ -0,0 +1,138 @@
+"""
+Cache of the unread message counts.
+
+Every user has a version in the cache, which is part of the keys of their
+counts. Changing the messages of a user removes the version, which makes all
+their cached counts unreachable at once. Broadcasts count for all users, so
+there is one version for the broadcasts as well.
+
+Versions are removed after the transaction that changed the messages is
+committed. Removed earlier, another request could cache the old counts again
+under a new version before the commit.
+
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.functional import wraps
+
+from userena import settings as userena_settings
+
+import threading, time
+
+UNREAD_VERSION_KEY = 'umessages_unread_version_%s'
+BROADCAST_VERSION_KEY = 'umessages_broadcast_version'
+UNREAD_COUNT_KEY = 'umessages_unread_%s_%s_%s'
+LATEST_MESSAGE_KEY = 'umessages_latest_%s_%s'
+
+# Version keys that are removed when the running transaction is committed.
+_pending = threading.local()
+
+def commit_on_success(func):
+    """
+    Decorator that runs a function in a transaction, like Django's
+    ``commit_on_success``, and removes the versions it invalidated once the
+    transaction is committed.
+
+    A decorated function that is called from another one joins its
+    transaction, instead of committing halfway.
+
+    """
+    def _commit_on_success(*args, **kwargs):
+        if getattr(_pending, 'keys', None) is not None:
+            return func(*args, **kwargs)
+
+        _pending.keys = set()
+        try:
+            return transaction.commit_on_success(func)(*args, **kwargs)
+        finally:
+            keys, _pending.keys = _pending.keys, None
+            if keys: cache.delete_many(list(keys))
+    return wraps(func)(_commit_on_success)
+
+def _invalidate(keys):
+    """ Removes version keys now, or after the running transaction. """
+    pending = getattr(_pending, 'keys', None)
+    if pending is not None:
+        pending.update(keys)
+    else: cache.delete_many(keys)
+
+def _get_version(key):
+    """ Returns the version stored at ``key``, creating it if it's missing. """
+    version = cache.get(key)
+    if version is None:
+        # A new version is unique, even when an old one was evicted.
+        cache.add(key, int(time.time() * 1000000),
+                  userena_settings.USERENA_UMESSAGES_CACHE_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+def get_version(user_id):
+    """
+    Returns the version of the unread counts of a user.
+
+    :param user_id:
+        Integer with the id of the user.
+
+    """
+    return '%s.%s' % (_get_version(UNREAD_VERSION_KEY % user_id),
+                      _get_version(BROADCAST_VERSION_KEY))
+
+def invalidate_unread(user_ids):
+    """
+    Removes the cached unread counts of users.
+
+    :param user_ids:
+        List of user id's whose messages changed.
+
+    """
+    _invalidate([UNREAD_VERSION_KEY % user_id for user_id in user_ids])
+
+def invalidate_broadcasts():
+    """ Removes the cached unread counts of all users. """
+    _invalidate([BROADCAST_VERSION_KEY])
+
+def get_unread_count(user_id, fetch, counterpart_id=None):
+    """
+    Returns a cached unread count.
+
+    :param user_id:
+        Integer with the id of the user the messages are for.
+
+    :param fetch:
+        Function without arguments that counts the messages when they are
+        not in the cache.
+
+    :param counterpart_id:
+        Optional integer with the id of the user the messages are from.
+
+    """
+    key = UNREAD_COUNT_KEY % (user_id, get_version(user_id),
+                              counterpart_id or '')
+
+    count = cache.get(key)
+    if count is None:
+        count = fetch()
+        cache.set(key, count, userena_settings.USERENA_UMESSAGES_CACHE_TIMEOUT)
+    return count
+
+def get_latest_message_id(user_id, fetch):
+    """
+    Returns the cached id of the latest message that a user received.
+
+    :param user_id:
+        Integer with the id of the user the messages are for.
+
+    :param fetch:
+        Function without arguments that looks up the id when it's not in the
+        cache. Returns ``None`` when there are no messages.
+
+    """
+    key = LATEST_MESSAGE_KEY % (user_id, get_version(user_id))
+
+    # ``0`` is cached for no message, ``None`` means a cache miss.
+    message_id = cache.get(key)
+    if message_id is None:
+        message_id = fetch() or 0
+        cache.set(key, message_id, userena_settings.USERENA_UMESSAGES_CACHE_TIMEOUT)
+    return message_id or None
+
@@ -8,6 +8,10 @@ urlpatterns = patterns('',
         messages_views.message_compose,
         name='userena_umessages_compose'),
 
+    url(r'^compose/autocomplete/$',
+        messages_views.message_autocomplete,
+        name='userena_umessages_autocomplete'),
+
     url(r'^compose/(?P<recipients>[\+\.\w]+)/$',
         messages_views.message_compose,
         name='userena_umessages_compose_to'),
@@ -29,6 +33,35 @@ urlpatterns = patterns('',
         {'undo': True},
         name='userena_umessages_unremove'),
 
+    url(r'^search/$',
+        messages_views.message_search,
+        name='userena_umessages_search'),
+
+    url(r'^export/$',
+        messages_views.message_export,
+        name='userena_umessages_export'),
+
+    url(r'^export/(?P<format>json|csv)/$',
+        messages_views.message_export,
+        name='userena_umessages_export_format'),
+
+    url(r'^poll/$',
+        messages_views.message_poll,
+        name='userena_umessages_poll'),
+
+    url(r'^broadcast/(?P<broadcast_id>\d+)/$',
+        messages_views.broadcast_detail,
+        name='userena_umessages_broadcast_detail'),
+
+    url(r'^broadcast/remove/$',
+        messages_views.broadcast_remove,
+        name='userena_umessages_broadcast_remove'),
+
+    url(r'^broadcast/unremove/$',
+        messages_views.broadcast_remove,
+        {'undo': True},
+        name='userena_umessages_broadcast_unremove'),
+
     url(r'^$',
         messages_views.message_list,
         name='userena_umessages_list'),
@@ -0,0 +1,272 @@
+from django.db import connections, transaction, router
+from django.db.models import AutoField
+
+import datetime, re
+
+CURSOR_DATE_FORMAT = '%Y%m%d%H%M%S%f'
+
+# Length of the start of the latest message that is shown in the inbox.
+SNIPPET_LENGTH = 100
+
+# Longest term that is stored in the search index.
+SEARCH_TERM_LENGTH = 30
+
+SEARCH_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+# Longest name by which a user is found as a recipient.
+SEARCH_NAME_LENGTH = 61
+
+# Multiplier that puts the lowest user id in the high bits of a conversation.
+CONVERSATION_SHIFT = 2 ** 32
+
+def conversation_key(user_id, other_id):
+    """
+    Returns the key of the conversation between two users.
+
+    The key is the same in both directions, so all messages between two users
+    are found with one index range.
+
+    :param user_id:
+        Integer with the id of a user.
+
+    :param other_id:
+        Integer with the id of the other user.
+
+    :return: Integer with the key of the conversation.
+
+    """
+    lowest, highest = sorted([user_id, other_id])
+    return lowest * CONVERSATION_SHIFT + highest
+
+def search_terms(text):
+    """
+    Returns the terms that a text is indexed and searched by.
+
+    Terms are the lowercased words of at least two characters, cut off at
+    ``SEARCH_TERM_LENGTH`` characters.
+
+    :param text:
+        String that is split into terms.
+
+    :return: Set of strings.
+
+    """
+    return set([term[:SEARCH_TERM_LENGTH] for term in
+                SEARCH_TERM_RE.findall(text.lower()) if len(term) > 1])
+
+def search_names(user):
+    """
+    Returns the lowercased names by which a user is found as a recipient.
+
+    :param user:
+        The :class:`User`.
+
+    :return: Set of strings.
+
+    """
+    full_name = ('%s %s' % (user.first_name, user.last_name)).strip()
+    return set([name.lower()[:SEARCH_NAME_LENGTH] for name in
+                (user.username, user.first_name, user.last_name, full_name)
+                if name])
+
+def message_position(message):
+    """
+    Returns the position of a message in a conversation.
+
+    :param message:
+        The :class:`Message` or :class:`ArchivedMessage`. An archived message
+        keeps the id of the message it was made from.
+
+    :return: Tuple containing the ``sent_at`` and the id of the message.
+
+    """
+    return (message.sent_at, getattr(message, 'message_id', message.pk))
+
+def inbox_position(entry):
+    """
+    Returns the position of an entry in the inbox of a user.
+
+    :param entry:
+        The :class:`InboxEntry`.
+
+    :return: Tuple containing the ``latest_sent_at`` and the id of the entry.
+
+    """
+    return (entry.latest_sent_at, entry.pk)
+
+def encode_cursor(message, position=message_position):
+    """
+    Returns the cursor that points to a message in a conversation.
+
+    The cursor is built from the ``sent_at`` and the id of the message, which
+    together define the order of a conversation.
+
+    :param message:
+        The :class:`Message` or :class:`ArchivedMessage` that the cursor
+        points to.
+
+    :param position:
+        Function that returns the date and id of ``message``. Supply
+        :func:`inbox_position` for a cursor that points to an
+        :class:`InboxEntry`.
+
+    :return: String containing the cursor.
+
+    """
+    sent_at, pk = position(message)
+    return '%s_%s' % (sent_at.strftime(CURSOR_DATE_FORMAT), pk)
+
+def decode_cursor(cursor):
+    """
+    Returns the position that a cursor points to.
+
+    :param cursor:
+        String containing a cursor made by :func:`encode_cursor`.
+
+    :return:
+        Tuple containing the ``sent_at`` and the id of the message, or
+        ``None`` when the cursor is invalid.
+
+    """
+    try:
+        sent_at, pk = cursor.split('_')
+        return (datetime.datetime.strptime(sent_at, CURSOR_DATE_FORMAT),
+                int(pk))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def bulk_insert(model, objs, using=None, batch_size=400):
+    """
+    Inserts model instances with a multi-row ``INSERT`` per batch.
+
+    Uses ``bulk_create`` where Django supplies it. Just like ``bulk_create``
+    no signals are send, ``save`` isn't called and the primary keys of the
+    instances are not set.
+
+    :param model:
+        The model class of the instances.
+
+    :param objs:
+        List of unsaved instances of ``model``.
+
+    :param using:
+        Optional alias of the database to insert in.
+
+    :param batch_size:
+        Integer defining the maximum amount of rows per ``INSERT``.
+
+    """
+    if not objs: return
+    if using is None: using = router.db_for_write(model)
+
+    manager = model._default_manager.db_manager(using)
+    if hasattr(manager, 'bulk_create'):
+        for i in xrange(0, len(objs), batch_size):
+            manager.bulk_create(objs[i:i + batch_size])
+        return
+
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    fields = [f for f in model._meta.local_fields if not isinstance(f, AutoField)]
+    row_sql = '(%s)' % ', '.join(['%s'] * len(fields))
+
+    cursor = connection.cursor()
+    for i in xrange(0, len(objs), batch_size):
+        batch = objs[i:i + batch_size]
+        params = []
+        for obj in batch:
+            params.extend([f.get_db_prep_save(f.pre_save(obj, True),
+                                              connection=connection)
+                           for f in fields])
+        cursor.execute('INSERT INTO %s (%s) VALUES %s' %
+                       (qn(model._meta.db_table),
+                        ', '.join([qn(f.column) for f in fields]),
+                        ', '.join([row_sql] * len(batch))),
+                       params)
+    transaction.set_dirty(using=using)
+
+def bulk_update(model, key_field, rows, filters=None, add=(), using=None,
+                batch_size=100):
+    """
+    Updates rows with different values per row, with one ``UPDATE`` that
+    picks the values with ``CASE`` per batch.
+
+    Just like ``QuerySet.update`` no signals are send and ``save`` isn't
+    called.
+
+    :param model:
+        The model class of the rows.
+
+    :param key_field:
+        String with the name of the field that identifies a row, next to the
+        ``filters``.
+
+    :param rows:
+        Dictionary with the value of ``key_field`` as key and a dictionary
+        with the field names and values of the row as value. Every row has
+        the same fields.
+
+    :param filters:
+        Optional dictionary with field names and the values that all updated
+        rows have.
+
+    :param add:
+        Names of the fields whose value is added to the current value
+        instead of replacing it.
+
+    :param using:
+        Optional alias of the database to update in.
+
+    :param batch_size:
+        Integer defining the maximum amount of rows per ``UPDATE``.
+
+    :return: Integer with the amount of updated rows.
+
+    """
+    if not rows: return 0
+    if using is None: using = router.db_for_write(model)
+
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    opts = model._meta
+
+    def prep(field, value):
+        return field.get_db_prep_save(getattr(value, 'pk', value),
+                                      connection=connection)
+
+    key = opts.get_field(key_field)
+    filters = [(opts.get_field(name), value)
+               for name, value in (filters or dict()).items()]
+    field_names = rows.values()[0].keys()
+
+    keys, updated = rows.keys(), 0
+    cursor = connection.cursor()
+    for i in xrange(0, len(keys), batch_size):
+        batch = keys[i:i + batch_size]
+        assignments, params = [], []
+        for name in field_names:
+            field = opts.get_field(name)
+            column = qn(field.column)
+            cases = []
+            for row_key in batch:
+                cases.append('WHEN %s THEN %s')
+                params.extend([prep(key, row_key), prep(field, rows[row_key][name])])
+            value_sql = 'CASE %s %s END' % (qn(key.column), ' '.join(cases))
+            # PostgreSQL types the parameters of a ``CASE`` as text.
+            if getattr(connection, 'vendor', None) == 'postgresql':
+                value_sql = 'CAST(%s AS %s)' % (value_sql, field.db_type(connection=connection))
+            if name in add: value_sql = '%s + %s' % (column, value_sql)
+            assignments.append('%s = %s' % (column, value_sql))
+
+        where = ['%s = %%s' % qn(field.column) for field, value in filters]
+        params.extend([prep(field, value) for field, value in filters])
+        where.append('%s IN (%s)' % (qn(key.column), ', '.join(['%s'] * len(batch))))
+        params.extend([prep(key, row_key) for row_key in batch])
+
+        cursor.execute('UPDATE %s SET %s WHERE %s' %
+                       (qn(opts.db_table), ', '.join(assignments),
+                        ' AND '.join(where)),
+                       params)
+        updated += cursor.rowcount
+    transaction.set_dirty(using=using)
+    return updated
@@ -1,30 +1,39 @@
 from django.contrib.auth.decorators import login_required
-from django.views.generic import list_detail
 from django.views.decorators.http import require_http_methods
 from django.core.urlresolvers import reverse
 from django.views.generic.simple import direct_to_template
 from django.shortcuts import get_object_or_404, redirect
-from django.http import Http404
+from django.http import Http404, HttpResponse
+from django.utils import simplejson
+from django.core.paginator import Paginator, InvalidPage
 from django.contrib.auth.models import User
 from django.template import loader
 from django.contrib import messages
 from django.utils.translation import ugettext as _
 from django.utils.translation import ungettext
 from django.contrib.auth import REDIRECT_FIELD_NAME
+from django.forms.forms import NON_FIELD_ERRORS
 
 try:
     from django.utils.timezone import now
 except ImportError:
     now = datetime.datetime.now
 
-from userena.contrib.umessages.models import Message, MessageRecipient, MessageContact
-from userena.contrib.umessages.forms import ComposeForm
+from userena.contrib.umessages.models import (Message, MessageRecipient,
+                                              InboxEntry, Broadcast, BroadcastState,
+                                              MessageSearchTerm, UserSearchName)
+from userena.contrib.umessages.forms import ComposeForm, block_recipients
+from userena.contrib.umessages.utils import (encode_cursor, decode_cursor,
+                                             inbox_position)
+from userena.contrib.umessages.export import EXPORT_FORMATS
+from userena.contrib.umessages import unread
+from userena.utils import get_user_by_username_or_404
 from userena import settings as userena_settings
 
-import datetime
+import datetime, time
 
 @login_required
-def message_list(request, page=1, paginate_by=50,
+def message_list(request, paginate_by=50, broadcast_limit=5,
                  template_name="umessages/message_list.html",
                  extra_context=None, **kwargs):
     """
@@ -33,60 +42,93 @@ def message_list(request, page=1, paginate_by=50,
     which at the top has the user that the last conversation was with. This is
     an imitation of the iPhone SMS functionality.
 
-    :param page:
-        Integer of the active page used for pagination. Defaults to the first
-        page.
+    The list is paginated with cursors instead of page numbers, just like
+    :func:`message_detail`. A ``GET`` with ``before`` shows the conversations
+    that are older than the cursor, one with ``after`` the ones that are
+    newer.
 
     :param paginate_by:
         Integer defining the amount of displayed messages per page.
         Defaults to 50 messages per per page.
 
+    :param broadcast_limit:
+        Integer defining the amount of broadcasts that are shown on the first
+        page. Defaults to 5.
+
     :param template_name:
         String of the template that is rendered to display this view.
 
     :param extra_context:
         Dictionary of variables that will be made available to the template.
 
-    If the result is paginated, the context will also contain the following
-    variables.
+    **Context**
 
-    ``paginator``
-        An instance of ``django.core.paginator.Paginator``.
+    ``message_list``
+        List of :class:`InboxEntry` on this page, with the ``counterpart``,
+        ``snippet`` of the latest message and ``unread_count`` of every
+        conversation.
 
-    ``page_obj``
-        An instance of ``django.core.paginator.Page``.
+    ``has_older`` and ``has_newer``
+        Booleans whether there are older or newer conversations.
+
+    ``older_cursor`` and ``newer_cursor``
+        Strings that are supplied as ``before`` and ``after`` to get the
+        older or newer conversations.
+
+    ``broadcast_list``
+        List of the latest :class:`Broadcast` for the user, only on the first
+        page. Every broadcast has an ``is_read`` attribute.
 
     """
-    queryset = MessageContact.objects.get_contacts_for(request.user)
+    before = decode_cursor(request.GET.get('before'))
+    after = decode_cursor(request.GET.get('after'))
+    message_list, has_more = InboxEntry.objects.get_inbox_page(request.user,
+                                                               before=before,
+                                                               after=after,
+                                                               limit=paginate_by)
+    if before is None and after is not None:
+        has_older, has_newer = True, has_more
+    else:
+        has_older, has_newer = has_more, before is not None
+
+    broadcast_list = []
+    if not has_newer and broadcast_limit:
+        broadcast_list = list(Broadcast.objects.get_broadcasts_for(request.user)[:broadcast_limit])
+        Broadcast.objects.attach_read(request.user, broadcast_list)
 
     if not extra_context: extra_context = dict()
-    return list_detail.object_list(request,
-                                   queryset=queryset,
-                                   paginate_by=paginate_by,
-                                   page=page,
-                                   template_name=template_name,
-                                   extra_context=extra_context,
-                                   template_object_name="message",
-                                   **kwargs)
+    extra_context.update({
+        'broadcast_list': broadcast_list,
+        'message_list': message_list,
+        'has_older': has_older and len(message_list) > 0,
+        'has_newer': has_newer and len(message_list) > 0,
+        'older_cursor': message_list and encode_cursor(message_list[-1], inbox_position) or None,
+        'newer_cursor': message_list and encode_cursor(message_list[0], inbox_position) or None,
+    })
+    return direct_to_template(request,
+                              template_name,
+                              extra_context=extra_context,
+                              **kwargs)
 
 @login_required
-def message_detail(request, username, page=1, paginate_by=10,
+def message_detail(request, username, paginate_by=10,
                    template_name="umessages/message_detail.html",
-                   extra_context=None, **kwargs):
+                   read_page_only=False, extra_context=None, **kwargs):
     """
     Returns a conversation between two users
 
+    The conversation is paginated with cursors instead of page numbers. A
+    ``GET`` with ``before`` shows the messages that are older than the cursor,
+    one with ``after`` the messages that are newer. Without a cursor the
+    newest messages are shown.
+
     :param username:
         String containing the username of :class:`User` of whom the
         conversation is with.
 
-    :param page:
-        Integer of the active page used for pagination. Defaults to the first
-        page.
-
     :param paginate_by:
         Integer defining the amount of displayed messages per page.
-        Defaults to 50 messages per per page.
+        Defaults to 10 messages per per page.
 
     :param extra_context:
         Dictionary of variables that will be made available to the template.
@@ -94,8 +136,95 @@ def message_detail(request, username, page=1, paginate_by=10,
     :param template_name:
         String of the template that is rendered to display this view.
 
-    If the result is paginated, the context will also contain the following
-    variables.
+    :param read_page_only:
+        Boolean that defines if only the messages on the displayed page are
+        marked as read. Defaults to ``False``, marking the whole conversation
+        as read.
+
+    **Context**
+
+    ``message_list``
+        List of messages on this page, newest first.
+
+    ``recipient``
+        The :class:`User` with whom the conversation is.
+
+    ``has_older`` and ``has_newer``
+        Booleans whether there are older or newer messages.
+
+    ``older_cursor`` and ``newer_cursor``
+        Strings that are supplied as ``before`` and ``after`` to get the
+        older or newer messages.
+
+    """
+    recipient = get_user_by_username_or_404(username, request)
+
+    before = decode_cursor(request.GET.get('before'))
+    after = decode_cursor(request.GET.get('after'))
+    message_list, has_more = Message.objects.get_conversation_page(request.user,
+                                                                   recipient,
+                                                                   before=before,
+                                                                   after=after,
+                                                                   limit=paginate_by)
+    if before is None and after is not None:
+        has_older, has_newer = True, has_more
+    else:
+        has_older, has_newer = has_more, before is not None
+
+    # Update all the messages that are unread.
+    message_pks = None
+    if read_page_only:
+        message_pks = [m.pk for m in message_list]
+    MessageRecipient.objects.mark_read_between(request.user,
+                                               recipient,
+                                               message_pks)
+
+    if not extra_context: extra_context = dict()
+    extra_context.update({
+        'message_list': message_list,
+        'recipient': recipient,
+        'has_older': has_older and len(message_list) > 0,
+        'has_newer': has_newer and len(message_list) > 0,
+        'older_cursor': message_list and encode_cursor(message_list[-1]) or None,
+        'newer_cursor': message_list and encode_cursor(message_list[0]) or None,
+    })
+    return direct_to_template(request,
+                              template_name,
+                              extra_context=extra_context,
+                              **kwargs)
+
+@login_required
+def message_search(request, page=None, paginate_by=20,
+                   template_name="umessages/message_search.html",
+                   extra_context=None, **kwargs):
+    """
+    Searches the messages that the user sent or received.
+
+    The words to search for are supplied with ``q`` in the ``GET``. Results
+    are ranked by the amount of words they contain. Messages that are moved
+    to the archive are not found.
+
+    :param page:
+        Integer of the active page used for pagination. Defaults to the
+        ``page`` in the ``GET``, or the first page.
+
+    :param paginate_by:
+        Integer defining the amount of displayed messages per page.
+        Defaults to 20 messages per per page.
+
+    :param template_name:
+        String of the template that is rendered to display this view.
+
+    :param extra_context:
+        Dictionary of variables that will be made available to the template.
+
+    **Context**
+
+    ``query``
+        String that is searched for.
+
+    ``message_list``
+        List of :class:`Message` on this page, best match first.
 
     ``paginator``
         An instance of ``django.core.paginator.Paginator``.
@@ -103,29 +232,233 @@ def message_detail(request, username, page=1, paginate_by=10,
     ``page_obj``
         An instance of ``django.core.paginator.Page``.
 
+    ``is_paginated``
+        Boolean whether there is more than one page.
+
     """
-    recipient = get_object_or_404(User,
-                                  username__iexact=username)
-    queryset = Message.objects.get_conversation_between(request.user,
-                                                        recipient)
+    query = request.GET.get('q', '')
+    queryset = MessageSearchTerm.objects.search(request.user, query)
+
+    paginator = Paginator(queryset, paginate_by, allow_empty_first_page=True)
+    if not page: page = request.GET.get('page', 1)
+    try:
+        page_number = int(page)
+    except ValueError:
+        if page == 'last':
+            page_number = paginator.num_pages
+        else: raise Http404
+    try:
+        page_obj = paginator.page(page_number)
+    except InvalidPage:
+        raise Http404
+
+    # Fetch the messages of this page in the order of their rank.
+    message_pks = [result['message'] for result in page_obj.object_list]
+    messages_by_pk = Message.objects.select_related('sender').in_bulk(message_pks)
+    message_list = [messages_by_pk[pk] for pk in message_pks if pk in messages_by_pk]
 
-    # Update all the messages that are unread.
-    message_pks = [m.pk for m in queryset]
-    unread_list = MessageRecipient.objects.filter(message__in=message_pks,
-                                                  user=request.user,
-                                                  read_at__isnull=True)
-    unread_list.update(read_at=now())
+    if not extra_context: extra_context = dict()
+    extra_context.update({
+        'query': query,
+        'message_list': message_list,
+        'paginator': paginator,
+        'page_obj': page_obj,
+        'is_paginated': page_obj.has_other_pages(),
+    })
+    return direct_to_template(request,
+                              template_name,
+                              extra_context=extra_context,
+                              **kwargs)
+
+@login_required
+def message_export(request, format='json', batch_size=500):
+    """
+    Downloads all the messages that the user sent or received.
+
+    The response is streamed while the messages are read in batches, so a
+    user with many messages doesn't take more memory. Middleware that reads
+    the whole content, like ``GZipMiddleware``, undoes this.
+
+    :param format:
+        String with the format, ``json`` for JSON lines or ``csv``. Defaults
+        to ``json``.
+
+    :param batch_size:
+        Integer with the amount of messages that are read per query.
+
+    """
+    try:
+        export, mimetype, extension = EXPORT_FORMATS[format]
+    except KeyError:
+        raise Http404
+
+    response = HttpResponse(export(request.user, batch_size),
+                            mimetype=mimetype)
+    response['Content-Disposition'] = 'attachment; filename=messages.%s' % extension
+    return response
+
+@login_required
+def broadcast_detail(request, broadcast_id,
+                     template_name="umessages/broadcast_detail.html",
+                     extra_context=None, **kwargs):
+    """
+    Shows a broadcast and marks it as read for the user.
+
+    :param broadcast_id:
+        Integer with the id of the :class:`Broadcast`.
+
+    :param template_name:
+        String of the template that is rendered to display this view.
+
+    :param extra_context:
+        Dictionary of variables that will be made available to the template.
+
+    **Context**
+
+    ``broadcast``
+        The :class:`Broadcast` that is shown.
+
+    """
+    broadcast = get_object_or_404(Broadcast.objects.get_broadcasts_for(request.user),
+                                  pk=broadcast_id)
+    BroadcastState.objects.mark_read(request.user, [broadcast.pk])
 
     if not extra_context: extra_context = dict()
-    extra_context['recipient'] = recipient
-    return list_detail.object_list(request,
-                                   queryset=queryset,
-                                   paginate_by=paginate_by,
-                                   page=page,
-                                   template_name=template_name,
-                                   extra_context=extra_context,
-                                   template_object_name="message",
-                                   **kwargs)
+    extra_context['broadcast'] = broadcast
+    return direct_to_template(request,
+                              template_name,
+                              extra_context=extra_context,
+                              **kwargs)
+
+@login_required
+@require_http_methods(["POST"])
+def broadcast_remove(request, undo=False):
+    """
+    A ``POST`` to remove broadcasts from the inbox of the user.
+
+    :param undo:
+        A Boolean that if ``True`` unremoves broadcasts.
+
+    POST can have the following keys:
+
+        ``broadcast_pks``
+            List of broadcast id's that should be removed.
+
+        ``next``
+            String containing the URI which to redirect to after the
+            broadcasts are removed. Redirect defaults to the inbox view.
+
+    """
+    broadcast_pks = set()
+    for pk in request.POST.getlist('broadcast_pks'):
+        try: broadcast_pks.add(int(pk))
+        except (TypeError, ValueError): pass
+    redirect_to = request.REQUEST.get('next', False)
+
+    # Only the broadcasts that the user received can be changed.
+    if broadcast_pks:
+        broadcast_pks = list(Broadcast.objects.get_broadcasts_for(request.user,
+                                                                  include_removed=undo)
+                                              .filter(pk__in=broadcast_pks)
+                                              .values_list('pk', flat=True))
+
+    if broadcast_pks:
+        BroadcastState.objects.set_state(request.user,
+                                         broadcast_pks,
+                                         deleted_at=not undo and now() or None)
+
+        if userena_settings.USERENA_USE_MESSAGES:
+            if undo:
+                message = ungettext('Broadcast is succesfully restored.',
+                                    'Broadcasts are succesfully restored.',
+                                    len(broadcast_pks))
+            else:
+                message = ungettext('Broadcast is successfully removed.',
+                                    'Broadcasts are successfully removed.',
+                                    len(broadcast_pks))
+
+            messages.success(request, message, fail_silently=True)
+
+    if redirect_to: return redirect(redirect_to)
+    else: return redirect(reverse('userena_umessages_list'))
+
+@login_required
+def message_poll(request, timeout=25, interval=1):
+    """
+    Waits until the unread messages of the user change and returns them as
+    JSON.
+
+    The view compares the ``version`` that the client supplies with the
+    version of the unread counts in the cache, so waiting doesn't query the
+    database. The response is returned as soon as the versions differ, or
+    after ``timeout`` seconds.
+
+    :param timeout:
+        Integer defining the maximum amount of seconds that the request is
+        held open. The client can ask for less by supplying ``timeout`` in
+        the ``GET``.
+
+    :param interval:
+        Number of seconds between the checks of the version.
+
+    The response contains the following keys:
+
+        ``version``
+            String that the client supplies as ``version`` on the next poll.
+
+        ``changed``
+            Boolean whether the unread messages changed. Only when ``True``
+            the other keys are supplied.
+
+        ``unread_count``
+            Integer with the amount of unread messages.
+
+        ``latest_message``
+            Integer with the id of the latest received message, or ``null``.
+
+    """
+    try:
+        timeout = min(timeout, max(0, float(request.GET.get('timeout', timeout))))
+    except ValueError: pass
+
+    client_version = request.GET.get('version')
+    started = time.time()
+    version = unread.get_version(request.user.pk)
+    while version == client_version and time.time() - started < timeout:
+        time.sleep(min(interval, max(0, timeout - (time.time() - started))))
+        version = unread.get_version(request.user.pk)
+
+    response = {'version': version,
+                'changed': version != client_version}
+    if response['changed']:
+        response.update({
+            'unread_count': MessageRecipient.objects.count_unread_messages_for(request.user),
+            'latest_message': MessageRecipient.objects.get_latest_message_id(request.user),
+        })
+    return HttpResponse(simplejson.dumps(response),
+                        mimetype='application/json')
+
+@login_required
+def message_autocomplete(request, limit=10):
+    """
+    Returns the users of which a name starts with ``q`` in the ``GET``, as
+    JSON.
+
+    Only active users are returned, never the user that searches or users
+    that blocked them.
+
+    :param limit:
+        Integer with the maximum amount of users. Defaults to 10.
+
+    The response is a list with a dictionary per user, containing the
+    ``username`` and the ``name``.
+
+    """
+    user_list = UserSearchName.objects.autocomplete(request.GET.get('q', ''),
+                                                    exclude_user=request.user,
+                                                    limit=limit)
+    return HttpResponse(simplejson.dumps(user_list),
+                        mimetype='application/json')
 
 @login_required
 def message_compose(request, recipients=None, compose_form=ComposeForm,
@@ -140,7 +473,8 @@ def message_compose(request, recipients=None, compose_form=ComposeForm,
 
     :param compose_form:
         The form that is used for getting neccesary information. Defaults to
-        :class:`ComposeForm`.
+        :class:`ComposeForm`. A ``to`` field of the form refuses the users
+        that blocked the sender, see :func:`block_recipients`.
 
     :param success_url:
         String containing the named url which to redirect to after successfull
@@ -173,27 +507,34 @@ def message_compose(request, recipients=None, compose_form=ComposeForm,
     form = compose_form(initial=initial_data)
     if request.method == "POST":
         form = compose_form(request.POST)
+        block_recipients(form, request.user)
         if form.is_valid():
             requested_redirect = request.REQUEST.get("next", False)
 
             message = form.save(request.user)
             recipients = form.cleaned_data['to']
 
-            if userena_settings.USERENA_USE_MESSAGES:
-                messages.success(request, _('Message is sent.'),
-                                 fail_silently=True)
-
-            requested_redirect = request.REQUEST.get(REDIRECT_FIELD_NAME,
-                                                     False)
-
-            # Redirect mechanism
-            redirect_to = reverse('userena_umessages_list')
-            if requested_redirect: redirect_to = requested_redirect
-            elif success_url: redirect_to = success_url
-            elif len(recipients) == 1:
-                redirect_to = reverse('userena_umessages_detail',
-                                      kwargs={'username': recipients[0].username})
-            return redirect(redirect_to)
+            # Every recipient blocked the sender in the meantime, or is no
+            # longer active.
+            if message is None:
+                field_name = 'to' in form.fields and 'to' or NON_FIELD_ERRORS
+                form._errors[field_name] = form.error_class([_('None of the recipients can receive this message.')])
+            else:
+                if userena_settings.USERENA_USE_MESSAGES:
+                    messages.success(request, _('Message is sent.'),
+                                     fail_silently=True)
+
+                requested_redirect = request.REQUEST.get(REDIRECT_FIELD_NAME,
+                                                         False)
+
+                # Redirect mechanism
+                redirect_to = reverse('userena_umessages_list')
+                if requested_redirect: redirect_to = requested_redirect
+                elif success_url: redirect_to = success_url
+                elif len(recipients) == 1:
+                    redirect_to = reverse('userena_umessages_detail',
+                                          kwargs={'username': recipients[0].username})
+                return redirect(redirect_to)
 
     if not extra_context: extra_context = dict()
     extra_context["form"] = form
@@ -236,41 +577,20 @@ def message_remove(request, undo=False):
                 valid_message_pk_list.add(valid_pk)
 
         # Delete all the messages, if they belong to the user.
-        dtnow = now()
-        changed_message_list = set()
-        for pk in valid_message_pk_list:
-            message = get_object_or_404(Message, pk=pk)
-
-            # Check if the user is the owner
-            if message.sender == request.user:
-                if undo:
-                    message.sender_deleted_at = None
-                else:
-                    message.sender_deleted_at = dtnow
-                message.save()
-                changed_message_list.add(message.pk)
-
-            # Check if the user is a recipient of the message
-            if request.user in message.recipients.all():
-                mr = message.messagerecipient_set.get(user=request.user,
-                                                      message=message)
-                if undo:
-                    mr.deleted_at = None
-                else:
-                    mr.deleted_at = dtnow
-                mr.save()
-                changed_message_list.add(message.pk)
+        changed_count = Message.objects.remove_messages(request.user,
+                                                        valid_message_pk_list,
+                                                        undo)
 
         # Send messages
-        if (len(changed_message_list) > 0) and userena_settings.USERENA_USE_MESSAGES:
+        if changed_count > 0 and userena_settings.USERENA_USE_MESSAGES:
             if undo:
                 message = ungettext('Message is succesfully restored.',
                                     'Messages are succesfully restored.',
-                                    len(changed_message_list))
+                                    changed_count)
             else:
                 message = ungettext('Message is successfully removed.',
                                     'Messages are successfully removed.',
-                                    len(changed_message_list))
+                                    changed_count)
 
             messages.success(request, message, fail_silently=True)
 
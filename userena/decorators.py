@@ -1,8 +1,10 @@
 from django.conf import settings
-from django.http import HttpResponsePermanentRedirect
+from django.http import HttpResponsePermanentRedirect, HttpResponseForbidden, Http404
 from django.utils.decorators import available_attrs
 
 from userena import settings as userena_settings
+from userena.utils import (get_user_by_username_or_404, get_user_profile,
+                           get_profile_model)
 
 from django.utils.functional import wraps
 
@@ -27,3 +29,37 @@ def secure_required(view_func):
                 return HttpResponsePermanentRedirect(secure_url)
         return view_func(request, *args, **kwargs)
     return wraps(view_func, assigned=available_attrs(view_func))(_wrapped_view)
+
+def permission_required_or_403(perm, profile=False):
+    """
+    Decorator that checks if the signed in user has a permission on the user
+    that is supplied by the ``username`` argument of the view.
+
+    A replacement for the decorator with the same name of django-guardian.
+    The user and profile are resolved through :func:`get_user_by_username`
+    and :func:`get_user_profile`, which memoize them on the request. The view
+    gets them again without doing any queries.
+
+    :param perm:
+        String with the codename of the permission.
+
+    :param profile:
+        Boolean that defines if the permission is checked on the profile of
+        the user, instead of the user itself.
+
+    """
+    def decorator(view_func):
+        def _wrapped_view(request, *args, **kwargs):
+            user = get_user_by_username_or_404(kwargs['username'], request)
+            if profile:
+                try:
+                    obj = get_user_profile(user, request)
+                except get_profile_model().DoesNotExist:
+                    raise Http404
+            else: obj = user
+
+            if not request.user.has_perm(perm, obj):
+                return HttpResponseForbidden()
+            return view_func(request, *args, **kwargs)
+        return wraps(view_func, assigned=available_attrs(view_func))(_wrapped_view)
+    return decorator
@@ -6,7 +6,8 @@ from django.utils.hashcompat import sha_constructor
 
 from userena import settings as userena_settings
 from userena.models import UserenaSignup
-from userena.utils import get_profile_model, generate_valid_random_username
+from userena.utils import (get_profile_model, generate_valid_random_username,
+                           get_field_values, save_changed_fields)
 
 import random
 
@@ -230,17 +231,32 @@ class EditProfileForm(forms.ModelForm):
                        if f not in self.user_fields]
         self.fields.keyOrder = new_order
 
+        # Remember the values of the profile, so that only the changed
+        # fields are saved.
+        self._original_profile = get_field_values(self.instance)
+
     class Meta:
         model = get_profile_model()
         exclude = ['user']
 
     def save(self, force_insert=False, force_update=False, commit=True):
-        profile = super(EditProfileForm, self).save(commit=commit)
+        """
+        Saves the profile and the user fields.
+
+        Only the fields that are changed are written to the database. When
+        nothing changed, nothing is written.
+
+        """
+        profile = super(EditProfileForm, self).save(commit=False)
         # Save user fields
         user = profile.user
+        original_user = get_field_values(user)
         for user_field_name in self.user_fields:
             setattr(user, user_field_name, self.cleaned_data[user_field_name])
         if commit:
-            user.save()
+            if profile.pk is None: profile.save()
+            else: save_changed_fields(profile, self._original_profile)
+            self.save_m2m()
+            save_changed_fields(user, original_user)
 
         return profile
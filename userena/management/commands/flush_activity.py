@@ -0,0 +1,29 @@
+from django.core.management.base import NoArgsCommand, BaseCommand
+from optparse import make_option
+
+from userena.models import UserenaSignup
+from userena.activity import drain_activity
+
+class Command(NoArgsCommand):
+    """
+    Write the activity that is buffered by ``UserenaActivityMiddleware`` to
+    the ``last_active`` field of the users.
+
+    """
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size',
+            action='store',
+            type='int',
+            dest='batch_size',
+            default=500,
+            help='Amount of users that are updated per query.'),
+        )
+
+    help = 'Writes buffered user activity to the database.'
+    def handle_noargs(self, **options):
+        batch_size = options.get('batch_size')
+        activity = drain_activity(batch_size)
+        updated = UserenaSignup.objects.update_last_active(activity,
+                                                           batch_size)
+        if int(options.get('verbosity', 1)) > 1:
+            self.stdout.write("Updated last activity of %s users.\n" % updated)
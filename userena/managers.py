@@ -10,7 +10,8 @@ except ImportError:
     now = datetime.datetime.now
 
 from userena import settings as userena_settings
-from userena.utils import generate_sha1, get_profile_model
+from userena.utils import (generate_sha1, get_profile_model,
+                           get_field_values, save_changed_fields)
 from userena import signals as userena_signals
 
 from guardian.shortcuts import assign, get_perms
@@ -127,11 +128,13 @@ class UserenaManager(UserManager):
             except self.model.DoesNotExist:
                 return False
             if not userena.activation_key_expired():
-                userena.activation_key = userena_settings.USERENA_ACTIVATED
                 user = userena.user
+                original_userena = get_field_values(userena)
+                original_user = get_field_values(user)
+                userena.activation_key = userena_settings.USERENA_ACTIVATED
                 user.is_active = True
-                userena.save(using=self._db)
-                user.save(using=self._db)
+                save_changed_fields(userena, original_userena, using=self._db)
+                save_changed_fields(user, original_user, using=self._db)
 
                 # Send the activation_complete signal
                 userena_signals.activation_complete.send(sender=None,
@@ -170,10 +173,12 @@ class UserenaManager(UserManager):
                 return False
             else:
                 user = userena.user
+                original_userena = get_field_values(userena)
+                original_user = get_field_values(user)
                 user.email = userena.email_unconfirmed
                 userena.email_unconfirmed, userena.email_confirmation_key = '',''
-                userena.save(using=self._db)
-                user.save(using=self._db)
+                save_changed_fields(userena, original_userena, using=self._db)
+                save_changed_fields(user, original_user, using=self._db)
 
                 # Send the confirmation_complete signal
                 userena_signals.confirmation_complete.send(sender=None,
@@ -198,6 +203,36 @@ class UserenaManager(UserManager):
                 user.delete()
         return deleted_users
 
+    def update_last_active(self, activity, batch_size=500):
+        """
+        Writes activity timestamps to ``last_active`` in bulk.
+
+        Users that share the same timestamp are updated with a single
+        ``UPDATE`` statement. A ``last_active`` is never moved back in time.
+
+        :param activity:
+            Dictionary with the user id as key and a ``datetime`` as value,
+            like returned by :func:`userena.activity.drain_activity`.
+
+        :param batch_size:
+            Integer defining the maximum amount of users per ``UPDATE``.
+
+        :return: Integer with the amount of updated rows.
+
+        """
+        user_ids_by_time = dict()
+        for user_id, when in activity.iteritems():
+            user_ids_by_time.setdefault(when, []).append(user_id)
+
+        updated = 0
+        for when, user_ids in user_ids_by_time.iteritems():
+            for i in xrange(0, len(user_ids), batch_size):
+                updated += self.filter(Q(last_active__isnull=True) |
+                                       Q(last_active__lt=when),
+                                       user__in=user_ids[i:i + batch_size]) \
+                               .update(last_active=when)
+        return updated
+
     def check_permissions(self):
         """
         Checks that all permissions are set correctly for the users.
@@ -4,6 +4,8 @@ from django.conf import settings
 from django.contrib.auth.models import SiteProfileNotAvailable
 
 from userena import settings as userena_settings
+from userena.activity import record_activity
+from userena.utils import get_user_profile
 
 class UserenaLocaleMiddleware(object):
     """
@@ -18,7 +20,7 @@ class UserenaLocaleMiddleware(object):
         if not lang_cookie:
             if request.user.is_authenticated():
                 try:
-                    profile = request.user.get_profile()
+                    profile = get_user_profile(request.user, request)
                 except (ObjectDoesNotExist, SiteProfileNotAvailable):
                     profile = False
 
@@ -28,3 +30,16 @@ class UserenaLocaleMiddleware(object):
                         translation.activate(lang)
                         request.LANGUAGE_CODE = translation.get_language()
                     except AttributeError: pass
+
+class UserenaActivityMiddleware(object):
+    """
+    Record when signed in users were last active.
+
+    The activity is buffered in the cache and recorded at most once every
+    ``USERENA_ACTIVITY_INTERVAL`` seconds per user. Run the ``flush_activity``
+    command periodically to write the buffer to ``UserenaSignup.last_active``.
+
+    """
+    def process_request(self, request):
+        if request.user.is_authenticated():
+            record_activity(request.user)
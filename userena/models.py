@@ -7,13 +7,16 @@ from django.contrib.sites.models import Site
 from django.core.urlresolvers import reverse
 from django.core.mail import send_mail
 from django.core.exceptions import ImproperlyConfigured
+from django.db.models.signals import post_save, post_delete
 
 try:
     from django.utils.timezone import now
 except ImportError:
     now = datetime.datetime.now
 
-from userena.utils import get_gravatar, generate_sha1, get_protocol
+from userena.utils import (get_gravatar, generate_sha1, get_protocol,
+                           invalidate_user_profile, invalidate_username,
+                           get_field_values, save_changed_fields)
 from userena.managers import UserenaManager, UserenaBaseProfileManager
 from userena.models_base import UserenaBaseProfile, UserenaMugshotBaseProfile
 from userena import settings as userena_settings
@@ -86,12 +89,13 @@ class UserenaSignup(models.Model):
             The new email address that the user wants to use.
 
         """
+        original = get_field_values(self)
         self.email_unconfirmed = email
 
         salt, hash = generate_sha1(self.user.username)
         self.email_confirmation_key = hash
         self.email_confirmation_key_created = now()
-        self.save()
+        save_changed_fields(self, original)
 
         # Send email for activation
         self.send_confirmation_email()
@@ -186,3 +190,21 @@ class UserenaSignup(models.Model):
                   settings.DEFAULT_FROM_EMAIL,
                   [self.user.email,])
 
+def invalidate_profile_cache(sender, instance, **kwargs):
+    """ Removes a changed or deleted profile from the profile cache """
+    if isinstance(instance, UserenaBaseProfile):
+        invalidate_user_profile(instance.user_id)
+
+post_save.connect(invalidate_profile_cache,
+                  dispatch_uid='userena_profile_cache_save')
+post_delete.connect(invalidate_profile_cache,
+                    dispatch_uid='userena_profile_cache_delete')
+
+def invalidate_username_cache(sender, instance, **kwargs):
+    """ Removes a changed or deleted username from the username cache """
+    invalidate_username(instance.pk)
+
+post_save.connect(invalidate_username_cache, sender=User,
+                  dispatch_uid='userena_username_cache_save')
+post_delete.connect(invalidate_username_cache, sender=User,
+                    dispatch_uid='userena_username_cache_delete')
@@ -0,0 +1,108 @@
+"""
+Index of the users that are currently online.
+
+The index is kept in the cache and fed by :func:`userena.activity.record_activity`.
+A user is online when they were active within the last
+``USERENA_ONLINE_TIMEOUT`` seconds.
+
+Every user has a key that expires when they go offline, which answers
+:func:`is_online` with a single cache lookup. Next to that the users are
+appended to a bucket per ``USERENA_ACTIVITY_INTERVAL``, so the most recently
+active users can be listed without touching the database.
+
+"""
+from django.core.cache import cache
+
+import calendar, datetime
+
+try:
+    from django.utils.timezone import now
+except ImportError:
+    now = datetime.datetime.now
+
+from userena import settings as userena_settings
+
+PRESENCE_USER_KEY = 'userena_presence_user_%s'
+PRESENCE_COUNT_KEY = 'userena_presence_bucket_%s_count'
+PRESENCE_SLOT_KEY = 'userena_presence_bucket_%s_%s'
+
+def _bucket(when):
+    """ Returns the number of the bucket that ``when`` falls in. """
+    return calendar.timegm(when.utctimetuple()) // \
+            userena_settings.USERENA_ACTIVITY_INTERVAL
+
+def mark_online(user, when):
+    """
+    Adds a user to the presence index.
+
+    :param user:
+        The :class:`User` that is active.
+
+    :param when:
+        ``datetime`` of the activity.
+
+    """
+    timeout = userena_settings.USERENA_ONLINE_TIMEOUT
+    bucket = _bucket(when)
+    cache.set(PRESENCE_USER_KEY % user.pk, bucket, timeout)
+
+    # Appending through ``incr`` gives every user their own slot, so
+    # concurrent requests can't overwrite each other.
+    count_key = PRESENCE_COUNT_KEY % bucket
+    try:
+        slot = cache.incr(count_key)
+    except ValueError:
+        cache.add(count_key, 0, timeout)
+        slot = cache.incr(count_key)
+
+    cache.set(PRESENCE_SLOT_KEY % (bucket, slot),
+              {'id': user.pk, 'username': user.username},
+              timeout)
+
+def is_online(user):
+    """
+    Returns a boolean whether a user is online.
+
+    :param user:
+        A Django :class:`User` or the id of one.
+
+    """
+    user_id = getattr(user, 'pk', user)
+    return cache.get(PRESENCE_USER_KEY % user_id) is not None
+
+def get_online_users(limit=None, when=None):
+    """
+    Returns the users that are online, most recently active first.
+
+    :param limit:
+        Optional integer with the maximum amount of users to return.
+
+    :param when:
+        Optional ``datetime`` of the current time. Defaults to now.
+
+    :return:
+        List of dictionaries with the ``id`` and ``username`` of the users.
+
+    """
+    if when is None: when = now()
+
+    current = _bucket(when)
+    oldest = current - (userena_settings.USERENA_ONLINE_TIMEOUT //
+                        userena_settings.USERENA_ACTIVITY_INTERVAL)
+
+    users, seen = [], set()
+    for bucket in xrange(current, oldest - 1, -1):
+        count = cache.get(PRESENCE_COUNT_KEY % bucket)
+        if not count: continue
+
+        keys = [PRESENCE_SLOT_KEY % (bucket, slot)
+                for slot in xrange(count, 0, -1)]
+        found = cache.get_many(keys)
+        for key in keys:
+            user = found.get(key)
+            if user is None or user['id'] in seen: continue
+            seen.add(user['id'])
+            users.append(user)
+            if limit is not None and len(users) >= limit:
+                return users
+    return users
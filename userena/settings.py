@@ -102,3 +102,31 @@ USERENA_USERADMIN = getattr(settings,
 USERENA_PROFILEADMIN = getattr(settings,
                                     'USERENA_PROFILEADMIN',
                                     'userena.admin_base.UserenaProfileAdmin')
+
+USERENA_ACTIVITY_INTERVAL = getattr(settings,
+                                    'USERENA_ACTIVITY_INTERVAL',
+                                    300)
+
+USERENA_ACTIVITY_BUFFER_TIMEOUT = getattr(settings,
+                                          'USERENA_ACTIVITY_BUFFER_TIMEOUT',
+                                          60 * 60 * 24)
+
+USERENA_ONLINE_TIMEOUT = getattr(settings,
+                                 'USERENA_ONLINE_TIMEOUT',
+                                 60 * 15)
+
+USERENA_PROFILE_CACHE_TIMEOUT = getattr(settings,
+                                        'USERENA_PROFILE_CACHE_TIMEOUT',
+                                        0)
+
+USERENA_USERNAME_CACHE_TIMEOUT = getattr(settings,
+                                         'USERENA_USERNAME_CACHE_TIMEOUT',
+                                         60 * 60)
+
+USERENA_UMESSAGES_CACHE_TIMEOUT = getattr(settings,
+                                          'USERENA_UMESSAGES_CACHE_TIMEOUT',
+                                          60 * 60)
+
+USERENA_UMESSAGES_AUTOCOMPLETE_TIMEOUT = getattr(settings,
+                                                 'USERENA_UMESSAGES_AUTOCOMPLETE_TIMEOUT',
+                                                 5 * 60)
@@ -0,0 +1,59 @@
+from django import template
+
+from userena import presence
+
+import re
+
+register = template.Library()
+
+class OnlineUsers(template.Node):
+    def __init__(self, limit, var_name):
+        self.limit = template.Variable(limit)
+        self.var_name = var_name
+
+    def render(self, context):
+        try:
+            limit = int(self.limit.resolve(context))
+        except (template.VariableDoesNotExist, TypeError, ValueError):
+            return ''
+
+        context[self.var_name] = presence.get_online_users(limit)
+
+        return ''
+
+@register.tag
+def get_online_users(parser, token):
+    """
+    Returns the users that are online, most recently active first. Each user
+    is a dictionary with an ``id`` and ``username`` key.
+
+    Syntax::
+
+        {% get_online_users [limit] as [var_name] %}
+
+    Example usage::
+
+        {% get_online_users 10 as online_users %}
+
+    """
+    try:
+        tag_name, arg = token.contents.split(None, 1)
+    except ValueError:
+        raise template.TemplateSyntaxError, "%s tag requires arguments" % token.contents.split()[0]
+    m = re.search(r'(.*?) as (\w+)', arg)
+    if not m:
+        raise template.TemplateSyntaxError, "%s tag had invalid arguments" % tag_name
+    limit, var_name = m.groups()
+    return OnlineUsers(limit, var_name)
+
+@register.filter
+def is_online(user):
+    """
+    Returns a boolean whether the user is online.
+
+    Example usage::
+
+        {% if profile.user|is_online %}Online{% endif %}
+
+    """
+    return presence.is_online(user)
@@ -5,6 +5,7 @@ from userena.tests.forms import *
 from userena.tests.managers import *
 from userena.tests.middleware import *
 from userena.tests.models import *
+from userena.tests.presence import *
 from userena.tests.privacy import *
 from userena.tests.utils import *
 from userena.tests.views import *
@@ -1,5 +1,6 @@
 from django.test import TestCase
 from django.core.management import call_command
+from django.core.cache import cache
 from django.contrib.auth.models import User, Permission
 from django.contrib.contenttypes.models import ContentType
 
@@ -7,6 +8,7 @@ from userena.models import UserenaSignup
 from userena.managers import ASSIGNED_PERMISSIONS
 from userena import settings as userena_settings
 from userena.utils import get_profile_model
+from userena.activity import record_activity
 
 from guardian.shortcuts import remove_perm
 from guardian.models import UserObjectPermission
@@ -37,6 +39,20 @@ class CleanExpiredTests(TestCase):
 
         self.failUnlessEqual(User.objects.filter(username=self.user_info['username']).count(), 0)
 
+class FlushActivityTests(TestCase):
+    fixtures = ['users']
+
+    def test_flush_activity(self):
+        """ Buffered activity is written to ``last_active`` """
+        cache.clear()
+        jane = User.objects.get(pk=2)
+        record_activity(jane)
+
+        call_command('flush_activity')
+
+        signup = UserenaSignup.objects.get(user=jane)
+        self.failUnless(signup.last_active)
+
 class CheckPermissionTests(TestCase):
     user_info = {'username': 'alice',
                  'password': 'swordfish',
@@ -3,10 +3,12 @@ from django.utils.importlib import import_module
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist
 from django.conf import settings
+from django.core.cache import cache
 
 from userena.tests.profiles.test import ProfileTestCase
 from userena.tests.profiles.models import Profile
-from userena.middleware import UserenaLocaleMiddleware
+from userena.middleware import UserenaLocaleMiddleware, UserenaActivityMiddleware
+from userena.activity import drain_activity
 from userena import settings as userena_settings
 
 class UserenaLocaleMiddlewareTests(ProfileTestCase):
@@ -69,3 +71,26 @@ class UserenaLocaleMiddlewareTests(ProfileTestCase):
         # Middleware should do nothing
         UserenaLocaleMiddleware().process_request(req)
         self.failIf(hasattr(req, 'LANGUAGE_CODE'))
+
+class UserenaActivityMiddlewareTests(ProfileTestCase):
+    """ Test the ``UserenaActivityMiddleware`` """
+    fixtures = ['users']
+
+    def setUp(self):
+        cache.clear()
+
+    def test_activity_is_coalesced(self):
+        """ Multiple requests within the interval are recorded once """
+        user = User.objects.get(pk=1)
+        request = HttpRequest()
+        request.user = user
+
+        for i in range(3):
+            UserenaActivityMiddleware().process_request(request)
+
+        activity = drain_activity()
+        self.failUnlessEqual(activity.keys(), [user.pk])
+
+        # The log is empty after draining it.
+        self.failUnlessEqual(drain_activity(), {})
+
@@ -0,0 +1,35 @@
+from django.test import TestCase
+from django.core.cache import cache
+from django.contrib.auth.models import User
+
+from userena.activity import record_activity
+from userena import presence
+
+class PresenceTests(TestCase):
+    """ Test the presence index """
+    fixtures = ['users']
+
+    def setUp(self):
+        cache.clear()
+
+    def test_is_online(self):
+        """ Only users with recorded activity are online """
+        john = User.objects.get(pk=1)
+        jane = User.objects.get(pk=2)
+
+        record_activity(john)
+
+        self.failUnless(presence.is_online(john))
+        self.failUnless(presence.is_online(john.pk))
+        self.failIf(presence.is_online(jane))
+
+    def test_get_online_users(self):
+        """ Online users are listed once, without querying the database """
+        for user in User.objects.all():
+            record_activity(user)
+
+        online_users = self.assertNumQueries(0, presence.get_online_users)
+        self.failUnlessEqual(len(online_users), User.objects.count())
+
+        # The limit is respected.
+        self.failUnlessEqual(len(presence.get_online_users(limit=2)), 2)
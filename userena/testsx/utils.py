@@ -2,9 +2,14 @@ from django.test import TestCase
 from django.contrib.auth.models import User
 from django.conf import settings
 from django.contrib.auth.models import SiteProfileNotAvailable
+from django.http import HttpRequest
+from django.core.cache import cache
 
 from userena.utils import (get_gravatar, signin_redirect, get_profile_model,
-                           get_protocol)
+                           get_protocol, get_user_profile,
+                           get_user_by_username, get_field_values,
+                           save_changed_fields)
+from userena.tests.profiles.test import ProfileTestCase
 from userena import settings as userena_settings
 from userena.models import UserenaBaseProfile
 
@@ -95,3 +100,90 @@ class UtilsTests(TestCase):
         userena_settings.USERENA_USE_HTTPS = True
         self.failUnlessEqual(get_protocol(), 'https')
         userena_settings.USERENA_USE_HTTPS = False
+
+class ProfileCacheTests(ProfileTestCase):
+    """ Test the profile cache of ``get_user_profile`` """
+    fixtures = ['users', 'profiles']
+
+    def setUp(self):
+        cache.clear()
+        userena_settings.USERENA_PROFILE_CACHE_TIMEOUT = 60
+
+    def tearDown(self):
+        userena_settings.USERENA_PROFILE_CACHE_TIMEOUT = 0
+
+    def test_request_memoization(self):
+        """ A profile is fetched once per request """
+        request = HttpRequest()
+        profile = get_user_profile(User.objects.get(pk=1), request)
+
+        # Another instance of the same user gets the memoized profile.
+        self.failUnless(get_user_profile(User.objects.get(pk=1),
+                                         request) is profile)
+
+    def test_cache_invalidation(self):
+        """ A saved profile is removed from the cache """
+        profile = get_user_profile(User.objects.get(pk=1))
+
+        # Served from the cache on a fresh user instance.
+        user = User.objects.get(pk=1)
+        self.assertNumQueries(0, get_user_profile, user)
+
+        profile.language = 'en'
+        profile.save()
+
+        self.failUnlessEqual(get_user_profile(User.objects.get(pk=1)).language,
+                             'en')
+
+class UsernameCacheTests(TestCase):
+    """ Test the username cache of ``get_user_by_username`` """
+    fixtures = ['users']
+
+    def setUp(self):
+        cache.clear()
+
+    def test_get_user_by_username(self):
+        """ Usernames are resolved case insensitive and once per request """
+        request = HttpRequest()
+        request.user = User.objects.get(pk=2)
+
+        user = get_user_by_username('JOHN', request)
+        self.failUnlessEqual(user.pk, 1)
+        self.assertNumQueries(0, get_user_by_username, 'john', request)
+
+        # The signed in user needs no query.
+        self.failUnless(get_user_by_username('jane', request) is request.user)
+
+    def test_username_change(self):
+        """ A changed username is removed from the cache """
+        get_user_by_username('john')
+
+        user = User.objects.get(pk=1)
+        user.username = 'johnny'
+        user.save()
+
+        self.assertRaises(User.DoesNotExist, get_user_by_username, 'john')
+        self.failUnlessEqual(get_user_by_username('johnny').pk, 1)
+
+class SaveChangedFieldsTests(TestCase):
+    """ Test ``save_changed_fields`` """
+    fixtures = ['users']
+
+    def test_nothing_changed(self):
+        """ An unchanged instance isn't written """
+        user = User.objects.get(pk=1)
+        original = get_field_values(user)
+
+        self.failUnlessEqual(self.assertNumQueries(0, save_changed_fields,
+                                                   user, original), [])
+
+    def test_changed_field(self):
+        """ Only the changed field is written """
+        user = User.objects.get(pk=1)
+        original = get_field_values(user)
+        user.first_name = 'Johnny'
+
+        self.failUnlessEqual(save_changed_fields(user, original),
+                             ['first_name'])
+        self.failUnlessEqual(User.objects.get(pk=1).first_name, 'Johnny')
+
@@ -2,10 +2,15 @@ from django.conf import settings
 from django.utils.hashcompat import sha_constructor
 from django.contrib.auth.models import User, SiteProfileNotAvailable
 from django.db.models import get_model
+from django.db.models.signals import pre_save, post_save
+from django.db.models.fields.files import FieldFile
+from django.db import router
+from django.core.cache import cache
+from django.http import Http404
 
 from userena import settings as userena_settings
 
-import urllib, random
+import urllib, random, copy, time
 
 from django.utils.hashcompat import md5_constructor
 
@@ -131,6 +136,225 @@ def get_profile_model():
         raise SiteProfileNotAvailable
     return profile_mod
 
+PROFILE_CACHE_KEY = 'userena_profile_%s_%s'
+PROFILE_VERSION_KEY = 'userena_profile_version_%s'
+
+def _profile_cache_key(user_id):
+    """ Returns the cache key for the current version of a profile. """
+    version_key = PROFILE_VERSION_KEY % user_id
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, '%f' % time.time(),
+                  userena_settings.USERENA_PROFILE_CACHE_TIMEOUT)
+        version = cache.get(version_key)
+    return PROFILE_CACHE_KEY % (user_id, version)
+
+def get_user_profile(user, request=None):
+    """
+    Returns the profile of a user, like :func:`User.get_profile` does.
+
+    The profile is memoized on the ``request``, so every lookup of the same
+    user within a request returns the same profile. When
+    ``USERENA_PROFILE_CACHE_TIMEOUT`` is set the profile is also stored in the
+    cache, until it's changed or deleted.
+
+    :param user:
+        The :class:`User` whose profile is returned.
+
+    :param request:
+        Optional ``HttpRequest`` on which the profile is memoized.
+
+    :return: The profile of the user.
+
+    """
+    profiles = None
+    if request is not None:
+        profiles = request.__dict__.setdefault('_userena_profiles', dict())
+        if user.pk in profiles:
+            return profiles[user.pk]
+
+    profile = getattr(user, '_profile_cache', None)
+    if profile is None:
+        timeout = userena_settings.USERENA_PROFILE_CACHE_TIMEOUT
+        cache_key = None
+        if timeout:
+            cache_key = _profile_cache_key(user.pk)
+            profile = cache.get(cache_key)
+            if profile is not None: profile._user_cache = user
+
+        if profile is None:
+            profile = user.get_profile()
+            if cache_key:
+                # The profile is stored without its user, which is always
+                # supplied by the caller.
+                cached_profile = copy.copy(profile)
+                cached_profile.__dict__.pop('_user_cache', None)
+                cache.set(cache_key, cached_profile, timeout)
+
+        # Also makes ``user.get_profile()`` use this profile.
+        user._profile_cache = profile
+
+    if profiles is not None: profiles[user.pk] = profile
+    return profile
+
+def invalidate_user_profile(user_id):
+    """
+    Removes a profile from the cache used by :func:`get_user_profile`.
+
+    :param user_id:
+        Integer with the id of the user whose profile is invalidated.
+
+    """
+    if userena_settings.USERENA_PROFILE_CACHE_TIMEOUT:
+        cache.set(PROFILE_VERSION_KEY % user_id, '%f' % time.time(),
+                  userena_settings.USERENA_PROFILE_CACHE_TIMEOUT)
+
+USERNAME_CACHE_KEY = 'userena_username_%s'
+USER_USERNAME_CACHE_KEY = 'userena_user_username_%s'
+
+def _username_cache_key(username):
+    """ Returns the cache key for a lowercased username. """
+    return USERNAME_CACHE_KEY % md5_constructor(username.encode('utf-8')).hexdigest()
+
+def get_user_by_username(username, request=None):
+    """
+    Returns the :class:`User` with a username, ignoring the case.
+
+    The username is resolved once per ``request``. The id that belongs to the
+    username is cached for ``USERENA_USERNAME_CACHE_TIMEOUT`` seconds, so
+    that the user can be fetched by its primary key.
+
+    :param username:
+        String containing the username.
+
+    :param request:
+        Optional ``HttpRequest`` on which the user is memoized. If the
+        username is that of the signed in user, ``request.user`` is returned.
+
+    :return: The :class:`User`. Raises ``User.DoesNotExist`` if there is none.
+
+    """
+    lookup = username.lower()
+
+    users = None
+    if request is not None:
+        users = request.__dict__.setdefault('_userena_users', dict())
+        if lookup in users:
+            return users[lookup]
+
+        if request.user.is_authenticated() and \
+           request.user.username.lower() == lookup:
+            users[lookup] = request.user
+            return request.user
+
+    user = None
+    user_id = cache.get(_username_cache_key(lookup))
+    if user_id is not None:
+        try: user = User.objects.get(pk=user_id)
+        except User.DoesNotExist: pass
+        else:
+            # The username changed without the cache being invalidated.
+            if user.username.lower() != lookup: user = None
+
+    if user is None:
+        user = User.objects.get(username__iexact=username)
+        cache.set_many({_username_cache_key(lookup): user.pk,
+                        USER_USERNAME_CACHE_KEY % user.pk: lookup},
+                       userena_settings.USERENA_USERNAME_CACHE_TIMEOUT)
+
+    if users is not None: users[lookup] = user
+    return user
+
+def get_user_by_username_or_404(username, request=None):
+    """
+    Like :func:`get_user_by_username`, but raises ``Http404`` when no
+    :class:`User` has the username.
+
+    """
+    try:
+        return get_user_by_username(username, request)
+    except User.DoesNotExist:
+        raise Http404
+
+def invalidate_username(user_id):
+    """
+    Removes the username of a user from the cache used by
+    :func:`get_user_by_username`.
+
+    :param user_id:
+        Integer with the id of the user whose username is invalidated.
+
+    """
+    reverse_key = USER_USERNAME_CACHE_KEY % user_id
+    lookup = cache.get(reverse_key)
+    if lookup is not None:
+        cache.delete_many([_username_cache_key(lookup), reverse_key])
+
+def get_field_values(instance):
+    """
+    Returns the values of the fields of a model instance.
+
+    Take these values before changing the instance and supply them to
+    :func:`save_changed_fields` to only write the fields that changed.
+
+    :param instance:
+        A Django model instance.
+
+    :return: Dictionary with the attribute name of the field as key.
+
+    """
+    values = dict()
+    for field in instance._meta.fields:
+        value = getattr(instance, field.attname)
+        # Files are compared by their name, the file object is reused.
+        if isinstance(value, FieldFile): value = value.name
+        values[field.attname] = value
+    return values
+
+def save_changed_fields(instance, original, using=None):
+    """
+    Saves the fields of a model instance that differ from ``original``.
+
+    Only the changed columns are written with an ``UPDATE``. The
+    ``pre_save`` and ``post_save`` signals are sent like :func:`Model.save`
+    does. When nothing changed, nothing is written and no signals are sent.
+
+    :param instance:
+        A Django model instance that is already saved in the database.
+
+    :param original:
+        Dictionary with the values of the instance before it was changed,
+        like returned by :func:`get_field_values`.
+
+    :param using:
+        Optional string with the alias of the database to write to.
+
+    :return: List with the names of the saved fields.
+
+    """
+    def changed_fields():
+        current = get_field_values(instance)
+        return [f for f in instance._meta.fields
+                if f.attname not in original or
+                   original[f.attname] != current[f.attname]]
+
+    if not changed_fields(): return []
+
+    model = instance.__class__
+    if using is None: using = router.db_for_write(model, instance=instance)
+
+    pre_save.send(sender=model, instance=instance, raw=False, using=using)
+
+    # A receiver of ``pre_save`` could have changed more fields. The
+    # ``pre_save`` of a file field also commits the uploaded file.
+    fields = changed_fields()
+    values = dict((f.name, f.pre_save(instance, False)) for f in fields)
+    model._default_manager.using(using).filter(pk=instance.pk).update(**values)
+
+    post_save.send(sender=model, instance=instance, created=False, raw=False,
+                   using=using)
+    return values.keys()
+
 def get_protocol():
     """
     Returns a string with the current protocol.
@@ -14,14 +14,13 @@ from django.http import HttpResponseForbidden, HttpResponseRedirect, Http404
 from userena.forms import (SignupForm, SignupFormOnlyEmail, AuthenticationForm,
                            ChangeEmailForm, EditProfileForm)
 from userena.models import UserenaSignup
-from userena.decorators import secure_required
+from userena.decorators import secure_required, permission_required_or_403
 from userena.backends import UserenaAuthenticationBackend
-from userena.utils import signin_redirect, get_profile_model
+from userena.utils import (signin_redirect, get_profile_model, get_user_profile,
+                           get_user_by_username_or_404)
 from userena import signals as userena_signals
 from userena import settings as userena_settings
 
-from guardian.decorators import permission_required_or_403
-
 
 def signup(request, signup_form=SignupForm,
            template_name='userena/signup_form.html', success_url=None,
@@ -236,7 +235,7 @@ def direct_to_user_template(request, username, template_name,
         The currently :class:`User` that is viewed.
 
     """
-    user = get_object_or_404(User, username__iexact=username)
+    user = get_user_by_username_or_404(username, request)
 
     if not extra_context: extra_context = dict()
     extra_context['viewed_user'] = user
@@ -369,7 +368,7 @@ def email_change(request, username, email_form=ChangeEmailForm,
     permissions to alter the email address of others.
 
     """
-    user = get_object_or_404(User, username__iexact=username)
+    user = get_user_by_username_or_404(username, request)
 
     form = email_form(user)
 
@@ -431,8 +430,7 @@ def password_change(request, username, template_name='userena/password_form.html
         Form used to change the password.
 
     """
-    user = get_object_or_404(User,
-                             username__iexact=username)
+    user = get_user_by_username_or_404(username, request)
 
     form = pass_form(user=user)
 
@@ -507,10 +505,9 @@ def profile_edit(request, username=None, edit_profile_form=EditProfileForm,
             username = request.user.username
         else:
             return HttpResponseRedirect(redirect_to=reverse('userena_signin'))
-    user = get_object_or_404(User,
-                             username__iexact=username)
+    user = get_user_by_username_or_404(username, request)
 
-    profile = user.get_profile()
+    profile = get_user_profile(user, request)
 
     user_initial = {'first_name': user.first_name,
                     'last_name': user.last_name}
@@ -568,13 +565,12 @@ def profile_detail(request, username=None, template_name='userena/profile_detail
             username = request.user.username
         else:
             return HttpResponseRedirect(redirect_to=reverse('userena_signin'))
-    user = get_object_or_404(User,
-                             username__iexact=username)
-    profile = user.get_profile()
+    user = get_user_by_username_or_404(username, request)
+    profile = get_user_profile(user, request)
     if not profile.can_view_profile(request.user):
         return HttpResponseForbidden(_("You don't have permission to view this profile."))
     if not extra_context: extra_context = dict()
-    extra_context['profile'] = user.get_profile()
+    extra_context['profile'] = profile
     return direct_to_template(request,
                               template_name,
                               extra_context=extra_context,
@@ -645,9 +641,9 @@ def profile_list(request, page=1, template_name='userena/profile_list.html',
                                    **kwargs)
 
 
-profile_edit_view = secure_required(permission_required_or_403('change_profile', (get_profile_model(), 'user__username', 'username'))(profile_edit))
-password_change_view = secure_required(permission_required_or_403('change_user', (User, 'username', 'username'))(password_change))
-email_change_view = secure_required(permission_required_or_403('change_user', (User, 'username', 'username'))(email_change))
+profile_edit_view = secure_required(permission_required_or_403('change_profile', profile=True)(profile_edit))
+password_change_view = secure_required(permission_required_or_403('change_user')(password_change))
+email_change_view = secure_required(permission_required_or_403('change_user')(email_change))
 signin_view = secure_required(signin)
 email_confirm_view = secure_required(email_confirm)
 signup_view = secure_required(signup)